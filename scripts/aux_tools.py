@@ -6,6 +6,7 @@ import re
 import pandas as pd
 import scripts.google_drive_file_finder as google_find
 from scripts.load_config import load_config
+from scripts.name_reconciliation import drive_candidates, local_candidates, reconcile_names, save_mapping
 
 def sanitize_filename(filename):
     """Sanitize the filename by removing or replacing problematic characters."""
@@ -53,6 +54,32 @@ def full_file_name_check(excel_file_path, doc_txt_dir_path):
 
     return missing_files
 
+def reconcile_missing_files(excel_file_path, dir_paths, mapping_path, drive_files=None, top_k=5, min_score=0.75,
+                            min_margin=0.05):
+    """
+    Resolves the Excel 'File Name' values that have no exact match in the given
+    directories (and Drive listing) to ranked fuzzy candidates, and saves the mapping.
+
+    Args:
+        excel_file_path (str): Excel file with a 'File Name' column.
+        dir_paths (list): Local directories holding the downloaded or converted files.
+        mapping_path (str): Where to write the mapping JSON read by steps 2 and 3.
+        drive_files (list): Optional Drive listing from google_find.list_drive_files.
+        top_k (int): Number of candidates to keep per missing name.
+        min_score (float): Similarity needed to accept the best candidate.
+        min_margin (float): Lead the best candidate needs over the runner-up; names with
+            two near-identical candidates stay unresolved.
+
+    Returns:
+        dict: The reconcile_names result (mapping, candidates, unresolved).
+    """
+    df = excel_2_dataframe(excel_file_path)
+    candidates = local_candidates(dir_paths) + drive_candidates(drive_files or [])
+    result = reconcile_names(df['File Name'].dropna().tolist(), candidates, top_k=top_k, min_score=min_score,
+                             min_margin=min_margin)
+    save_mapping(result, mapping_path)
+    return result
+
 def current_missing_files():
     excel_file_path = './datasets/AI Training_Install Reports.xlsx'
     doc_txt_dif_path= './datasets/Endeavor_ESP_reports_txt'
@@ -0,0 +1,270 @@
+## checkpointing.py
+
+import copy
+import os
+import random
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from safetensors.torch import save_file
+from transformers import TrainerCallback
+from transformers.trainer_utils import get_last_checkpoint
+
+# File names the Trainer looks for when resuming, so resume_from_checkpoint works unchanged
+MODEL_FILE = "model.safetensors"
+ADAPTER_FILE = "adapter_model.safetensors"
+OPTIMIZER_FILE = "optimizer.pt"
+SCHEDULER_FILE = "scheduler.pt"
+RNG_FILE = "rng_state.pth"
+TRAINER_STATE_FILE = "trainer_state.json"
+OPTIMIZER_SHARD_PATTERN = re.compile(r"^optimizer-(\d+)-of-(\d+)\.pt$")
+
+
+def _clone_to_cpu(value):
+    """
+    Recursively copies every tensor in a (nested) state dict to CPU memory so training can
+    keep updating the originals while the copy is written.
+    """
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: _clone_to_cpu(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_clone_to_cpu(item) for item in value)
+    return copy.deepcopy(value)
+
+
+def _model_weights(model):
+    """
+    Returns (file name, CPU state dict) for the trainable model. Peft models only save
+    their adapter; tied weights (e.g. T5's shared embeddings) are stored once.
+    """
+    if hasattr(model, "peft_config"):
+        from peft import get_peft_model_state_dict
+        return ADAPTER_FILE, _clone_to_cpu(get_peft_model_state_dict(model))
+
+    state_dict = {}
+    seen = set()
+    for name, tensor in model.state_dict().items():
+        key = (tensor.data_ptr(), tuple(tensor.shape))
+        if key in seen:
+            continue
+        seen.add(key)
+        state_dict[name] = tensor.detach().to("cpu", copy=True).contiguous()
+    return MODEL_FILE, state_dict
+
+
+def _rng_state():
+    """Collects the RNG states in the format the Trainer restores on resume."""
+    rng_states = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "cpu": torch.random.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        rng_states["cuda"] = torch.cuda.random.get_rng_state()
+    return rng_states
+
+
+def _shard_optimizer_state(optimizer_state, num_shards):
+    """
+    Splits an optimizer state dict into shards of roughly equal byte size. The first shard
+    also carries the param groups.
+    """
+    shards = [{"state": {}} for _ in range(num_shards)]
+    shard_bytes = [0] * num_shards
+    by_size = sorted(
+        optimizer_state["state"].items(),
+        key=lambda item: sum(t.numel() * t.element_size() for t in item[1].values() if isinstance(t, torch.Tensor)),
+        reverse=True,
+    )
+    for param_id, param_state in by_size:
+        target = shard_bytes.index(min(shard_bytes))
+        shards[target]["state"][param_id] = param_state
+        shard_bytes[target] += sum(
+            t.numel() * t.element_size() for t in param_state.values() if isinstance(t, torch.Tensor)
+        )
+    shards[0]["param_groups"] = optimizer_state["param_groups"]
+    return shards
+
+
+def consolidate_optimizer_shards(checkpoint_dir):
+    """
+    Merges sharded optimizer state back into the optimizer.pt file the Trainer loads on
+    resume. Does nothing when the checkpoint has no shards.
+
+    Args:
+        checkpoint_dir (str): Checkpoint folder.
+
+    Returns:
+        bool: True if shards were merged.
+    """
+    shard_files = sorted(name for name in os.listdir(checkpoint_dir) if OPTIMIZER_SHARD_PATTERN.match(name))
+    if not shard_files or os.path.exists(os.path.join(checkpoint_dir, OPTIMIZER_FILE)):
+        return False
+
+    optimizer_state = {"state": {}}
+    for shard_file in shard_files:
+        shard = torch.load(os.path.join(checkpoint_dir, shard_file), weights_only=False)
+        optimizer_state["state"].update(shard["state"])
+        if "param_groups" in shard:
+            optimizer_state["param_groups"] = shard["param_groups"]
+    torch.save(optimizer_state, os.path.join(checkpoint_dir, OPTIMIZER_FILE))
+    return True
+
+
+def resolve_resume_checkpoint(resume_from_checkpoint, output_dir):
+    """
+    Turns the resume_from_checkpoint setting into a checkpoint folder ready for the Trainer.
+
+    Args:
+        resume_from_checkpoint (str): None, "latest" or a checkpoint folder.
+        output_dir (str): Folder the checkpoints were written to.
+
+    Returns:
+        str: Checkpoint folder, or None to start from scratch.
+    """
+    if not resume_from_checkpoint:
+        return None
+    if resume_from_checkpoint == "latest":
+        if not os.path.isdir(output_dir):
+            return None
+        resume_from_checkpoint = get_last_checkpoint(output_dir)
+        if resume_from_checkpoint is None:
+            return None
+    consolidate_optimizer_shards(resume_from_checkpoint)
+    print(f"Resuming from checkpoint {resume_from_checkpoint}")
+    return resume_from_checkpoint
+
+
+class AsyncCheckpointCallback(TrainerCallback):
+    """
+    Writes checkpoints from a background thread instead of blocking the training loop.
+
+    At a save point the weights, optimizer state and RNG state are copied to CPU memory
+    (the only part training waits for) and a writer thread serializes them: weights as
+    safetensors, optimizer state in full, in shards or not at all. The folder layout
+    matches the Trainer's own checkpoints, so resume_from_checkpoint restores the run
+    exactly as long as the optimizer state is kept. Use with save_strategy="no".
+
+    Args:
+        output_dir (str): Folder that receives the checkpoint-<step> folders.
+        save_steps (int): Save every this many optimizer steps (None to disable).
+        save_every_minutes (float): Also save when this much time has passed since the last
+            save (None to disable).
+        optimizer_state (str): "full", "sharded" or "none". Without optimizer state the
+            checkpoints are much smaller but a resumed run restarts the optimizer.
+        optimizer_shards (int): Number of optimizer shard files when sharded; shards are
+            written in parallel, which helps on network volumes.
+        save_total_limit (int): Number of checkpoints to keep (None keeps all).
+    """
+
+    def __init__(self, output_dir, save_steps=500, save_every_minutes=None, optimizer_state="full",
+                 optimizer_shards=4, save_total_limit=3):
+        if optimizer_state not in ("full", "sharded", "none"):
+            raise ValueError(f"Unknown optimizer_state: {optimizer_state}")
+        self.output_dir = output_dir
+        self.save_steps = save_steps
+        self.save_every_minutes = save_every_minutes
+        self.optimizer_state = optimizer_state
+        self.optimizer_shards = optimizer_shards
+        self.save_total_limit = save_total_limit
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self.pending = None
+        self.last_save_time = time.monotonic()
+
+    def _should_save(self, state):
+        if self.save_steps and state.global_step % self.save_steps == 0:
+            return True
+        if self.save_every_minutes and time.monotonic() - self.last_save_time >= self.save_every_minutes * 60:
+            return True
+        return False
+
+    def on_step_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if not state.is_world_process_zero or not self._should_save(state):
+            return
+        self.wait()
+
+        # Snapshot everything on the training thread; only this part blocks training
+        snapshot_start = time.monotonic()
+        snapshot = {
+            "step": state.global_step,
+            "weights": _model_weights(model),
+            "config": getattr(model, "peft_config", None) or model.config,
+            "optimizer": _clone_to_cpu(optimizer.state_dict()) if self.optimizer_state != "none" else None,
+            "scheduler": copy.deepcopy(lr_scheduler.state_dict()) if lr_scheduler is not None else None,
+            "rng": _rng_state(),
+            "trainer_state": copy.deepcopy(state),
+        }
+        blocked = time.monotonic() - snapshot_start
+        self.last_save_time = time.monotonic()
+        self.pending = self.writer.submit(self._write, snapshot, blocked)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.wait()
+
+    def wait(self):
+        """Blocks until the checkpoint being written (if any) is on disk; re-raises its errors."""
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def _write(self, snapshot, blocked):
+        write_start = time.monotonic()
+        checkpoint_dir = os.path.join(self.output_dir, f"checkpoint-{snapshot['step']}")
+        tmp_dir = checkpoint_dir + ".tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        weights_file, weights = snapshot["weights"]
+        save_file(weights, os.path.join(tmp_dir, weights_file), metadata={"format": "pt"})
+        config = snapshot["config"]
+        if isinstance(config, dict):
+            # Peft adapter config, keyed by adapter name
+            for adapter_config in config.values():
+                adapter_config.save_pretrained(tmp_dir)
+        else:
+            config.to_json_file(os.path.join(tmp_dir, "config.json"))
+
+        if snapshot["optimizer"] is not None:
+            if self.optimizer_state == "sharded":
+                shards = _shard_optimizer_state(snapshot["optimizer"], self.optimizer_shards)
+                with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+                    list(pool.map(
+                        lambda item: torch.save(
+                            item[1],
+                            os.path.join(tmp_dir, f"optimizer-{item[0] + 1:05d}-of-{len(shards):05d}.pt"),
+                        ),
+                        enumerate(shards),
+                    ))
+            else:
+                torch.save(snapshot["optimizer"], os.path.join(tmp_dir, OPTIMIZER_FILE))
+        if snapshot["scheduler"] is not None:
+            torch.save(snapshot["scheduler"], os.path.join(tmp_dir, SCHEDULER_FILE))
+        torch.save(snapshot["rng"], os.path.join(tmp_dir, RNG_FILE))
+        snapshot["trainer_state"].save_to_json(os.path.join(tmp_dir, TRAINER_STATE_FILE))
+
+        # Publish the checkpoint only once it is complete
+        if os.path.exists(checkpoint_dir):
+            shutil.rmtree(checkpoint_dir)
+        os.replace(tmp_dir, checkpoint_dir)
+        self._rotate_checkpoints()
+        print(
+            f"Checkpoint {checkpoint_dir} written in {time.monotonic() - write_start:.2f}s "
+            f"(training blocked for {blocked:.2f}s)"
+        )
+
+    def _rotate_checkpoints(self):
+        if not self.save_total_limit:
+            return
+        checkpoints = []
+        for name in os.listdir(self.output_dir):
+            match = re.match(r"^checkpoint-(\d+)$", name)
+            if match:
+                checkpoints.append((int(match.group(1)), os.path.join(self.output_dir, name)))
+        for _, path in sorted(checkpoints)[:-self.save_total_limit]:
+            shutil.rmtree(path)
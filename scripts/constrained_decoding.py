@@ -0,0 +1,185 @@
+## constrained_decoding.py
+
+import torch
+from transformers.cache_utils import DynamicCache, EncoderDecoderCache
+from output_schema import OUTPUT_SCHEMA, DEFAULT_MAX_VALUE_TOKENS, DEFAULT_MAX_INSTANCES, entry_keys
+
+
+class _DecodingState:
+    """
+    Incremental decoder for one document. The encoder runs once; every decoder call only
+    processes the new tokens on top of the cached keys and values.
+    """
+
+    def __init__(self, model, input_ids):
+        self.model = model
+        self.input_ids = torch.tensor([input_ids])
+        self.attention_mask = torch.ones_like(self.input_ids)
+        self.encoder_outputs = model.get_encoder()(input_ids=self.input_ids, attention_mask=self.attention_mask)
+        self.past_key_values = EncoderDecoderCache(DynamicCache(), DynamicCache())
+        self.logits = None
+        self.forced_tokens = 0
+        self.generated_tokens = 0
+        self.feed([model.config.decoder_start_token_id])
+
+    def feed(self, token_ids):
+        outputs = self.model(
+            encoder_outputs=self.encoder_outputs,
+            attention_mask=self.attention_mask,
+            decoder_input_ids=torch.tensor([token_ids]),
+            past_key_values=self.past_key_values,
+            use_cache=True,
+        )
+        self.past_key_values = outputs.past_key_values
+        self.logits = outputs.logits[0, -1]
+
+
+class ConstrainedExtractor:
+    """
+    Generates the extraction output by walking OUTPUT_SCHEMA instead of letting the model
+    write the whole JSON.
+
+    Key names, braces, brackets and separators are fed to the decoder as forced tokens, so
+    the model only generates the field values. Each value stops at its closing quote, at
+    null/NaN, or at the field's max_tokens. Instance lists continue or close depending on
+    which of the two structural continuations the model scores higher. The result is
+    assembled as a Python dict, so it always serializes to valid JSON.
+
+    Args:
+        model: Fine-tuned seq2seq model.
+        tokenizer: Matching tokenizer.
+        schema (list): Output schema, see output_schema.py.
+    """
+
+    def __init__(self, model, tokenizer, schema=OUTPUT_SCHEMA):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.schema = schema
+        self.chunk_ids = {}
+
+    def _ids(self, text):
+        # Structural chunks repeat for every document, so their token ids are cached
+        if text not in self.chunk_ids:
+            self.chunk_ids[text] = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+        return self.chunk_ids[text]
+
+    def _force(self, state, text):
+        token_ids = self._ids(text)
+        if token_ids:
+            state.feed(token_ids)
+            state.forced_tokens += len(token_ids)
+
+    def _choose(self, state, options):
+        """
+        Feeds whichever structural option the model scores highest and returns its index.
+        Tokens shared by all options are fed first so the options are compared at the
+        first token where they differ.
+        """
+        option_ids = [self._ids(option) for option in options]
+        common = 0
+        while all(len(ids) > common for ids in option_ids) and len({ids[common] for ids in option_ids}) == 1:
+            common += 1
+        if common:
+            state.feed(option_ids[0][:common])
+
+        scores = [state.logits[ids[common]].item() if len(ids) > common else float("-inf") for ids in option_ids]
+        best = scores.index(max(scores))
+        remaining = option_ids[best][common:]
+        if remaining:
+            state.feed(remaining)
+        state.forced_tokens += len(option_ids[best])
+        return best
+
+    def _decode_value(self, state, max_tokens):
+        """
+        Greedily generates one value; returns the string or None for null/NaN.
+        """
+        value_ids = []
+        text = ""
+        for _ in range(max_tokens):
+            token_id = int(state.logits.argmax())
+            if token_id == self.tokenizer.eos_token_id:
+                break
+            value_ids.append(token_id)
+            state.feed([token_id])
+            state.generated_tokens += 1
+
+            text = self.tokenizer.decode(value_ids, skip_special_tokens=True).strip()
+            if text.lower().startswith(("null", "nan")):
+                return None
+            if text.startswith('"'):
+                closing = text.find('"', 1)
+                if closing != -1:
+                    return text[1:closing].strip()
+            else:
+                # Unquoted values end at the next separator
+                for index, char in enumerate(text):
+                    if char in ",}]":
+                        return text[:index].strip() or None
+
+        text = text.strip('"').strip()
+        return text or None
+
+    def _decode_fields(self, state, keys, max_tokens, lead):
+        values = {}
+        for index, key in enumerate(keys):
+            self._force(state, f'{lead if index == 0 else ", "}"{key}": ')
+            values[key] = self._decode_value(state, max_tokens)
+        return values
+
+    def extract(self, input_ids):
+        """
+        Extracts the output dict for one tokenized document.
+
+        Args:
+            input_ids (list): Token ids of the model input (instruction and report text).
+
+        Returns:
+            tuple: (output dict, {"generated_tokens": ..., "forced_tokens": ...})
+        """
+        output = {}
+        # The encoder pass and first decoder step run in here too, so the encoder outputs
+        # kept for the whole document hold no autograd graph
+        with torch.inference_mode():
+            state = _DecodingState(self.model, input_ids)
+            for index, entry in enumerate(self.schema):
+                key_text = f'{"{" if index == 0 else ", "}"{entry["key"]}": '
+                max_tokens = entry.get("max_tokens", DEFAULT_MAX_VALUE_TOKENS)
+
+                if entry["kind"] == "value":
+                    self._force(state, key_text)
+                    output[entry["key"]] = self._decode_value(state, max_tokens)
+                elif entry["kind"] == "group":
+                    output[entry["key"]] = self._decode_fields(state, entry_keys(entry), max_tokens, key_text + "{")
+                    self._force(state, "}")
+                elif entry["kind"] == "record":
+                    output[entry["key"]] = [
+                        self._decode_fields(state, entry_keys(entry), max_tokens, key_text + "[{")
+                    ]
+                    self._force(state, "}]")
+                else:
+                    output[entry["key"]] = self._decode_instances(state, entry, key_text, max_tokens)
+
+        return output, {"generated_tokens": state.generated_tokens, "forced_tokens": state.forced_tokens}
+
+    def _decode_instances(self, state, entry, key_text, max_tokens):
+        keys = entry_keys(entry)
+        first_key = f'"{keys[0]}": '
+        self._force(state, key_text + "[")
+
+        instances = []
+        for index in range(entry.get("max_instances", DEFAULT_MAX_INSTANCES)):
+            opener = "{" if index == 0 else ", {"
+            if self._choose(state, ["]", opener + first_key]) == 0:
+                return instances
+            instance = {keys[0]: self._decode_value(state, max_tokens)}
+            if len(keys) > 1:
+                instance.update(self._decode_fields(state, keys[1:], max_tokens, ", "))
+            self._force(state, "}")
+            # Early stop: an all-null instance means the model has run out of entries
+            if all(value is None for value in instance.values()):
+                break
+            instances.append(instance)
+
+        self._force(state, "]")
+        return instances
@@ -0,0 +1,202 @@
+## content_dedupe.py
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+# Local hashes use MD5 so they compare directly with Drive's md5Checksum
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_INDEX_FILE = ".content_hashes.json"
+
+
+def file_content_hash(file_path):
+    """
+    Returns the hex MD5 of a file's content, read in chunks.
+    """
+    digest = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalHashIndex:
+    """
+    Content hashes of the files in a directory, kept in a small JSON file next to them
+    so unchanged files (same size and modification time) are not hashed again.
+
+    Args:
+        directory (str): Directory with the downloaded reports.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, HASH_INDEX_FILE)
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as index_file:
+                self.entries = json.load(index_file)
+
+    def hash(self, file_name):
+        """
+        Returns the content hash of a file in the directory, or None if it does not exist.
+        """
+        file_path = os.path.join(self.directory, file_name)
+        if not os.path.isfile(file_path):
+            return None
+        stat = os.stat(file_path)
+        entry = self.entries.get(file_name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["md5"]
+        md5 = file_content_hash(file_path)
+        self.entries[file_name] = {"md5": md5, "size": stat.st_size, "mtime": stat.st_mtime}
+        self.changed = True
+        return md5
+
+    def by_hash(self):
+        """
+        Hashes every file in the directory and returns {md5: [file names]}.
+        """
+        groups = {}
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.startswith("."):
+                continue
+            md5 = self.hash(file_name)
+            if md5:
+                groups.setdefault(md5, []).append(file_name)
+        return groups
+
+    def save(self):
+        if self.changed:
+            with open(self.index_path, "w") as index_file:
+                json.dump(self.entries, index_file)
+            self.changed = False
+
+
+def group_drive_files(found_files):
+    """
+    Groups Drive search results by md5Checksum.
+
+    Args:
+        found_files (dict): {file name: Drive item with id, size and md5Checksum}.
+
+    Returns:
+        list: Lists of file names with the same content. Items without a checksum
+        (Google Docs editor files) are never grouped.
+    """
+    groups = {}
+    for file_name, item in found_files.items():
+        key = item.get("md5Checksum") or f"id:{item['id']}"
+        groups.setdefault(key, []).append(file_name)
+    return list(groups.values())
+
+
+def link_or_copy(source, destination):
+    """
+    Makes destination a hard link to source, falling back to a copy where links are
+    not supported (other drive, FAT, some network shares).
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ExtractionCache:
+    """
+    Extracted text stored by content hash, so a report that exists under several names
+    is OCR'd once and every alias reuses the text.
+
+    Args:
+        cache_dir (str): Directory holding one JSON file per content hash.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, content_hash):
+        return os.path.join(self.cache_dir, f"{content_hash}.json")
+
+    def get(self, content_hash):
+        """
+        Returns the cached entry ({"text", "seconds", "file_name"}) or None.
+        """
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as cache_file:
+            return json.load(cache_file)
+
+    def put(self, content_hash, text, seconds, file_name):
+        path = self._path(content_hash)
+        with open(f"{path}.tmp", "w") as cache_file:
+            json.dump({"text": text, "seconds": seconds, "file_name": file_name}, cache_file)
+        os.replace(f"{path}.tmp", path)
+
+
+class DedupeStats:
+    """
+    Counts what content deduplication saved in one pipeline step.
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.files = 0
+        self.unique_contents = set()
+        self.aliases = {}
+        self.cache_hits = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+
+    def add_alias(self, canonical, alias, size=0, seconds=0.0):
+        self.aliases.setdefault(canonical, []).append(alias)
+        self.bytes_saved += int(size or 0)
+        self.seconds_saved += float(seconds or 0.0)
+
+    def add_cache_hit(self, seconds=0.0):
+        # Same file as an earlier run; counted as saved time but not as a duplicate
+        self.cache_hits += 1
+        self.seconds_saved += float(seconds or 0.0)
+
+    def summary(self):
+        return {
+            "files": self.files,
+            "unique_contents": len(self.unique_contents),
+            "duplicates": sum(len(aliases) for aliases in self.aliases.values()),
+            "cache_hits": self.cache_hits,
+            "bytes_saved": self.bytes_saved,
+            "seconds_saved": round(self.seconds_saved, 2),
+            "aliases": self.aliases,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+def save_dedupe_report(stats, report_path):
+    """
+    Writes the summary of one step into the dedupe report, keeping the other steps'
+    sections, and prints the savings.
+    """
+    report = {}
+    if os.path.exists(report_path):
+        with open(report_path, "r") as report_file:
+            report = json.load(report_file)
+    summary = stats.summary()
+    report[stats.step] = summary
+
+    report_dir = os.path.dirname(report_path)
+    if report_dir:
+        os.makedirs(report_dir, exist_ok=True)
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(
+        f"{stats.step}: {summary['files']} files, {summary['unique_contents']} unique, "
+        f"{summary['duplicates']} duplicates; saved {summary['bytes_saved'] / 1e6:.1f} MB "
+        f"and {summary['seconds_saved']:.1f} s. Report at {report_path}"
+    )
+    return report
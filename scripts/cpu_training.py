@@ -0,0 +1,159 @@
+## cpu_training.py
+
+import math
+import os
+import psutil
+import torch
+
+
+def cpu_supports_bf16():
+    """
+    Checks whether the CPU has native bf16 support (AVX512-BF16 or AMX), which is what
+    makes bf16 autocast faster than fp32 instead of slower.
+    """
+    checks = [
+        getattr(torch.cpu, "_is_avx512_bf16_supported", None),
+        getattr(torch.cpu, "_is_amx_tile_supported", None),
+    ]
+    return any(check() for check in checks if check is not None)
+
+
+def configure_cpu_threads(intra_op_threads=None, inter_op_threads=None):
+    """
+    Sets the PyTorch intra-op and inter-op thread pools.
+
+    Args:
+        intra_op_threads (int): Threads used inside one op (matmuls, ...). Defaults to the
+            number of physical cores, since hyper-threads slow down dense math.
+        inter_op_threads (int): Threads used to run independent ops in parallel.
+
+    Returns:
+        tuple: The (intra_op_threads, inter_op_threads) in effect.
+    """
+    if intra_op_threads is None:
+        intra_op_threads = psutil.cpu_count(logical=False) or os.cpu_count()
+    torch.set_num_threads(intra_op_threads)
+
+    if inter_op_threads is not None:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Can only be set once, before any inter-op parallel work has started
+            print(f"Could not set inter-op threads: {e}")
+
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def estimate_memory_per_sample(model_config, max_input_length, max_output_length, bytes_per_value=4):
+    """
+    Rough estimate of the activation memory one training sample needs in a T5-style
+    encoder-decoder (about 34 values per token per hidden unit plus 5 per attention
+    score, per layer).
+
+    Returns:
+        int: Estimated bytes per sample.
+    """
+    hidden = model_config.d_model
+    heads = model_config.num_heads
+    encoder_layers = model_config.num_layers
+    decoder_layers = getattr(model_config, "num_decoder_layers", None) or encoder_layers
+
+    encoder = encoder_layers * (34 * max_input_length * hidden + 5 * heads * max_input_length ** 2)
+    decoder = decoder_layers * (
+        34 * max_output_length * hidden
+        + 5 * heads * max_output_length ** 2
+        + 5 * heads * max_output_length * max_input_length
+    )
+    return (encoder + decoder) * bytes_per_value
+
+
+def cpu_training_arguments(cpu_profile, model, batch_size, max_input_length, max_output_length):
+    """
+    Builds the Seq2SeqTrainingArguments settings for training on CPU.
+
+    The per-step batch is the largest one (up to batch_size) that fits the memory budget
+    next to the weights, gradients and Adam state, and gradient accumulation makes up
+    the rest of the target effective batch size.
+
+    Args:
+        cpu_profile (dict): The "cpu_profile" section of the fine_tune config.
+        model: Model to be trained.
+        batch_size (int): Largest per-step batch size to use.
+        max_input_length (int): Maximum input length, used for the memory estimate.
+        max_output_length (int): Maximum target length, used for the memory estimate.
+
+    Returns:
+        dict: Keyword arguments for Seq2SeqTrainingArguments.
+    """
+    bf16 = cpu_profile.get("bf16", "auto")
+    if bf16 == "auto":
+        bf16 = cpu_supports_bf16()
+
+    effective_batch_size = cpu_profile.get("effective_batch_size", batch_size)
+    memory_budget_gb = cpu_profile.get("memory_budget_gb")
+
+    micro_batch_size = batch_size
+    if memory_budget_gb is not None:
+        trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+        total = sum(p.numel() for p in model.parameters())
+        # fp32 weights, plus gradients and two Adam moments for the trainable weights
+        static_bytes = total * 4 + trainable * 12
+        # Autocast keeps the saved activations in bf16
+        per_sample = estimate_memory_per_sample(
+            model.config, max_input_length, max_output_length, bytes_per_value=2 if bf16 else 4
+        )
+        available = memory_budget_gb * 1024 ** 3 - static_bytes
+        micro_batch_size = max(1, min(batch_size, int(available // per_sample)))
+    gradient_accumulation_steps = max(1, math.ceil(effective_batch_size / micro_batch_size))
+
+    dataloader_num_workers = cpu_profile.get("dataloader_num_workers", 2)
+    print(
+        f"CPU profile: bf16={bf16}, batch size {micro_batch_size} x {gradient_accumulation_steps} "
+        f"accumulation steps, {dataloader_num_workers} dataloader workers"
+    )
+
+    return {
+        "use_cpu": True,
+        "bf16": bf16,
+        "fp16": False,
+        "torch_compile": cpu_profile.get("torch_compile", False),
+        "per_device_train_batch_size": micro_batch_size,
+        "per_device_eval_batch_size": micro_batch_size,
+        "gradient_accumulation_steps": gradient_accumulation_steps,
+        "dataloader_num_workers": dataloader_num_workers,
+        "dataloader_persistent_workers": dataloader_num_workers > 0,
+        "dataloader_pin_memory": False,
+    }
+
+
+def benchmark_cpu_profile(config, max_steps=20):
+    """
+    Trains for a fixed number of steps with the default profile and with the CPU profile
+    and prints the training throughput of each in samples per second.
+
+    Args:
+        config (dict): Pipeline configuration.
+        max_steps (int): Optimizer steps to run per profile.
+
+    Returns:
+        dict: Samples per second per profile.
+    """
+    from script4_finetune_model import build_trainer
+
+    results = {}
+    for profile in ("default", "cpu"):
+        profile_config = dict(config, fine_tune=dict(config["fine_tune"], profile=profile))
+        trainer = build_trainer(
+            profile_config, max_steps=max_steps, evaluation_strategy="no", save_strategy="no", report_to=[]
+        )
+        metrics = trainer.train().metrics
+        results[profile] = metrics["train_samples_per_second"]
+        print(f"{profile} profile: {results[profile]:.2f} samples/s")
+    return results
+
+
+if __name__ == "__main__":
+    from load_config import load_config
+
+    config = load_config("../configs/config.json")
+    benchmark_cpu_profile(config)
@@ -0,0 +1,360 @@
+## distillation.py
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import torch
+import torch.nn.functional as F
+from datasets import load_from_disk
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, Seq2SeqTrainer, Seq2SeqTrainingArguments, DataCollatorForSeq2Seq
+from evaluation import checkpoint_id, compare_checkpoints, load_evaluation_records
+from finetune_preprocess import build_tokenized_datasets
+from inference_utils import load_model, run_batch_inference, percentile
+
+# Bump this whenever the soft target format changes so stale caches are not reused
+SOFT_TARGETS_VERSION = 1
+TEACHER_COLUMNS = ("teacher_top_ids", "teacher_top_logits")
+
+
+class DistillationError(Exception):
+    """Raised when the teacher and student cannot be distilled into one another."""
+
+
+def soft_targets_key(teacher_dir, train_dataset, top_k):
+    """
+    Identifies the soft targets of a teacher checkpoint on a tokenized training split.
+    """
+    key = {
+        "version": SOFT_TARGETS_VERSION,
+        "teacher": checkpoint_id(teacher_dir),
+        # load_from_disk restores the fingerprint of the cached tokenized split
+        "dataset": train_dataset._fingerprint,
+        "top_k": top_k,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def teacher_top_logits(examples, model, collator, top_k):
+    """
+    Runs the teacher over a batch of tokenized examples, fed the reference output
+    (teacher forcing), and keeps the top_k logits of every target position.
+
+    The logits are stored before any temperature is applied, so the temperature can be
+    changed without regenerating the soft targets.
+    """
+    features = [
+        {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+        for input_ids, attention_mask, labels in zip(examples["input_ids"], examples["attention_mask"], examples["labels"])
+    ]
+    batch = {name: tensor.to(model.device) for name, tensor in collator(features).items()}
+    with torch.inference_mode():
+        logits = model(**batch).logits
+    top_logits, top_ids = logits.float().topk(top_k, dim=-1)
+
+    lengths = [len(labels) for labels in examples["labels"]]
+    return {
+        "teacher_top_ids": [ids[:length].tolist() for ids, length in zip(top_ids.cpu(), lengths)],
+        "teacher_top_logits": [values[:length].tolist() for values, length in zip(top_logits.cpu(), lengths)],
+    }
+
+
+def build_soft_targets(config, teacher_dir, tokenizer, train_dataset):
+    """
+    Returns the training split with the teacher's top-k logits per target token added,
+    running the teacher only when no cached copy exists.
+
+    Args:
+        config (dict): Pipeline configuration. Uses the "distill" section.
+        teacher_dir (str): Folder written by fine_tune_model.
+        tokenizer: Tokenizer shared by teacher and student.
+        train_dataset (Dataset): Tokenized training split (see build_tokenized_datasets).
+
+    Returns:
+        Dataset: train_dataset with "teacher_top_ids" and "teacher_top_logits" columns.
+    """
+    distill_config = config["distill"]
+    top_k = distill_config.get("top_k", 16)
+    cache_dir = distill_config.get("soft_targets_dir", "../datasets/soft_targets")
+    cache_key = soft_targets_key(teacher_dir, train_dataset, top_k)
+    cache_path = os.path.join(cache_dir, cache_key[:16])
+
+    if os.path.exists(cache_path):
+        print(f"Loading cached soft targets from {cache_path}")
+        return load_from_disk(cache_path)
+
+    print(f"Generating top-{top_k} soft targets with the teacher at {teacher_dir}...")
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher = AutoModelForSeq2SeqLM.from_pretrained(teacher_dir).to(device)
+    teacher.eval()
+    dataset = train_dataset.map(
+        teacher_top_logits,
+        batched=True,
+        batch_size=distill_config.get("teacher_batch_size", 4),
+        fn_kwargs={"model": teacher, "collator": DataCollatorForSeq2Seq(tokenizer, model=teacher), "top_k": top_k},
+        # The key already identifies the teacher and the split; hashing the model is slow
+        new_fingerprint=cache_key,
+    )
+
+    # Write to a temporary folder first so an interrupted run never leaves a half-written cache
+    tmp_path = cache_path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    dataset.save_to_disk(tmp_path)
+    os.replace(tmp_path, cache_path)
+    print(f"Soft targets cached at {cache_path}")
+    return load_from_disk(cache_path)
+
+
+class DistillationCollator:
+    """
+    Pads a batch like DataCollatorForSeq2Seq and pads the teacher's top-k ids and logits
+    to the label length. Examples without soft targets (the evaluation split) give a
+    batch without them.
+    """
+
+    def __init__(self, tokenizer, model=None):
+        self.seq2seq_collator = DataCollatorForSeq2Seq(tokenizer, model=model)
+
+    def __call__(self, features):
+        teacher = [{name: feature.pop(name) for name in TEACHER_COLUMNS if name in feature} for feature in features]
+        batch = self.seq2seq_collator(features)
+        if not all(teacher):
+            return batch
+
+        label_length = batch["labels"].shape[1]
+        top_k = len(teacher[0]["teacher_top_ids"][0])
+        top_ids = torch.zeros((len(features), label_length, top_k), dtype=torch.long)
+        top_logits = torch.zeros((len(features), label_length, top_k), dtype=torch.float)
+        for row, targets in enumerate(teacher):
+            length = len(targets["teacher_top_ids"])
+            top_ids[row, :length] = torch.tensor(targets["teacher_top_ids"], dtype=torch.long)
+            top_logits[row, :length] = torch.tensor(targets["teacher_top_logits"], dtype=torch.float)
+        batch["teacher_top_ids"] = top_ids
+        batch["teacher_top_logits"] = top_logits
+        return batch
+
+
+class DistillationTrainer(Seq2SeqTrainer):
+    """
+    Seq2SeqTrainer whose loss mixes the label cross-entropy with the KL divergence from
+    the teacher's softened distribution:
+
+        alpha * CE + (1 - alpha) * T^2 * KL(teacher_T || student_T)
+
+    The teacher distribution is restricted to its top-k tokens, so the student's
+    probabilities are gathered at those ids. T^2 keeps the gradient scale of the KD term
+    independent of the temperature.
+
+    Args:
+        alpha (float): Weight of the label loss.
+        temperature (float): Softmax temperature of both distributions in the KD term.
+    """
+
+    def __init__(self, *args, alpha=0.5, temperature=2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        top_ids = inputs.pop("teacher_top_ids", None)
+        top_logits = inputs.pop("teacher_top_logits", None)
+        outputs = model(**inputs)
+        loss = outputs.loss
+        if top_ids is not None:
+            mask = inputs["labels"] != -100
+            teacher_log_probs = F.log_softmax(top_logits / self.temperature, dim=-1)
+            student_log_probs = F.log_softmax(outputs.logits / self.temperature, dim=-1).gather(-1, top_ids)
+            kl = (teacher_log_probs.exp() * (teacher_log_probs - student_log_probs)).sum(-1)
+            kd_loss = kl[mask].mean() * self.temperature ** 2
+            loss = self.alpha * loss + (1 - self.alpha) * kd_loss
+        return (loss, outputs) if return_outputs else loss
+
+
+def measure_latency(model_dir, records, settings):
+    """
+    Runs the same documents through a model the way script5 serves them.
+
+    Returns:
+        dict: Documents per second and p50/p95 latency in seconds.
+    """
+    model, tokenizer = load_model(model_dir, quantize=settings["quantize"])
+    start = time.perf_counter()
+    predictions = list(run_batch_inference(
+        model,
+        tokenizer,
+        records,
+        batch_size=settings["batch_size"],
+        max_input_length=settings["max_input_length"],
+        max_new_tokens=settings["max_new_tokens"],
+        decoding=settings["decoding"],
+    ))
+    elapsed = time.perf_counter() - start
+    latencies = [prediction["latency_s"] for prediction in predictions]
+    return {
+        "docs_per_s": len(latencies) / elapsed,
+        "p50_latency_s": percentile(latencies, 0.50),
+        "p95_latency_s": percentile(latencies, 0.95),
+    }
+
+
+def compare_teacher_student(config, teacher_dir, student_dir):
+    """
+    Scores teacher and student field by field on the evaluation split (see
+    evaluation.compare_checkpoints) and times both on the same documents, so accuracy
+    can be traded for throughput knowingly.
+
+    Args:
+        config (dict): Pipeline configuration. Uses the "distill", "inference" and
+            "evaluation" sections.
+        teacher_dir (str): Folder written by fine_tune_model.
+        student_dir (str): Folder written by distill_model.
+
+    Returns:
+        dict: Per model its parameters, accuracy and latency, plus the student's speedup
+            and accuracy change.
+    """
+    distill_config = config["distill"]
+    inference_config = config.get("inference", {})
+    accuracy = compare_checkpoints(config, [teacher_dir, student_dir])
+
+    records = load_evaluation_records(config, config.get("evaluation", {}).get("split", "test"))
+    records = records[:distill_config.get("latency_documents", 32)]
+    settings = {
+        "quantize": inference_config.get("quantize"),
+        "decoding": inference_config.get("decoding", "free"),
+        "max_input_length": inference_config.get("max_input_length", 512),
+        "max_new_tokens": inference_config.get("max_new_tokens", 512),
+        "batch_size": inference_config.get("batch_size", 8),
+    }
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "latency_documents": len(records), "settings": settings}
+    for name, model_dir, evaluation in zip(("teacher", "student"), (teacher_dir, student_dir), accuracy):
+        parameters = AutoModelForSeq2SeqLM.from_pretrained(model_dir).num_parameters()
+        report[name] = {
+            "model_dir": model_dir,
+            "parameters": parameters,
+            "parse_rate": evaluation["parse_rate"],
+            "overall": evaluation["overall"],
+            "fields": evaluation["fields"],
+            **measure_latency(model_dir, records, settings),
+        }
+    teacher, student = report["teacher"], report["student"]
+    report["speedup"] = student["docs_per_s"] / teacher["docs_per_s"]
+    report["normalized_accuracy_change"] = student["overall"]["normalized"] - teacher["overall"]["normalized"]
+
+    for name in ("teacher", "student"):
+        print(
+            f"{name}: {report[name]['parameters'] / 1e6:.1f}M parameters, "
+            f"{report[name]['overall']['normalized']:.1%} fields correct, "
+            f"{report[name]['docs_per_s']:.2f} docs/s, p50 {report[name]['p50_latency_s']:.3f}s, "
+            f"p95 {report[name]['p95_latency_s']:.3f}s"
+        )
+    print(f"Student: {report['speedup']:.1f}x the throughput, {report['normalized_accuracy_change']:+.1%} field accuracy")
+
+    report_path = distill_config.get("report_path")
+    if report_path:
+        if os.path.dirname(report_path):
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Distillation report saved at {report_path}")
+    return report
+
+
+def distill_model(config):
+    """
+    Trains a smaller student on the teacher's soft targets and the labels, saves it and
+    reports teacher vs student accuracy and latency.
+
+    The teacher is the model written by fine_tune_model. Student and teacher must share
+    the tokenizer vocabulary, as all flan-t5 sizes do.
+
+    Args:
+        config (dict): Pipeline configuration. Uses the "distill" and "fine_tune" sections.
+
+    Returns:
+        dict: The teacher vs student report (see compare_teacher_student).
+    """
+    distill_config = config["distill"]
+    teacher_dir = distill_config.get("teacher_dir") or config["fine_tune"]["output_dir"]
+    student_name = distill_config.get("student_model", "google/flan-t5-small")
+    output_dir = distill_config["output_dir"]
+    if not os.path.exists(teacher_dir):
+        raise FileNotFoundError(f"Teacher model not found at {teacher_dir}; run fine_tune_model first")
+
+    tokenizer = AutoTokenizer.from_pretrained(teacher_dir)
+    if AutoTokenizer.from_pretrained(student_name).get_vocab() != tokenizer.get_vocab():
+        raise DistillationError(f"{student_name} does not share the vocabulary of the teacher at {teacher_dir}")
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+    student = AutoModelForSeq2SeqLM.from_pretrained(student_name).to(device)
+
+    if config["fine_tune"].get("dataset_mode", "truncate") == "pack":
+        # Packed rows hold several examples per window; the teacher is run on them unpacked
+        print("Distilling on the unpacked windows of the packed dataset")
+        config = {**config, "fine_tune": {**config["fine_tune"], "dataset_mode": "window"}}
+    dataset = build_tokenized_datasets(config, tokenizer)
+    train_dataset = build_soft_targets(config, teacher_dir, tokenizer, dataset["train"])
+
+    training_args = Seq2SeqTrainingArguments(
+        output_dir=output_dir,
+        evaluation_strategy="epoch",
+        save_strategy="epoch",
+        logging_dir=os.path.join(output_dir, "logs"),
+        learning_rate=distill_config.get("learning_rate", 3e-4),
+        per_device_train_batch_size=distill_config.get("batch_size", 8),
+        per_device_eval_batch_size=distill_config.get("batch_size", 8),
+        num_train_epochs=distill_config.get("num_epochs", 5),
+        fp16=torch.cuda.is_available(),
+        save_total_limit=2,
+        # The soft target columns are not model arguments and must reach the collator
+        remove_unused_columns=False,
+    )
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=dataset["test"],
+        tokenizer=tokenizer,
+        data_collator=DistillationCollator(tokenizer, model=student),
+        alpha=distill_config.get("alpha", 0.5),
+        temperature=distill_config.get("temperature", 2.0),
+    )
+
+    print(f"Distilling {teacher_dir} into {student_name}...")
+    trainer.train()
+
+    print("Saving distilled model...")
+    student.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    print(f"Model saved to {output_dir}")
+
+    return compare_teacher_student(config, teacher_dir, output_dir)
+
+
+def main(config):
+    """
+    Entry point for the distillation step in the pipeline
+    """
+    distill_model(config)
+
+
+if __name__ == "__main__":
+    import argparse
+    from load_config import load_config
+
+    parser = argparse.ArgumentParser(description="Distill the fine-tuned model into a smaller student")
+    parser.add_argument("--report-only", action="store_true", help="Compare an already distilled student with the teacher")
+    args = parser.parse_args()
+
+    config = load_config("../configs/config.json")
+    if args.report_only:
+        compare_teacher_student(
+            config,
+            config["distill"].get("teacher_dir") or config["fine_tune"]["output_dir"],
+            config["distill"]["output_dir"],
+        )
+    else:
+        main(config)
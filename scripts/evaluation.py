@@ -0,0 +1,395 @@
+## evaluation.py
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datasets import Dataset
+from finetune_preprocess import load_finetune_records
+from inference_utils import load_model, build_model_input, run_batch_inference
+from output_schema import OUTPUT_SCHEMA, entry_keys
+from load_config import load_config
+
+# Files whose size and modification time identify a checkpoint's weights
+CHECKPOINT_FILE_PATTERN = re.compile(r"\.(safetensors|bin|json)$")
+NUMBER_PATTERN = re.compile(r"^[-+]?(\d+\.?\d*|\.\d+)$")
+
+
+def checkpoint_id(model_dir):
+    """
+    Identifies a checkpoint by the names, sizes and modification times of its weight and
+    config files, so retraining into the same folder gives a new id without hashing
+    gigabytes of weights.
+    """
+    entries = []
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path) and CHECKPOINT_FILE_PATTERN.search(name):
+            stat = os.stat(path)
+            entries.append([name, stat.st_size, stat.st_mtime_ns])
+    if not entries:
+        raise FileNotFoundError(f"No model files found in {model_dir}")
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    SQLite store of generated predictions keyed by checkpoint id and input hash.
+
+    The input hash covers the model input text and every generation setting, so a cached
+    prediction is only reused for exactly the same request to exactly the same weights.
+    """
+
+    def __init__(self, db_path):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "checkpoint_id TEXT, input_hash TEXT, prediction TEXT, parse_error TEXT, created REAL, "
+            "PRIMARY KEY (checkpoint_id, input_hash))"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def input_hash(record, settings):
+        key = json.dumps({"input": build_model_input(record), "settings": settings}, sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_many(self, checkpoint, input_hashes):
+        """Returns {input_hash: (prediction, parse_error)} for the hashes already cached."""
+        found = {}
+        unique_hashes = list(set(input_hashes))
+        # Stay below SQLite's limit on query parameters
+        for start in range(0, len(unique_hashes), 500):
+            chunk = unique_hashes[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT input_hash, prediction, parse_error FROM generations "
+                f"WHERE checkpoint_id = ? AND input_hash IN ({','.join('?' * len(chunk))})",
+                [checkpoint, *chunk],
+            )
+            for input_hash, prediction, parse_error in rows:
+                found[input_hash] = (json.loads(prediction), parse_error)
+        return found
+
+    def put(self, checkpoint, input_hash, prediction, parse_error):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)",
+            (checkpoint, input_hash, json.dumps(prediction), parse_error, time.time()),
+        )
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def _as_text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    text = str(value).strip()
+    return text if text and text.lower() not in ("nan", "null", "none") else None
+
+
+def _as_number(text):
+    candidate = text.replace(",", "")
+    if NUMBER_PATTERN.match(candidate):
+        return float(candidate)
+    return None
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def score_value(predicted, expected):
+    """
+    Scores one field.
+
+    Returns:
+        tuple: (exact match, normalized match). Exact compares the trimmed text; normalized
+            compares numbers numerically ("1,200" == "1200.0") and other text ignoring case
+            and whitespace. An empty prediction for an empty label counts as a match.
+    """
+    predicted, expected = _as_text(predicted), _as_text(expected)
+    if predicted is None or expected is None:
+        return predicted == expected, predicted == expected
+    if predicted == expected:
+        return True, True
+
+    predicted_number, expected_number = _as_number(predicted), _as_number(expected)
+    if predicted_number is not None and expected_number is not None:
+        return False, math.isclose(predicted_number, expected_number, rel_tol=1e-6, abs_tol=1e-9)
+    return False, _normalize(predicted) == _normalize(expected)
+
+
+def _match_instances(predicted, expected, keys):
+    """
+    Pairs predicted and expected instances greedily by the number of fields that agree.
+
+    Returns:
+        list: (predicted instance or {}, expected instance or {}) pairs; unmatched instances
+            on either side are paired with an empty dict.
+    """
+    candidates = []
+    for p_index, p_item in enumerate(predicted):
+        for e_index, e_item in enumerate(expected):
+            agreement = sum(score_value(p_item.get(key), e_item.get(key))[1] for key in keys)
+            candidates.append((agreement, p_index, e_index))
+
+    pairs = []
+    used_predicted, used_expected = set(), set()
+    for _, p_index, e_index in sorted(candidates, key=lambda candidate: -candidate[0]):
+        if p_index in used_predicted or e_index in used_expected:
+            continue
+        used_predicted.add(p_index)
+        used_expected.add(e_index)
+        pairs.append((predicted[p_index], expected[e_index]))
+
+    pairs.extend((predicted[index], {}) for index in range(len(predicted)) if index not in used_predicted)
+    pairs.extend(({}, expected[index]) for index in range(len(expected)) if index not in used_expected)
+    return pairs
+
+
+def score_document(prediction, label, schema=OUTPUT_SCHEMA):
+    """
+    Scores one prediction against its label, field by field.
+
+    List fields are matched per instance (see _match_instances), and every field of an
+    unmatched instance, whether missing or extra, counts as a miss.
+
+    Args:
+        prediction: Parsed prediction dict; anything else (e.g. unparsable text) scores as
+            an empty prediction.
+        label (dict): The "output" dict of the dataset record.
+        schema (list): Output schema, see output_schema.py.
+
+    Returns:
+        dict: Field name -> [exact hits, normalized hits, compared values].
+    """
+    if not isinstance(prediction, dict):
+        prediction = {}
+    scores = {}
+
+    def add(field, predicted, expected):
+        exact, normalized = score_value(predicted, expected)
+        counts = scores.setdefault(field, [0, 0, 0])
+        counts[0] += exact
+        counts[1] += normalized
+        counts[2] += 1
+
+    for entry in schema:
+        key = entry["key"]
+        predicted, expected = prediction.get(key), label.get(key)
+        if entry["kind"] == "value":
+            add(key, predicted, expected)
+        elif entry["kind"] == "group":
+            predicted = predicted if isinstance(predicted, dict) else {}
+            expected = expected or {}
+            for field in entry_keys(entry):
+                add(f"{key}.{field}", predicted.get(field), expected.get(field))
+        else:
+            keys = entry_keys(entry)
+            predicted = [item for item in predicted if isinstance(item, dict)] if isinstance(predicted, list) else []
+            for predicted_item, expected_item in _match_instances(predicted, expected or [], keys):
+                for field in keys:
+                    add(f"{key}[].{field}", predicted_item.get(field), expected_item.get(field))
+    return scores
+
+
+def aggregate_scores(document_scores):
+    """
+    Sums per-document scores into per-field and overall accuracies.
+    """
+    totals = {}
+    for scores in document_scores:
+        for field, counts in scores.items():
+            field_totals = totals.setdefault(field, [0, 0, 0])
+            for index in range(3):
+                field_totals[index] += counts[index]
+
+    fields = {
+        field: {"exact": exact / count, "normalized": normalized / count, "count": count}
+        for field, (exact, normalized, count) in totals.items() if count
+    }
+    exact, normalized, count = (sum(counts[index] for counts in totals.values()) for index in range(3))
+    overall = {"exact": exact / count if count else 0.0, "normalized": normalized / count if count else 0.0,
+               "count": count}
+    return {"fields": fields, "overall": overall}
+
+
+def load_evaluation_records(config, split="test"):
+    """
+    Loads the labelled records to evaluate on. "test" reproduces the held-out split used
+    during fine-tuning (same seed and test size); "all" uses the whole dataset.
+    """
+    fine_tune_config = config["fine_tune"]
+    records = load_finetune_records(fine_tune_config["dataset_path"])
+    if split == "all":
+        return records
+    dataset = Dataset.from_list(records).train_test_split(
+        test_size=fine_tune_config.get("test_size", 0.1), seed=fine_tune_config.get("seed", 42)
+    )
+    return dataset[split].to_list()
+
+
+def generate_predictions(model_dir, records, cache, settings, tokenizer_dir=None):
+    """
+    Returns a prediction per record, generating only those not yet in the cache.
+
+    Args:
+        model_dir (str): Model or checkpoint folder.
+        records (list): Records with "text" and a "template_id" or inline "instruction".
+        cache (GenerationCache): Generation store.
+        settings (dict): Generation settings (quantize, decoding, lengths, batch_size).
+        tokenizer_dir (str): Tokenizer fallback for checkpoints without one.
+
+    Returns:
+        list: (prediction, parse_error) per record, in record order.
+    """
+    checkpoint = checkpoint_id(model_dir)
+    hash_settings = {key: value for key, value in settings.items() if key != "batch_size"}
+    input_hashes = [GenerationCache.input_hash(record, hash_settings) for record in records]
+    results = cache.get_many(checkpoint, input_hashes)
+
+    missing = [index for index, input_hash in enumerate(input_hashes) if input_hash not in results]
+    print(f"{model_dir}: {len(records) - len(missing)} cached, {len(missing)} to generate")
+    if missing:
+        if os.path.exists(os.path.join(model_dir, "tokenizer_config.json")):
+            tokenizer_dir = None
+        model, tokenizer = load_model(model_dir, quantize=settings["quantize"], tokenizer_dir=tokenizer_dir)
+        for prediction in run_batch_inference(
+            model,
+            tokenizer,
+            [records[index] for index in missing],
+            batch_size=settings["batch_size"],
+            max_input_length=settings["max_input_length"],
+            max_new_tokens=settings["max_new_tokens"],
+            decoding=settings["decoding"],
+            input_mode=settings["input_mode"],
+        ):
+            input_hash = input_hashes[missing[prediction["index"]]]
+            cache.put(checkpoint, input_hash, prediction["prediction"], prediction["parse_error"])
+            results[input_hash] = (prediction["prediction"], prediction["parse_error"])
+        cache.commit()
+
+    return [results[input_hash] for input_hash in input_hashes]
+
+
+def evaluate_checkpoint(config, model_dir, records=None, cache=None):
+    """
+    Scores one model or checkpoint on the evaluation records.
+
+    Generation goes through the cache, and documents are scored in parallel processes.
+
+    Args:
+        config (dict): Pipeline configuration. Uses the "evaluation", "inference" and
+            "fine_tune" sections.
+        model_dir (str): Model or checkpoint folder.
+        records (list): Evaluation records; loaded from the config when None.
+        cache (GenerationCache): Generation store; opened from the config when None.
+
+    Returns:
+        dict: {"model_dir", "documents", "parse_rate", "fields", "overall", "seconds"}.
+    """
+    evaluation_config = config.get("evaluation", {})
+    inference_config = config.get("inference", {})
+    start = time.perf_counter()
+    if records is None:
+        records = load_evaluation_records(config, evaluation_config.get("split", "test"))
+    own_cache = cache is None
+    if own_cache:
+        cache = GenerationCache(evaluation_config.get("cache_path", "../datasets/evaluation_cache.sqlite"))
+
+    settings = {
+        "quantize": evaluation_config.get("quantize", inference_config.get("quantize")),
+        "decoding": evaluation_config.get("decoding", inference_config.get("decoding", "free")),
+        "input_mode": evaluation_config.get("input_mode", inference_config.get("input_mode", "truncate")),
+        "max_input_length": inference_config.get("max_input_length", 512),
+        "max_new_tokens": inference_config.get("max_new_tokens", 512),
+        "batch_size": inference_config.get("batch_size", 8),
+    }
+    try:
+        predictions = generate_predictions(
+            model_dir, records, cache, settings, tokenizer_dir=config["fine_tune"].get("model_name")
+        )
+    finally:
+        if own_cache:
+            cache.close()
+
+    labels = [json.loads(record["output"]) for record in records]
+    num_workers = evaluation_config.get("num_workers", os.cpu_count())
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        document_scores = list(pool.map(
+            score_document,
+            [prediction for prediction, _ in predictions],
+            labels,
+            chunksize=max(1, len(records) // (num_workers * 4)),
+        ))
+
+    report = {
+        "model_dir": model_dir,
+        "documents": len(records),
+        "parse_rate": sum(parse_error is None for _, parse_error in predictions) / max(1, len(predictions)),
+        **aggregate_scores(document_scores),
+        "seconds": time.perf_counter() - start,
+    }
+    return report
+
+
+def compare_checkpoints(config, model_dirs, report_path=None):
+    """
+    Evaluates several checkpoints on the same records and prints per-field accuracy side
+    by side. Checkpoints evaluated before are scored from the cache without generating.
+
+    Args:
+        config (dict): Pipeline configuration.
+        model_dirs (list): Model or checkpoint folders.
+        report_path (str): Optional JSON file for the full reports.
+
+    Returns:
+        list: One report per checkpoint (see evaluate_checkpoint).
+    """
+    evaluation_config = config.get("evaluation", {})
+    records = load_evaluation_records(config, evaluation_config.get("split", "test"))
+    cache = GenerationCache(evaluation_config.get("cache_path", "../datasets/evaluation_cache.sqlite"))
+    try:
+        reports = [evaluate_checkpoint(config, model_dir, records=records, cache=cache) for model_dir in model_dirs]
+    finally:
+        cache.close()
+
+    names = [os.path.basename(os.path.normpath(model_dir)) for model_dir in model_dirs]
+    print(f"\n{'field':<40}" + "".join(f"{name[:18]:>20}" for name in names))
+    fields = sorted({field for report in reports for field in report["fields"]})
+    for field in fields:
+        row = "".join(
+            f"{report['fields'][field]['normalized']:>20.1%}" if field in report["fields"] else f"{'-':>20}"
+            for report in reports
+        )
+        print(f"{field[:39]:<40}{row}")
+    print(f"{'overall (normalized)':<40}" + "".join(f"{report['overall']['normalized']:>20.1%}" for report in reports))
+    print(f"{'overall (exact)':<40}" + "".join(f"{report['overall']['exact']:>20.1%}" for report in reports))
+    print(f"{'valid JSON':<40}" + "".join(f"{report['parse_rate']:>20.1%}" for report in reports))
+    print(f"{'seconds':<40}" + "".join(f"{report['seconds']:>20.1f}" for report in reports))
+
+    if report_path:
+        with open(report_path, "w") as file:
+            json.dump(reports, file, indent=2)
+        print(f"Reports saved at {report_path}")
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Field-level evaluation of fine-tuned checkpoints")
+    parser.add_argument("model_dirs", nargs="+", help="Model or checkpoint folders to compare")
+    parser.add_argument("--report", help="Write the full reports to this JSON file")
+    args = parser.parse_args()
+
+    config = load_config("../configs/config.json")
+    compare_checkpoints(config, args.model_dirs, report_path=args.report)
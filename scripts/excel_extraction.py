@@ -2,13 +2,16 @@
 
 import pandas as pd
 import pytesseract
-from openpyxl import load_workbook
 from PIL import Image
 from io import BytesIO
 import logging_utils
+from text_normalizer import normalize_text
+import posixpath
 import warnings
 import logging
 import re
+import zipfile
+import xml.etree.ElementTree as ET
 
 # Suppress UserWarning from openpyxl mostly related to print areas
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
@@ -22,12 +25,132 @@ pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tessera
 
 # Setup logging
 # logger = logging_utils.setup_logger(f'logs/{__name__}.log')
-logger = logging_utils.setup_logger(f'logs/main_log.log')
+logger = logging_utils.setup_logger(f'logs/main_log.log', name=__name__)
 
 class ExcelExtractionError(Exception):
     """Custom exception for handling Excel extraction errors."""
     pass
 
+SHEET_SCAN_CHUNK = 4 * 1024 * 1024
+# A whole cell element, self-closing or with its children: group 1 holds its attributes,
+# group 2 its children
+CELL_PATTERN = re.compile(rb'<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)', re.DOTALL)
+CELL_START_PATTERN = re.compile(rb'<(?:\w+:)?c\b')
+# A cell holds a value when it has a non-empty cached value or an inline string; cells that
+# only carry formatting (<c r="A1" s="3"/> or <c r="A1" s="3"></c>) or a formula without
+# a cached value read as empty
+CELL_VALUE_PATTERN = re.compile(rb'<(?:\w+:)?(?:v|is)>(?!</)')
+CELL_REF_PATTERN = re.compile(rb'\br=["\']([A-Z]+)([0-9]+)["\']')
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _part_relationships(archive, part_path):
+    """
+    Returns {relationship id: (type, target part path)} of a part in an xlsx archive.
+    """
+    directory, name = posixpath.split(part_path)
+    rels_path = posixpath.join(directory, "_rels", f"{name}.rels")
+    if rels_path not in archive.namelist():
+        return {}
+    relationships = {}
+    for element in ET.fromstring(archive.read(rels_path)):
+        if element.get("TargetMode") == "External":
+            continue
+        target = element.get("Target", "")
+        path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(directory, target))
+        relationships[element.get("Id")] = (element.get("Type", ""), path)
+    return relationships
+
+
+def xlsx_sheet_parts(archive):
+    """
+    Returns [(sheet name, sheet XML part path)] of an xlsx archive in workbook order,
+    read from the workbook part without loading any sheet.
+    """
+    relationships = _part_relationships(archive, "xl/workbook.xml")
+    sheets = []
+    for element in ET.fromstring(archive.read("xl/workbook.xml")).iter():
+        if _local_name(element.tag) != "sheet":
+            continue
+        relationship_id = next((value for key, value in element.attrib.items() if _local_name(key) == "id"), None)
+        if relationship_id in relationships:
+            sheets.append((element.get("name"), relationships[relationship_id][1]))
+    return sheets
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + letter - 64
+    return number
+
+
+def sheet_used_range(archive, sheet_path):
+    """
+    Finds the last row and column that hold a value by streaming the sheet XML, so
+    formatting applied to whole rows or columns (down to row 1,048,576) costs a regex
+    scan instead of a cell object per formatted cell.
+
+    Returns:
+        tuple: (last row, last column), 1-based; None if the sheet has no values, or
+        (None, None) if cell references are missing and the extent is unknown.
+    """
+    last_row = last_column = 0
+    carry = b""
+    with archive.open(sheet_path) as sheet:
+        while True:
+            chunk = sheet.read(SHEET_SCAN_CHUNK)
+            data = carry + chunk
+            last_end = 0
+            for match in CELL_PATTERN.finditer(data):
+                last_end = match.end()
+                if not match.group(2) or not CELL_VALUE_PATTERN.search(match.group(2)):
+                    continue
+                reference = CELL_REF_PATTERN.search(match.group(1))
+                if reference is None:
+                    return None, None
+                last_row = max(last_row, int(reference.group(2)))
+                last_column = max(last_column, _column_number(reference.group(1)))
+            if not chunk:
+                break
+            # A cell or tag cut at the chunk end is scanned with the next chunk
+            open_cell = CELL_START_PATTERN.search(data, last_end)
+            cut = open_cell.start() if open_cell else data.rfind(b"<", last_end)
+            carry = data[cut:] if cut >= 0 else b""
+    return (last_row, last_column) if last_row else None
+
+
+def _read_first_sheet(file_path):
+    """
+    Reads the cells of the first sheet like pd.read_excel(file_path) does, without
+    loading other sheets or the empty formatted rows below the data.
+
+    Returns:
+        DataFrame: The sheet, or None if it holds no values.
+    """
+    if file_path.lower().endswith('.xls'):
+        # Use xlrd engine for .xls files; on_demand loads only the sheet that is read.
+        # Without formatting_info xlrd skips blank cells, so the sheet extent is the data
+        df = pd.read_excel(file_path, engine='xlrd', engine_kwargs={"on_demand": True})
+    elif file_path.lower().endswith('.xlsx'):
+        # Use openpyxl engine for .xlsx files, stopping at the last row with a value
+        with zipfile.ZipFile(file_path) as archive:
+            sheets = xlsx_sheet_parts(archive)
+            used_range = sheet_used_range(archive, sheets[0][1]) if sheets else None
+        if used_range is None:
+            return None
+        last_row, _ = used_range
+        nrows = max(0, last_row - 1) if last_row is not None else None
+        df = pd.read_excel(file_path, engine='openpyxl', nrows=nrows)
+    else:
+        raise ExcelExtractionError(f"Unsupported Excel file format: {file_path} ")
+    if df.empty and len(df.columns) == 0:
+        return None
+    return df
+
 # Function to perform OCR on images
 def perform_ocr_on_image(image):
     return pytesseract.image_to_string(image)
@@ -37,18 +160,12 @@ def perform_ocr_on_image(image):
 def get_text_from_excel(file_path):
     text = ""
     try:
-        # Step 1: Extract text from cells
-        if file_path.lower().endswith('.xls'):
-            # Use xlrd engine for .xls files
-            df = pd.read_excel(file_path, engine='xlrd')
-        elif file_path.lower().endswith('.xlsx'):
-            # Use openpyxl engine for .xlsx files
-            df = pd.read_excel(file_path, engine='openpyxl')
-        else:
-            raise ExcelExtractionError(f"Unsupported Excel file format: {file_path} ")
+        # Step 1: Extract text from cells of the first sheet; an empty sheet adds nothing
+        df = _read_first_sheet(file_path)
 
         # Convert DataFrame to a string
-        text += df.to_string()
+        if df is not None:
+            text += df.to_string()
     except Exception as e:
         logger.error(f"Error extracting text from Excel file {file_path}: {e}")
         raise ExcelExtractionError(f"Error extracting text from Excel file {file_path}: {e}")
@@ -61,33 +178,51 @@ def get_text_from_excel(file_path):
             logger.error(f"Error extracting images from Excel file {file_path}: {e}")
             raise ExcelExtractionError(f"Error extracting images from Excel file {file_path}: {e}")
 
-    # Step 3: remove "Unnamed" and "NaN" as a preprocess step
+    # Step 3: remove "Unnamed" and "NaN" and collapse whitespace, keeping the rows on their own lines
     processed_text = preprocess_text(text)
 
     return processed_text
 
 
+def sheet_image_parts(archive, sheet_path):
+    """
+    Returns the media part paths of the pictures drawn on a sheet, in drawing order,
+    following sheet -> drawing -> image relationships. Sheets without a drawing are
+    never opened.
+    """
+    images = []
+    for relationship_type, drawing_path in _part_relationships(archive, sheet_path).values():
+        if not relationship_type.endswith("/drawing"):
+            continue
+        drawing_relationships = _part_relationships(archive, drawing_path)
+        for element in ET.fromstring(archive.read(drawing_path)).iter():
+            if _local_name(element.tag) != "blip":
+                continue
+            embed = next((value for key, value in element.attrib.items() if _local_name(key) == "embed"), None)
+            if embed in drawing_relationships and drawing_relationships[embed][0].endswith("/image"):
+                images.append(drawing_relationships[embed][1])
+    return images
+
+
 # Function to extract images from Excel files and perform OCR
 def extract_image_text_from_excel(file_path):
+    """
+    OCRs the pictures of every sheet, sheet by sheet. The pictures are read from the
+    xlsx archive directly, so no sheet's cells are loaded.
+    """
     text_from_images = ""
     try:
-        # Load the Excel workbook
-        wb = load_workbook(file_path, data_only=True)
-
-        # Iterate through all worksheets
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-
-            # Check if the worksheet contains any images
-            if ws._images:
-                for image in ws._images:
+        with zipfile.ZipFile(file_path) as archive:
+            # Iterate through all worksheets
+            for sheetname, sheet_path in xlsx_sheet_parts(archive):
+                for image_path in sheet_image_parts(archive, sheet_path):
+                    try:
+                        img = Image.open(BytesIO(archive.read(image_path)))
+                    except Exception as e:
+                        # openpyxl skipped pictures PIL cannot open (EMF, WMF) the same way
+                        logger.warning(f"Skipping unreadable image {image_path} in Excel sheet {sheetname}: {e}")
+                        continue
                     try:
-                        # The image data is already in BytesIO, so no need to wrap it again.
-                        img_data = image.ref  # or simply image.image for image data
-
-                        # Open the image using PIL directly
-                        img = Image.open(img_data)  # No need for BytesIO wrapping
-
                         # Perform OCR on the image
                         ocr_text = perform_ocr_on_image(img)
                         text_from_images += ocr_text
@@ -104,21 +239,7 @@ def extract_image_text_from_excel(file_path):
 def preprocess_text(text):
     """
     Cleans and reduces noise in the extracted text by handling placeholders like 'Unnamed' and 'NaN',
-    and collapsing redundant whitespace.
+    and collapsing redundant whitespace. Kept for callers of the old name; see
+    text_normalizer.normalize_text, which also keeps one line per table row.
     """
-
-    # Replace "Unnamed" and similar placeholders
-    text = re.sub(r'\bUnnamed\b.*?:?', '', text)  # Matches "Unnamed" or "Unnamed:X"
-
-    # Replace "NaN" or similar placeholders
-    text = re.sub(r'\bNaN\b', '', text)
-
-    # Remove excessive whitespace introduced by replacements
-    text = re.sub(r'\s+', ' ', text)  # Collapse multiple spaces into one
-    text = re.sub(r'^\s+|\s+$', '', text, flags=re.MULTILINE)  # Strip leading/trailing spaces from each line
-
-    # Remove rows that are completely empty after processing
-    cleaned_lines = [line for line in text.splitlines() if line.strip()]
-    text = "\n".join(cleaned_lines)
-
-    return text
+    return normalize_text(text)
@@ -1,9 +1,37 @@
 ##File name: excel_to_jsonl.py
 
 import pandas as pd
+import numpy as np
 import json
 import re
 import os
+from itertools import islice
+from output_schema import OUTPUT_SCHEMA
+from prompt_templates import DEFAULT_TEMPLATE_ID
+
+# Mismatches kept in the validation summary; all of them are counted
+MAX_MISMATCH_EXAMPLES = 20
+
+
+def read_label_sheet(input_excel_path):
+    """
+    Reads the label sheet the way the conversion needs it: every column as text except
+    "Install Date", which is parsed as a date.
+    """
+    # One read: parsing the workbook (shared strings included) dominates, so the date
+    # column is converted afterwards instead of reading the header first for a dtype map
+    df = pd.read_excel(input_excel_path, dtype=str)
+    df["Install Date"] = pd.to_datetime(df["Install Date"])
+    return df
+
+
+def instance_pattern(entry):
+    """
+    Regex of the "<prefix> <n> <field>" columns of an "instances" schema entry; the
+    groups are the instance number and the field ("" or None for the bare column).
+    """
+    return re.compile(rf"^{entry['prefix']} (\d+)(?: ({'|'.join(entry['fields'])}))?$")
+
 
 def excel_to_jsonl(input_excel_path, output_jsonl_path):
     """
@@ -17,67 +45,8 @@ def excel_to_jsonl(input_excel_path, output_jsonl_path):
         None: The function writes a JSONL file to the specified location.
     """
 
-    # Define the task instruction (common for all examples)
-    instruction = """
-    Extract the following information from the report if available:
-
-    Install Date
-    Customer
-    Well Name
-    API #
-    Tubing Size
-    Tubing Weight
-    Manufacturer
-
-    for each pump in the report:
-    - Pump type
-    - Pump Series
-    - Pump number of Stages
-
-    for each pump taper in the report:
-    - taper type
-    - total number of Stages
-
-    for each intake/gas separator
-    - model
-    - series
-
-    for each Seal/Protector
-    - series
-    - model
-
-    for each motor
-    - manufacturer
-    - series
-    - model
-    - horsepower
-    - voltage
-    - amperage
-
-    calculated total horsepower
-    calculated total voltage
-    calculated total amperage
-
-    sensor series
-    sensor manufacturer
-    sensor model
-    sensor depth
-
-    main cable AWG
-    Cable KV
-    Cable Profile
-
-    VSD Manufacturer
-    VSD Type
-    VSD KVA
-    VSD A
-    """
-
     # Step 1: Read the Excel file
-    df_temp = pd.read_excel(input_excel_path)
-    dtypes = {col: str for col in df_temp.columns}
-    dtypes["Install Date"] = "datetime64[ns]"
-    df = pd.read_excel(input_excel_path, dtype=dtypes)
+    df = read_label_sheet(input_excel_path)
 
     # Initialize the output JSON list
     output_json = []
@@ -100,14 +69,14 @@ def excel_to_jsonl(input_excel_path, output_jsonl_path):
         return value
 
     # Function to extract instances dynamically based on column headers
-    def extract_instances(row, prefix, fields):
+    def extract_instances(row, entry):
         """
         Extract instances dynamically for components with numbered columns.
 
         Args:
             row (pd.Series): A row of data from the DataFrame.
-            prefix (str): Column prefix (e.g., "Pump", "Motor").
-            fields (list): List of subfields to extract for each instance (e.g., ["", "Series", "Stages"]).
+            entry (dict): "instances" schema entry with the column prefix (e.g., "Pump") and
+                the subfields of each instance (e.g., ["", "Series", "# Stages"]).
 
         Returns:
             List[dict]: List of extracted instances for the component.
@@ -116,7 +85,7 @@ def excel_to_jsonl(input_excel_path, output_jsonl_path):
         grouped_columns = {}
 
         # Combine all fields into a single regex pattern
-        pattern = re.compile(rf"^{prefix} (\d+)(?: ({'|'.join(fields)}))?$")
+        pattern = instance_pattern(entry)
 
         # Group columns by instance number
         for col in row.index:
@@ -137,57 +106,22 @@ def excel_to_jsonl(input_excel_path, output_jsonl_path):
 
     # Iterate through the Excel rows to structure the data
     for _, row in df.iterrows():
-        # Serialize datetime fields
-        install_date = serialize_datetime(row["Install Date"])
-
-        # Build the "output" section of the JSON
-        output = {
-            "Install Date": install_date,
-            "Customer": row["Customer"],
-            "Well Name": row["Well Name"],
-            "API #": row["API #"],
-            "Tubing Size": row["Tubing Size"],
-            "Tubing Weight": row["Tubing Weight"],
-            "Manufacturer": row["Manufacturer"],
-            "Pumps": extract_instances(row, "Pump", fields=["", "Series", "# Stages"]),
-            "Pump Tapers": extract_instances(row, "Calculated Pump Taper", ["", "Total # Stages"]),
-            "Intakes/Gas Separators": extract_instances(row, "Intake/ Gas Sep", ["Series", "Model"]),
-            "Seals/Protectors": extract_instances(row, "Seal/Protector", ["Series", "Model"]),
-            "Motor Manufacturer": row["Motor Manufacturer"],
-            "Motors": extract_instances(row, "Motor", ["Series", "Model", "HP", "V", "A"]),
-            "Calculated": {
-                "Total Horsepower": row["Calculated Total Motor HP"],
-                "Total Voltage": row["Calculated Total Motor V"],
-                "Total Amperage": row["Calculated Total Motor A"]
-            },
-            "Sensors": [
-                {
-                    "Series": row["Sensor Series"],
-                    "Manufacturer": row["Sensor Manufacturer"],
-                    "Model": row["Sensor Model"],
-                    "Depth": row["Sensor Depth"]
-                }
-            ],
-            "Cable": [
-                {
-                    "AWG": row["Main Cable AWG"],
-                    "KV": row["Cable KV"],
-                    "Profile": row["Cable Profile"]
-                }
-            ],
-            "VSD": [
-                {
-                    "Manufacturer": row["VSD Manufacturer"],
-                    "Type": row["VSD Type"],
-                    "KVA": row["VSD KVA"],
-                    "A": row["VSD A"]
-                }
-            ]
-        }
-
-        # Add this record to the dataset
+        # Build the "output" section of the JSON following the shared schema
+        output = {}
+        for entry in OUTPUT_SCHEMA:
+            if entry["kind"] == "value":
+                value = row[entry["column"]]
+                output[entry["key"]] = serialize_datetime(value) if entry.get("dtype") == "date" else value
+            elif entry["kind"] == "instances":
+                output[entry["key"]] = extract_instances(row, entry)
+            elif entry["kind"] == "group":
+                output[entry["key"]] = {field: row[column] for field, column in entry["columns"].items()}
+            else:
+                output[entry["key"]] = [{field: row[column] for field, column in entry["columns"].items()}]
+
+        # Add this record to the dataset; the instruction is referenced by its template id
         output_json.append({
-            "instruction": instruction,
+            "template_id": DEFAULT_TEMPLATE_ID,
             "document": f"{row['File Name']}",
             "output": output
         })
@@ -200,184 +134,238 @@ def excel_to_jsonl(input_excel_path, output_jsonl_path):
     print(f"Dataset converted and saved as '{output_jsonl_path}'")
 
 
-def jsonl_to_dataframe(jsonl_file_path):
+def _is_missing(values):
+    # The JSONL holds null for missing dates and NaN for other missing cells
+    return pd.isna(values)
+
+
+def flatten_outputs(outputs, schema=OUTPUT_SCHEMA):
     """
-    Converts a JSONL file into a pandas DataFrame with expanded fields for comparison.
+    Flattens "output" dicts into one column per value, column by column instead of
+    row by row: "<key>" for values, "<key>_<field>" for groups and "<key>_<n>_<field>"
+    for the n-th dict of a list (the bare instance column is stored as "type").
 
     Args:
-        jsonl_file_path (str): Path to the JSONL file.
+        outputs (list): The "output" dicts of a JSONL chunk.
+        schema (list): Output schema the dicts follow.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the JSONL data with expanded fields.
+        pd.DataFrame: One row per output.
     """
-    data = []
-    with open(jsonl_file_path, "r") as file:
-        for line in file:
-            # Parse each line as a JSON object
-            obj = json.loads(line)
-            output = obj.get("output", {})
-
-            # Expand lists of dictionaries into separate fields
-            expanded = {}
-            for key, value in output.items():
-                if isinstance(value, list):
-                    for i, item in enumerate(value):
-                        if isinstance(item, dict):
-                            for subkey, subvalue in item.items():
-                                expanded[f"{key}_{i+1}_{subkey}"] = subvalue
-                        else:
-                            expanded[f"{key}_{i+1}"] = item
-                else:
-                    expanded[key] = value
-
-            flat_obj = {
-                "instruction": obj.get("instruction"),
-                "document": obj.get("document"),
-                **expanded
-            }
-            data.append(flat_obj)
-
-    return pd.DataFrame(data)
-
-
-def compare_dataframes(original_df, converted_df, save_folder):
+    # Like pd.json_normalize(outputs, sep="_", max_level=1), without its per-record deep copy
+    frame = pd.DataFrame.from_records(outputs)
+    flat = {}
+    for entry in schema:
+        key = entry["key"]
+        if entry["kind"] == "value":
+            flat[key] = frame[key] if key in frame else pd.Series(np.nan, index=frame.index)
+        elif entry["kind"] == "group":
+            groups = frame[key] if key in frame else pd.Series([None] * len(frame), index=frame.index)
+            fields = pd.DataFrame([group if isinstance(group, dict) else {} for group in groups], index=frame.index)
+            for field in entry["columns"]:
+                flat[f"{key}_{field}"] = fields[field] if field in fields else pd.Series(np.nan, index=frame.index)
+        elif key in frame:
+            # Lists: one row per (output, position), then one column per (position, field)
+            items = frame[key].explode().dropna()
+            if items.empty:
+                continue
+            values = pd.DataFrame(items.tolist(), index=items.index)
+            values["position"] = values.groupby(level=0).cumcount() + 1
+            wide = values.set_index("position", append=True).unstack("position")
+            for field, position in wide.columns:
+                flat[f"{key}_{position}_{field}"] = wide[(field, position)].reindex(frame.index)
+    return pd.DataFrame(flat, index=frame.index)
+
+
+def expected_outputs(df, schema=OUTPUT_SCHEMA):
     """
-    Compares two DataFrames, prints differences, and saves all outputs to files.
+    Builds, from label sheet rows, the flattened frame the JSONL of those rows should
+    flatten to. Column names follow from the schema, so every numbered instance
+    column of the sheet is checked, not only a fixed list. Empty instances are dropped
+    and the rest renumbered from 1, as excel_to_jsonl does.
 
     Args:
-        original_df (pd.DataFrame): Original DataFrame from Excel.
-        converted_df (pd.DataFrame): DataFrame converted from JSONL.
-        save_folder (str): Folder where outputs (differences, DataFrames) will be saved.
+        df (pd.DataFrame): Rows of read_label_sheet().
+        schema (list): Output schema used by the conversion.
 
     Returns:
-        None: Prints the comparison results.
+        tuple: (flattened frame, label sheet columns no schema entry reads)
     """
-    # Ensure the save folder exists
-    os.makedirs(save_folder, exist_ok=True)
+    flat = {}
+    used = set()
+    for entry in schema:
+        key = entry["key"]
+        if entry["kind"] == "value":
+            values = df[entry["column"]]
+            if entry.get("dtype") == "date":
+                values = pd.to_datetime(values).dt.strftime("%Y-%m-%d")
+            flat[key] = values
+            used.add(entry["column"])
+        elif entry["kind"] in ("group", "record"):
+            for field, column in entry["columns"].items():
+                flat[f"{key}_1_{field}" if entry["kind"] == "record" else f"{key}_{field}"] = df[column]
+                used.add(column)
+        else:
+            pattern = instance_pattern(entry)
+            numbers, fields, cells = [], [], {}
+            for column in df.columns:
+                match = pattern.match(column)
+                if not match:
+                    continue
+                number, field = match.groups()
+                field = field or "type"
+                if number not in numbers:
+                    numbers.append(number)
+                if field not in fields:
+                    fields.append(field)
+                cells[(number, field)] = column
+                used.add(column)
+            if not numbers:
+                continue
+            # (rows, instances, fields) cells; a missing column is an empty cell
+            values = np.full((len(df), len(numbers), len(fields)), np.nan, dtype=object)
+            present = np.zeros((len(numbers), len(fields)), dtype=bool)
+            for (number, field), column in cells.items():
+                values[:, numbers.index(number), fields.index(field)] = df[column].to_numpy(dtype=object)
+                present[numbers.index(number), fields.index(field)] = True
+            filled = ~_is_missing(values).all(axis=2)
+            positions = np.cumsum(filled, axis=1) - 1
+            rows, instances = np.nonzero(filled)
+            compacted = np.full_like(values, np.nan)
+            compacted[rows, positions[rows, instances]] = values[rows, instances]
+            for position in range(int(filled.sum(axis=1).max(initial=0))):
+                for index, field in enumerate(fields):
+                    flat[f"{key}_{position + 1}_{field}"] = pd.Series(compacted[:, position, index], index=df.index)
+    unmapped = [column for column in df.columns if column not in used and column != "File Name"]
+    return pd.DataFrame(flat, index=df.index), unmapped
 
-    # Align indices
-    original_df = original_df.reset_index(drop=True)
-    converted_df = converted_df.reset_index(drop=True)
 
-    # Standardize column names
-    original_df.columns = original_df.columns.str.strip()
-    converted_df.columns = converted_df.columns.str.strip()
-
-    # Apply column mapping to the converted DataFrame
-    column_mapping = {
-        "Install Date": "Install Date",
-        "Customer": "Customer",
-        "Well Name": "Well Name",
-        "API #": "API #",
-        "Tubing Size": "Tubing Size",
-        "Tubing Weight": "Tubing Weight",
-        "Manufacturer": "Manufacturer",
-        "Pumps_1_type": "Pump 1",
-        "Pumps_1_Series": "Pump 1 Series",
-        "Pumps_1_# Stages": "Pump 1 # Stages",
-        "Pumps_2_type": "Pump 2",
-        "Pumps_2_Series": "Pump 2 Series",
-        "Pumps_2_# Stages": "Pump 2 # Stages",
-        "Pump Tapers_1_type": "Calculated Pump Taper 1",
-        "Pump Tapers_1_Total # Stages": "Calculated Pump Taper 1 Total # Stages",
-        "Pump Tapers_2_type": "Calculated Pump Taper 2",
-        "Pump Tapers_2_Total # Stages": "Calculated Pump Taper 2 Total # Stages",
-        "Intakes/Gas Separators_1_Series": "Intake/ Gas Sep 1 Series",
-        "Intakes/Gas Separators_1_Model": "Intake/ Gas Sep 1 Model",
-        "Intakes/Gas Separators_2_Series": "Intake/ Gas Sep 2 Series",
-        "Intakes/Gas Separators_2_Model": "Intake/ Gas Sep 2 Model",
-        "Seals/Protectors_1_Series": "Seal/Protector 1 Series",
-        "Seals/Protectors_1_Model": "Seal/Protector 1 Model",
-        "Motors_1_Series": "Motor 1 Series",
-        "Motors_1_Model": "Motor 1 Model",
-        "Motors_1_HP": "Motor 1 HP",
-        "Motors_1_V": "Motor 1 V",
-        "Motors_1_A": "Motor 1 A",
-        "Calculated_Total Horsepower": "Calculated Total Motor HP",
-        "Calculated_Total Voltage": "Calculated Total Motor V",
-        "Calculated_Total Amperage": "Calculated Total Motor A",
-        "Sensors_1_Series": "Sensor Series",
-        "Sensors_1_Manufacturer": "Sensor Manufacturer",
-        "Sensors_1_Model": "Sensor Model",
-        "Sensors_1_Depth": "Sensor Depth",
-        "Cable_1_AWG": "Main Cable AWG",
-        "Cable_1_KV": "Cable KV",
-        "Cable_1_Profile": "Cable Profile",
-        "VSD_1_Manufacturer": "VSD Manufacturer",
-        "VSD_1_Type": "VSD Type",
-        "VSD_1_KVA": "VSD KVA",
-        "VSD_1_A": "VSD A"
-    }
-    converted_df = converted_df.rename(columns=column_mapping)
-
-    # Save DataFrames for inspection
-    original_file = os.path.join(save_folder, "original_dataframe.pkl")
-    converted_file = os.path.join(save_folder, "converted_dataframe.pkl")
-    original_df.to_pickle(original_file)
-    converted_df.to_pickle(converted_file)
-
-    # Save as CSV for easier viewing
-    original_csv_file = os.path.join(save_folder, "original_dataframe.csv")
-    converted_csv_file = os.path.join(save_folder, "converted_dataframe.csv")
-    original_df.to_csv(original_csv_file, index=False)
-    converted_df.to_csv(converted_csv_file, index=False)
-
-    print(f"Saved original DataFrame to: {original_file} and {original_csv_file}")
-    print(f"Saved converted DataFrame to: {converted_file} and {converted_csv_file}")
-
-    # Align columns
-    original_columns = set(original_df.columns)
-    converted_columns = set(converted_df.columns)
-
-    # Check for missing or extra columns
-    missing_in_original = converted_columns - original_columns
-    missing_in_converted = original_columns - converted_columns
-
-    if missing_in_original:
-        print(f"Columns in converted DataFrame but missing in original: {missing_in_original}")
-    if missing_in_converted:
-        print(f"Columns in original DataFrame but missing in converted: {missing_in_converted}")
-
-    # Retain only common columns for comparison
-    common_columns = original_columns & converted_columns
-    original_df = original_df[sorted(common_columns)]
-    converted_df = converted_df[sorted(common_columns)]
-
-    # Compare DataFrames
-    if original_df.equals(converted_df):
-        print("The DataFrames are identical!")
-    else:
-        print("Differences found between the DataFrames:")
-        differences = original_df.compare(converted_df, align_axis=0)
+def jsonl_to_dataframe(jsonl_file_path):
+    """
+    Converts a JSONL file into a pandas DataFrame with expanded fields for comparison.
+
+    Args:
+        jsonl_file_path (str): Path to the JSONL file.
+
+    Returns:
+        pd.DataFrame: "template_id", "document" and the flatten_outputs() columns.
+    """
+    with open(jsonl_file_path, "r") as file:
+        records = [json.loads(line) for line in file]
+    flat = flatten_outputs([record.get("output", {}) for record in records])
+    flat.insert(0, "document", [record.get("document") for record in records])
+    flat.insert(0, "template_id", [record.get("template_id") for record in records])
+    return flat
+
 
-        # Save differences to a file
-        differences_file = os.path.join(save_folder, "differences.csv")
-        differences.to_csv(differences_file)
-        print(f"Saved differences to: {differences_file}")
+def compare_dataframes(expected_df, converted_df):
+    """
+    Compares two flattened frames with the same row index cell by cell; two missing
+    values are equal, other values are compared as text.
+
+    Returns:
+        pd.DataFrame: One row per differing cell (row, column, expected, converted), and
+        the columns that only one of the frames has.
+    """
+    columns = expected_df.columns.union(converted_df.columns, sort=False)
+    expected = expected_df.reindex(columns=columns)
+    converted = converted_df.reindex(columns=columns, index=expected_df.index)
+    expected_missing = _is_missing(expected.to_numpy(dtype=object))
+    converted_missing = _is_missing(converted.to_numpy(dtype=object))
+    same_text = expected.astype(str).to_numpy() == converted.astype(str).to_numpy()
+    differs = ~((expected_missing & converted_missing) | (~expected_missing & ~converted_missing & same_text))
+
+    rows, cols = np.nonzero(differs)
+    return pd.DataFrame({
+        "row": expected.index[rows],
+        "column": columns[cols],
+        "expected": expected.to_numpy(dtype=object)[rows, cols],
+        "converted": converted.to_numpy(dtype=object)[rows, cols],
+    })
+
+
+def _read_jsonl_chunks(jsonl_file_path, chunk_size):
+    with open(jsonl_file_path, "r") as file:
+        while True:
+            lines = list(islice(file, chunk_size))
+            if not lines:
+                return
+            yield [json.loads(line) for line in lines]
 
 
-def validate_conversion(original_excel_path, jsonl_file_path):
+def validate_conversion(original_excel_path, jsonl_file_path, chunk_size=1000, artifacts_dir=None):
     """
     Validates that the JSONL conversion matches the original Excel data.
 
+    The JSONL is read and compared chunk_size records at a time against the label sheet
+    rows in the same position, so memory stays bounded by the chunk rather than the
+    dataset.
+
     Args:
         original_excel_path (str): Path to the original Excel file.
         jsonl_file_path (str): Path to the JSONL file.
+        chunk_size (int): Records compared at a time.
+        artifacts_dir (str): Optional folder for mismatches.csv and the flattened
+            expected and converted frames as CSV; nothing is written without it.
 
     Returns:
-        None: Prints validation results.
+        dict: Rows compared, mismatch count in total and per column, columns only one
+        side has, label sheet columns the schema does not read, and the first
+        mismatches as examples.
     """
-    # Load original Excel file
-    original_df = pd.read_excel(original_excel_path)
-
-    # Convert JSONL to DataFrame
-    converted_df = jsonl_to_dataframe(jsonl_file_path)
-
-    # Extract folder path from JSONL save path
-    save_folder = os.path.dirname(jsonl_file_path)
+    # Read the label sheet the same way excel_to_jsonl does
+    original_df = read_label_sheet(original_excel_path).reset_index(drop=True)
+    original_df.columns = original_df.columns.str.strip()
 
-    # Compare DataFrames
-    compare_dataframes(original_df, converted_df, save_folder)
+    if artifacts_dir:
+        os.makedirs(artifacts_dir, exist_ok=True)
+    summary = {"rows": 0, "mismatches": 0, "mismatches_per_column": {}, "only_expected": set(),
+               "only_converted": set(), "unmapped_columns": [], "examples": []}
+    start = 0
+    for records in _read_jsonl_chunks(jsonl_file_path, chunk_size):
+        rows = original_df.iloc[start:start + len(records)]
+        if len(rows) < len(records):
+            raise ValueError(f"{jsonl_file_path} has more records than rows in {original_excel_path}")
+        expected, summary["unmapped_columns"] = expected_outputs(rows)
+        expected.insert(0, "document", rows["File Name"].astype(str))
+        converted = flatten_outputs([record.get("output", {}) for record in records])
+        converted.index = rows.index
+        converted.insert(0, "document", [record.get("document") for record in records])
+
+        # Instance columns exist per chunk only when some row fills them
+        summary["only_expected"] |= {column for column in expected.columns if column not in converted and not _is_missing(expected[column]).all()}
+        summary["only_converted"] |= {column for column in converted.columns if column not in expected and not _is_missing(converted[column]).all()}
+
+        mismatches = compare_dataframes(expected, converted)
+        summary["rows"] += len(records)
+        summary["mismatches"] += len(mismatches)
+        for column, count in mismatches["column"].value_counts().items():
+            summary["mismatches_per_column"][column] = summary["mismatches_per_column"].get(column, 0) + int(count)
+        summary["examples"] += mismatches.head(MAX_MISMATCH_EXAMPLES - len(summary["examples"])).to_dict("records")
+
+        if artifacts_dir:
+            first = start == 0
+            mismatches.to_csv(os.path.join(artifacts_dir, "mismatches.csv"), mode="w" if first else "a", header=first, index=False)
+            expected.to_csv(os.path.join(artifacts_dir, "expected_flat.csv"), mode="w" if first else "a", header=first, index=False)
+            converted.to_csv(os.path.join(artifacts_dir, "converted_flat.csv"), mode="w" if first else "a", header=first, index=False)
+        start += len(records)
+
+    if start < len(original_df):
+        print(f"{len(original_df) - start} label sheet rows have no JSONL record")
+    summary["only_expected"] = sorted(summary["only_expected"])
+    summary["only_converted"] = sorted(summary["only_converted"])
+
+    if summary["unmapped_columns"]:
+        print(f"Label sheet columns not in the output schema: {summary['unmapped_columns']}")
+    if summary["only_expected"] or summary["only_converted"]:
+        print(f"Columns only in the label sheet: {summary['only_expected']}; only in the JSONL: {summary['only_converted']}")
+    if summary["mismatches"] == 0:
+        print(f"The JSONL matches the label sheet ({summary['rows']} rows)")
+    else:
+        print(f"{summary['mismatches']} differing values in {summary['rows']} rows: {summary['mismatches_per_column']}")
+        if artifacts_dir:
+            print(f"Saved differences to: {os.path.join(artifacts_dir, 'mismatches.csv')}")
+    return summary
 
 
 if __name__ == "__main__":
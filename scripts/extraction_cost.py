@@ -0,0 +1,187 @@
+## extraction_cost.py
+
+import json
+import os
+import time
+import numpy as np
+
+MB = 1024 * 1024
+
+# Used until a file type has enough timings to fit: OCR dominates, a few seconds per
+# scanned page, about a second per page when the PDF has a text layer
+PRIOR_SECONDS = {
+    "pdf": lambda task: 2.0 + (1.0 if task.has_text_layer else 3.0) * (task.pages or 1),
+    "excel": lambda task: 1.0 + 5.0 * task.size_bytes / MB,
+    "other": lambda task: 0.5,
+}
+MIN_SAMPLES_PER_FEATURE = 2
+MIN_PREDICTION_SECONDS = 0.05
+
+
+def cost_features(file_type, size_bytes, pages, has_text_layer):
+    """
+    Regression features of one document. PDF cost grows with pages and more so for
+    scanned pages (no text layer); Excel cost grows with the workbook size.
+    """
+    size_mb = size_bytes / MB
+    if file_type == "pdf":
+        pages = pages or 1
+        return [1.0, pages, pages * (0.0 if has_text_layer else 1.0), size_mb]
+    if file_type == "excel":
+        return [1.0, size_mb]
+    return [1.0]
+
+
+class ExtractionCostModel:
+    """
+    Predicts how long extracting a document takes, fitted per file type by least squares
+    on the timings of earlier runs (see append_timings).
+
+    Args:
+        timings (list): Timing records with file_type, size_bytes, pages,
+            has_text_layer and seconds.
+    """
+
+    def __init__(self, timings=()):
+        self.weights = {}
+        self.samples = {}
+        by_type = {}
+        for timing in timings:
+            if timing.get("seconds") is None:
+                continue
+            features = cost_features(timing["file_type"], timing["size_bytes"], timing.get("pages"), timing.get("has_text_layer"))
+            by_type.setdefault(timing["file_type"], ([], []))
+            by_type[timing["file_type"]][0].append(features)
+            by_type[timing["file_type"]][1].append(timing["seconds"])
+
+        for file_type, (features, seconds) in by_type.items():
+            self.samples[file_type] = len(seconds)
+            if len(seconds) >= MIN_SAMPLES_PER_FEATURE * len(features[0]):
+                self.weights[file_type], *_ = np.linalg.lstsq(np.array(features), np.array(seconds), rcond=None)
+
+    @classmethod
+    def from_timings_file(cls, timings_path, ocr_mode=None):
+        """
+        Fits the model on a timings JSONL file, keeping only runs with the given OCR mode.
+        An absent file gives a model that only uses the priors.
+        """
+        timings = []
+        if timings_path and os.path.exists(timings_path):
+            with open(timings_path, "r") as timings_file:
+                timings = [json.loads(line) for line in timings_file if line.strip()]
+        if ocr_mode is not None:
+            timings = [timing for timing in timings if timing.get("ocr_mode", "full") == ocr_mode]
+        return cls(timings)
+
+    def predict(self, task):
+        """
+        Predicted extraction seconds for an ExtractionTask; also stored on the task.
+        """
+        weights = self.weights.get(task.file_type)
+        if weights is None:
+            seconds = PRIOR_SECONDS[task.file_type](task)
+        else:
+            seconds = float(np.dot(weights, cost_features(task.file_type, task.size_bytes, task.pages, task.has_text_layer)))
+        task.predicted_seconds = max(MIN_PREDICTION_SECONDS, seconds)
+        return task.predicted_seconds
+
+
+def longest_first(tasks, cost_model):
+    """
+    Orders tasks by predicted cost, most expensive first (LPT), so a large report does
+    not start last and leave the other workers idle at the end of the run.
+    """
+    for task in tasks:
+        cost_model.predict(task)
+    return sorted(tasks, key=lambda task: task.predicted_seconds, reverse=True)
+
+
+def append_timings(timings_path, tasks, results, ocr_mode="full"):
+    """
+    Appends the features and measured seconds of successfully extracted documents to
+    the timings JSONL the cost model is fitted on.
+    """
+    timings_dir = os.path.dirname(timings_path)
+    if timings_dir:
+        os.makedirs(timings_dir, exist_ok=True)
+    with open(timings_path, "a") as timings_file:
+        for result in results:
+            task = tasks[result["key"]]
+            if result["error"] is not None or result["seconds"] is None:
+                continue
+            timings_file.write(json.dumps({
+                "file_name": task.file_name,
+                "file_type": task.file_type,
+                "size_bytes": task.size_bytes,
+                "pages": task.pages,
+                "has_text_layer": task.has_text_layer,
+                "ocr_mode": ocr_mode,
+                "seconds": result["seconds"],
+                "peak_mb": result.get("peak_mb"),
+            }) + "\n")
+
+
+def write_run_report(report_path, tasks, results, wall_seconds, num_workers):
+    """
+    Writes predicted vs actual cost per document and for the whole run.
+
+    The run section compares the measured wall time with the makespan lower bound of
+    the measured costs (the larger of total cost / workers and the longest document).
+
+    Returns:
+        dict: The report.
+    """
+    documents = []
+    for result in results:
+        task = tasks[result["key"]]
+        documents.append({
+            "file_name": task.file_name,
+            "file_type": task.file_type,
+            "pages": task.pages,
+            "size_bytes": task.size_bytes,
+            "predicted_seconds": round(task.predicted_seconds, 2) if task.predicted_seconds is not None else None,
+            "actual_seconds": result["seconds"],
+            "peak_mb": result.get("peak_mb"),
+            "error": result["error"],
+        })
+
+    measured = [document for document in documents if document["actual_seconds"] is not None and document["predicted_seconds"] is not None]
+    actual = np.array([document["actual_seconds"] for document in measured])
+    predicted = np.array([document["predicted_seconds"] for document in measured])
+    total = float(actual.sum()) if len(actual) else 0.0
+    lower_bound = max(total / max(1, num_workers), float(actual.max()) if len(actual) else 0.0)
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "documents": len(documents),
+        "num_workers": num_workers,
+        "wall_seconds": round(wall_seconds, 2),
+        "makespan_lower_bound_seconds": round(lower_bound, 2),
+        "total_predicted_seconds": round(float(predicted.sum()), 2),
+        "total_actual_seconds": round(total, 2),
+        "mean_absolute_error_seconds": round(float(np.abs(predicted - actual).mean()), 2) if len(actual) else None,
+        "rank_correlation": _rank_correlation(predicted, actual),
+        "per_document": sorted(documents, key=lambda document: -(document["actual_seconds"] or 0)),
+    }
+
+    report_dir = os.path.dirname(report_path)
+    if report_dir:
+        os.makedirs(report_dir, exist_ok=True)
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(
+        f"Extraction run: {report['wall_seconds']} s wall, lower bound {report['makespan_lower_bound_seconds']} s; "
+        f"predicted {report['total_predicted_seconds']} s vs actual {report['total_actual_seconds']} s of work. "
+        f"Report at {report_path}"
+    )
+    return report
+
+
+def _rank_correlation(predicted, actual):
+    # Spearman correlation: how well the predicted order matches the actual one, which is what LPT needs
+    if len(actual) < 2:
+        return None
+    predicted_ranks = np.argsort(np.argsort(predicted))
+    actual_ranks = np.argsort(np.argsort(actual))
+    if predicted_ranks.std() == 0 or actual_ranks.std() == 0:
+        return None
+    return round(float(np.corrcoef(predicted_ranks, actual_ranks)[0, 1]), 3)
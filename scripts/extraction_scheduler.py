@@ -0,0 +1,397 @@
+## extraction_scheduler.py
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import psutil
+import logging_utils
+from extraction_cost import longest_first
+
+logger = logging_utils.setup_logger('logs/main_log.log', name=__name__)
+
+MB = 1024 * 1024
+
+# Starting memory model (MB). A page rendered by convert_from_path at 200 DPI is ~11 MB
+# of RGB pixels, and all pages of a PDF are held at once, plus Tesseract's copy.
+PDF_BASE_MB = 150
+PDF_PAGE_MB = 25
+# openpyxl and pandas expand the compressed xlsx XML many times over
+EXCEL_BASE_MB = 150
+EXCEL_SIZE_FACTOR = 30
+OTHER_BASE_MB = 100
+
+# Measured/estimated ratios are smoothed and clamped so one odd document cannot swing the model
+CORRECTION_SMOOTHING = 0.3
+CORRECTION_RANGE = (0.25, 4.0)
+MAX_RETRIES = 1
+
+
+class ExtractionSchedulerError(Exception):
+    """Raised when the extraction pool cannot be (re)started."""
+
+
+def document_type(file_name):
+    name = file_name.lower()
+    if name.endswith(".pdf"):
+        return "pdf"
+    if name.endswith(".xls") or name.endswith(".xlsx"):
+        return "excel"
+    return "other"
+
+
+def pdf_layout_info(file_path):
+    """
+    Reads the page count from the PDF page tree and whether the first page has fonts
+    (a text layer) without parsing any page content.
+
+    Returns:
+        tuple: (pages, has_text_layer); (None, None) if the file cannot be parsed.
+    """
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    try:
+        with open(file_path, "rb") as file:
+            document = PDFDocument(PDFParser(file))
+            pages = int(resolve1(resolve1(document.catalog["Pages"])["Count"]))
+            first_page = next(PDFPage.create_pages(document), None)
+            fonts = resolve1(first_page.resources.get("Font")) if first_page and first_page.resources else None
+            return pages, bool(fonts)
+    except Exception:
+        return None, None
+
+
+class ExtractionTask:
+    """
+    One file to extract, with what the scheduler knows about it before running it.
+
+    Args:
+        key (str): Cache key of the content (see script3), used to hand back the result.
+        file_name (str): File name, which decides the extractor.
+        file_path (str): Path of the file.
+    """
+
+    def __init__(self, key, file_name, file_path):
+        self.key = key
+        self.file_name = file_name
+        self.file_path = file_path
+        self.file_type = document_type(file_name)
+        self.size_bytes = os.path.getsize(file_path)
+        self.pages, self.has_text_layer = pdf_layout_info(file_path) if self.file_type == "pdf" else (None, None)
+        self.estimate_mb = None
+        self.predicted_seconds = None
+        self.retries = 0
+
+    def as_args(self):
+        return {"key": self.key, "file_name": self.file_name, "file_path": self.file_path}
+
+
+class MemoryModel:
+    """
+    Estimates the peak memory of extracting a document from its type, size and page
+    count. After every task the ratio of measured to estimated peak updates a per-type
+    correction factor, so the estimates follow the actual document mix.
+
+    Args:
+        ocr_settings (dict): OCR settings of the run; the OCR DPI scales the page cost
+            and the ROI mode only holds one full-resolution page at a time.
+    """
+
+    def __init__(self, ocr_settings=None):
+        ocr_settings = ocr_settings or {}
+        self.page_mb = PDF_PAGE_MB
+        if ocr_settings.get("ocr_mode", "full") == "roi":
+            self.page_mb *= (ocr_settings.get("ocr_dpi", 200) / 200) ** 2
+        self.roi = ocr_settings.get("ocr_mode", "full") == "roi"
+        self.correction = {"pdf": 1.0, "excel": 1.0, "other": 1.0}
+
+    def raw_estimate(self, task):
+        if task.file_type == "pdf":
+            pages = task.pages or max(1, task.size_bytes // (100 * 1024))
+            return PDF_BASE_MB + self.page_mb * (1 if self.roi else pages)
+        if task.file_type == "excel":
+            return EXCEL_BASE_MB + EXCEL_SIZE_FACTOR * task.size_bytes / MB
+        return OTHER_BASE_MB
+
+    def estimate(self, task):
+        task.estimate_mb = self.raw_estimate(task) * self.correction[task.file_type]
+        return task.estimate_mb
+
+    def update(self, task, measured_mb):
+        if not measured_mb:
+            return
+        ratio = measured_mb / self.raw_estimate(task)
+        low, high = CORRECTION_RANGE
+        current = self.correction[task.file_type]
+        self.correction[task.file_type] = min(high, max(low, current + CORRECTION_SMOOTHING * (ratio - current)))
+
+
+class _PeakRssSampler:
+    """
+    Samples the RSS of this process and its children (pdftoppm, Tesseract) on a thread
+    while a task runs and keeps the maximum. Lifetime peaks (ru_maxrss, peak_wset) cannot
+    be attributed to a single task and miss the child processes.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.rss()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def rss(self):
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return total
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def extract_document(task, ocr_settings=None, page_pool=None):
+    """
+    Extracts one document; the function pool workers run. Top level so it pickles.
+
+    Args:
+        task (dict): ExtractionTask.as_args().
+        ocr_settings (dict): OCR settings passed on to the PDF extractor.
+        page_pool (ProcessPoolExecutor): Page OCR pool of the run, see
+            pdf_extraction.open_page_pool; only used when extracting in this process.
+
+    Returns:
+        dict: key, text (None on error), error, seconds and the worker's peak RSS in MB
+        (interpreter and libraries included, like the base of the memory model).
+    """
+    # Imported here: script3 imports this module
+    from script3_extract_text import extract_file_text
+
+    result = {"key": task["key"], "text": None, "error": None}
+    start = time.perf_counter()
+    with _PeakRssSampler() as sampler:
+        try:
+            result["text"] = extract_file_text(task["file_name"], task["file_path"], ocr_settings, page_pool)
+        except Exception as e:
+            result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    result["peak_mb"] = round(sampler.peak / MB, 1)
+    return result
+
+
+def _worker_init(log_queue):
+    logging_utils.configure_worker_logging(log_queue)
+
+
+class MemoryGovernor:
+    """
+    Decides how many extraction tasks may run at once.
+
+    A task is admitted while the projected memory use (measured RSS of the worker
+    processes and their children, e.g. pdftoppm and Tesseract, plus the estimates of
+    running tasks that have not reached their peak yet, plus the new task) stays under
+    the budget and the machine still has that much memory available. The concurrency
+    limit drops when measured RSS crosses the budget and grows back while usage stays
+    well below it.
+
+    Args:
+        budget_mb (float): Memory budget for the extraction workers.
+        max_workers (int): Upper bound on concurrent tasks.
+        min_workers (int): Lower bound the limit never drops below.
+    """
+
+    def __init__(self, budget_mb, max_workers, min_workers=1):
+        self.budget_mb = budget_mb
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.concurrency = max_workers
+        self.process = psutil.Process()
+        self.peak_pool_mb = 0.0
+
+    def pool_rss_mb(self):
+        total = 0
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return total / MB
+
+    def projected_mb(self, running_tasks, pool_mb):
+        # Running tasks that have not reached their peak yet still claim their estimate
+        return max(pool_mb, sum(task.estimate_mb for task in running_tasks))
+
+    def can_admit(self, task, running_tasks, pool_mb):
+        if not running_tasks:
+            # A document larger than the budget still gets run, alone
+            return True
+        if len(running_tasks) >= self.concurrency:
+            return False
+        available_mb = psutil.virtual_memory().available / MB
+        projected = self.projected_mb(running_tasks, pool_mb) + task.estimate_mb
+        return projected <= self.budget_mb and task.estimate_mb <= available_mb
+
+    def observe(self, pool_mb, waiting):
+        """
+        Adjusts the concurrency limit from the measured pool RSS.
+        """
+        self.peak_pool_mb = max(self.peak_pool_mb, pool_mb)
+        if pool_mb > self.budget_mb and self.concurrency > self.min_workers:
+            self.concurrency -= 1
+            logger.info("Extraction over memory budget, lowering concurrency",
+                        extra={"pool_mb": round(pool_mb), "budget_mb": self.budget_mb, "concurrency": self.concurrency})
+        elif waiting and pool_mb < 0.6 * self.budget_mb and self.concurrency < self.max_workers:
+            self.concurrency += 1
+            logger.info("Extraction memory headroom, raising concurrency",
+                        extra={"pool_mb": round(pool_mb), "budget_mb": self.budget_mb, "concurrency": self.concurrency})
+
+
+def default_memory_budget_mb():
+    """
+    75% of the machine's memory minus what this process already uses.
+    """
+    return 0.75 * psutil.virtual_memory().total / MB - psutil.Process().memory_info().rss / MB
+
+
+def _new_executor(num_workers, max_tasks_per_child):
+    context = multiprocessing.get_context("spawn")
+    try:
+        return ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=context,
+            initializer=_worker_init,
+            initargs=(logging_utils.get_log_queue("spawn"),),
+            max_tasks_per_child=max_tasks_per_child,
+        )
+    except Exception as e:
+        raise ExtractionSchedulerError(f"Could not start the extraction pool: {e}")
+
+
+def run_extraction_tasks(tasks, ocr_settings=None, num_workers=1, memory_budget_mb=None,
+                         max_tasks_per_child=None, poll_interval=0.2, cost_model=None):
+    """
+    Extracts the given files, in worker processes when num_workers > 1, admitting work
+    only while it fits the memory budget (see MemoryGovernor).
+
+    With a cost model the most expensive documents are started first (longest job
+    first), so the run does not end with one large report on one worker while the
+    others are idle; each worker then takes the next task as soon as it is free.
+    Pending tasks are considered in order; when the next one does not fit, a later,
+    smaller one may start instead. If the pool dies (e.g. a worker killed for running
+    out of memory), it is restarted with fewer workers and the interrupted tasks are
+    retried once.
+
+    Args:
+        tasks (list): ExtractionTask objects.
+        ocr_settings (dict): OCR settings for PDFs. With num_workers 1, ocr.page_workers
+            processes OCR the pages, in one pool kept for the whole run; with more
+            extraction workers page_workers is forced to 1.
+        num_workers (int): Maximum worker processes; 1 extracts in this process.
+        memory_budget_mb (float): Budget for the workers; None uses default_memory_budget_mb().
+        max_tasks_per_child (int): Restart a worker after this many tasks so memory
+            held after a large document is returned to the system.
+        poll_interval (float): Seconds between memory checks while waiting.
+        cost_model (ExtractionCostModel): Predicts task durations for the ordering;
+            None keeps the given order.
+
+    Yields:
+        dict: One extract_document result per task, in completion order.
+    """
+    if cost_model is not None:
+        tasks = longest_first(tasks, cost_model)
+    model = MemoryModel(ocr_settings)
+    for task in tasks:
+        model.estimate(task)
+    pending = deque(tasks)
+
+    page_workers = (ocr_settings or {}).get("page_workers", 1)
+    if num_workers <= 1:
+        # Imported here: pdf_extraction loads Tesseract and pdfminer, which workers import themselves
+        from pdf_extraction import open_page_pool
+
+        # One page pool for the whole run, so its workers import the OCR libraries once
+        with open_page_pool(page_workers) as page_pool:
+            while pending:
+                task = pending.popleft()
+                result = extract_document(task.as_args(), ocr_settings, page_pool)
+                model.update(task, result["peak_mb"])
+                yield result
+        return
+
+    if page_workers > 1:
+        # Page pools inside extraction workers would be processes the memory governor never sees
+        print(f"Ignoring ocr.page_workers={page_workers} with {num_workers} extraction workers; pages are OCR'd in each worker")
+        ocr_settings = {**ocr_settings, "page_workers": 1}
+
+    budget_mb = memory_budget_mb or default_memory_budget_mb()
+    governor = MemoryGovernor(budget_mb, num_workers)
+    executor = _new_executor(num_workers, max_tasks_per_child)
+    running = {}
+    print(f"Extracting {len(pending)} files with up to {num_workers} workers under a {budget_mb:.0f} MB memory budget")
+
+    try:
+        while pending or running:
+            pool_mb = governor.pool_rss_mb()
+            governor.observe(pool_mb, waiting=bool(pending))
+            for task in list(pending):
+                if not governor.can_admit(task, list(running.values()), pool_mb):
+                    continue
+                pending.remove(task)
+                model.estimate(task)
+                running[executor.submit(extract_document, task.as_args(), ocr_settings)] = task
+                logger.debug("Admitted extraction", extra={"file_name": task.file_name, "estimate_mb": round(task.estimate_mb), "running": len(running)})
+                if len(running) >= governor.concurrency:
+                    break
+
+            done, _ = wait(list(running), timeout=poll_interval, return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                task = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(task)
+                    continue
+                model.update(task, result["peak_mb"])
+                yield result
+
+            if broken:
+                # Every task of a dead pool fails; retry them with fewer workers
+                broken += list(running.values())
+                running.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                governor.max_workers = max(1, governor.max_workers // 2)
+                governor.concurrency = min(governor.concurrency, governor.max_workers)
+                logger.error("Extraction pool died, restarting with fewer workers",
+                             extra={"workers": governor.max_workers, "pool_mb": round(pool_mb)})
+                print(f"Extraction pool died (out of memory?); restarting with {governor.max_workers} workers")
+                executor = _new_executor(governor.max_workers, max_tasks_per_child)
+                for task in broken:
+                    if task.retries < MAX_RETRIES:
+                        task.retries += 1
+                        pending.appendleft(task)
+                    else:
+                        yield {"key": task.key, "text": None, "error": "worker process died (out of memory?)",
+                               "seconds": None, "peak_mb": None}
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        print(f"Extraction pool peak RSS {governor.peak_pool_mb:.0f} MB of a {budget_mb:.0f} MB budget")
@@ -0,0 +1,246 @@
+## finetune_preprocess.py
+
+import hashlib
+import json
+import os
+import shutil
+from datasets import Dataset, load_from_disk
+from datasets.fingerprint import Hasher
+from sequence_packing import pack_dataset, packing_utilization
+from input_builder import build_ranked_inputs
+from prompt_templates import batch_instructions, encode_model_inputs, template_prefix_ids, templates_fingerprint
+
+# Bump this whenever the tokenized output format changes so stale caches are not reused
+PREPROCESS_VERSION = 1
+
+
+def load_finetune_records(dataset_path):
+    """
+    Loads the enriched JSONL dataset into flat records that can be tokenized.
+
+    Args:
+        dataset_path (str): Path to the enriched JSONL file.
+
+    Returns:
+        list: List of dicts with "template_id", "instruction", "text" and "output" strings.
+            "instruction" is only set for older records that carry the text inline;
+            templates are expanded at tokenization time.
+    """
+    records = []
+    with open(dataset_path, "r") as file:
+        for line in file:
+            record = json.loads(line)
+            output = record["output"]
+            records.append({
+                "template_id": record.get("template_id", ""),
+                "instruction": record.get("instruction", ""),
+                "text": record.get("text", ""),
+                # Nested outputs are serialized so the target is a plain string
+                "output": output if isinstance(output, str) else json.dumps(output),
+            })
+    return records
+
+
+def preprocess_data(examples, tokenizer, max_input_length=512, max_output_length=512):
+    """
+    Tokenizes a batch of examples. Padding is left to the data collator so the cached
+    shards only store the real tokens.
+    """
+    input_ids = encode_model_inputs(tokenizer, batch_instructions(examples), examples["text"], max_input_length)
+    inputs = {"input_ids": input_ids, "attention_mask": [[1] * len(ids) for ids in input_ids]}
+    labels = tokenizer(
+        examples["output"], max_length=max_output_length, truncation=True
+    )
+    inputs["labels"] = labels["input_ids"]
+    return inputs
+
+
+def preprocess_windows(examples, tokenizer, max_input_length=512, max_output_length=512, stride=128):
+    """
+    Tokenizes a batch of examples, splitting long report text into overlapping windows
+    instead of truncating it. Every window repeats the instruction and is paired with the
+    full target, so no report content is discarded.
+
+    Args:
+        examples (dict): Batch with "template_id", "instruction", "text" and "output" columns.
+        tokenizer: Hugging Face tokenizer used for preprocessing.
+        max_input_length (int): Token budget of each input window, special tokens included.
+        max_output_length (int): Maximum target length.
+        stride (int): Number of report tokens shared by consecutive windows.
+
+    Returns:
+        dict: Tokenized batch; may contain more rows than the input batch.
+    """
+    windows = {"input_ids": [], "attention_mask": [], "labels": []}
+    num_special = tokenizer.num_special_tokens_to_add()
+    labels = tokenizer(examples["output"], max_length=max_output_length, truncation=True)["input_ids"]
+
+    for instruction, text, label_ids in zip(batch_instructions(examples), examples["text"], labels):
+        prefix_ids = list(template_prefix_ids(tokenizer, instruction))
+        text_ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+
+        body_length = max_input_length - num_special - len(prefix_ids)
+        if body_length <= stride:
+            raise ValueError(
+                f"Window of {max_input_length} tokens leaves {body_length} tokens for the report, "
+                f"which must be more than the stride of {stride}"
+            )
+
+        start = 0
+        while True:
+            input_ids = tokenizer.build_inputs_with_special_tokens(prefix_ids + text_ids[start:start + body_length])
+            windows["input_ids"].append(input_ids)
+            windows["attention_mask"].append([1] * len(input_ids))
+            windows["labels"].append(label_ids)
+            if start + body_length >= len(text_ids):
+                break
+            start += body_length - stride
+
+    return windows
+
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """
+    Computes the sha256 of a file without loading it into memory at once.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def tokenized_cache_key(dataset_path, tokenizer, settings):
+    """
+    Builds the cache key for a tokenized dataset.
+
+    Args:
+        dataset_path (str): Path to the enriched JSONL file.
+        tokenizer: Hugging Face tokenizer used for preprocessing.
+        settings (dict): Every other setting that changes the tokenized output
+            (max lengths, split seed, test size, ...).
+
+    Returns:
+        str: Hex digest identifying the tokenized dataset.
+    """
+    key = {
+        "version": PREPROCESS_VERSION,
+        "dataset": hash_file(dataset_path),
+        "tokenizer": Hasher.hash(tokenizer),
+        # Records only reference templates by id, so the template texts are part of the key
+        "templates": templates_fingerprint(),
+        "settings": settings,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def build_tokenized_datasets(config, tokenizer, decoder_start_token_id=None):
+    """
+    Returns the tokenized train/test splits, tokenizing only when no cached copy exists.
+
+    The cached splits are Arrow shards written with save_to_disk and loaded back memory
+    mapped, so later runs (for example hyperparameter sweeps) skip tokenization entirely.
+
+    The "dataset_mode" setting selects how reports are turned into model inputs:
+        - "truncate": one example per report, cut at max_input_length (default).
+        - "ranked": one example per report, built from the report sections most relevant
+          to the output fields that fit in max_input_length (see input_builder.py).
+        - "window": long reports are split into overlapping windows (see preprocess_windows).
+        - "pack": like "window", and the training split is then packed so several short
+          examples share one input window (see sequence_packing.pack_dataset).
+
+    Args:
+        config (dict): Pipeline configuration. Uses the "fine_tune" section.
+        tokenizer: Hugging Face tokenizer used for preprocessing.
+        decoder_start_token_id (int): Start token of the decoder, required in "pack" mode.
+
+    Returns:
+        DatasetDict: Tokenized dataset with "train" and "test" splits.
+    """
+    fine_tune_config = config["fine_tune"]
+    dataset_path = fine_tune_config["dataset_path"]
+    cache_dir = fine_tune_config.get("tokenized_cache_dir", "../datasets/tokenized_cache")
+    num_proc = fine_tune_config.get("num_proc", 1)
+    settings = {
+        "max_input_length": fine_tune_config.get("max_input_length", 512),
+        "max_output_length": fine_tune_config.get("max_output_length", 512),
+        "seed": fine_tune_config.get("seed", 42),
+        "test_size": fine_tune_config.get("test_size", 0.1),
+        "dataset_mode": fine_tune_config.get("dataset_mode", "truncate"),
+    }
+    if settings["dataset_mode"] not in ("truncate", "ranked", "window", "pack"):
+        raise ValueError(f"Unknown dataset_mode: {settings['dataset_mode']}")
+    if settings["dataset_mode"] in ("window", "pack"):
+        settings["window_stride"] = fine_tune_config.get("window_stride", 128)
+    if settings["dataset_mode"] == "pack":
+        if decoder_start_token_id is None:
+            raise ValueError("decoder_start_token_id is required when dataset_mode is 'pack'")
+        settings["decoder_start_token_id"] = decoder_start_token_id
+
+    cache_key = tokenized_cache_key(dataset_path, tokenizer, settings)
+    cache_path = os.path.join(cache_dir, cache_key[:16])
+
+    if os.path.exists(cache_path):
+        print(f"Loading cached tokenized dataset from {cache_path}")
+        return load_from_disk(cache_path)
+
+    print(f"Tokenizing dataset with {num_proc} process(es)...")
+    dataset = Dataset.from_list(load_finetune_records(dataset_path))
+    dataset = dataset.train_test_split(test_size=settings["test_size"], seed=settings["seed"])
+    if settings["dataset_mode"] == "ranked":
+        # Replace each report with its most relevant sections before tokenizing
+        dataset = dataset.map(
+            build_ranked_inputs,
+            batched=True,
+            num_proc=num_proc,
+            fn_kwargs={"tokenizer": tokenizer, "max_input_length": settings["max_input_length"]},
+        )
+    fn_kwargs = {
+        "tokenizer": tokenizer,
+        "max_input_length": settings["max_input_length"],
+        "max_output_length": settings["max_output_length"],
+    }
+    if settings["dataset_mode"] in ("truncate", "ranked"):
+        preprocess_function = preprocess_data
+    else:
+        preprocess_function = preprocess_windows
+        fn_kwargs["stride"] = settings["window_stride"]
+    dataset = dataset.map(
+        preprocess_function,
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=dataset["train"].column_names,
+        fn_kwargs=fn_kwargs,
+    )
+
+    if settings["dataset_mode"] == "pack":
+        # Only the training split is packed; evaluation generates per example
+        before = packing_utilization(dataset["train"], settings["max_input_length"])
+        dataset["train"] = pack_dataset(
+            dataset["train"],
+            max_input_length=settings["max_input_length"],
+            max_output_length=settings["max_output_length"],
+            decoder_start_token_id=settings["decoder_start_token_id"],
+        )
+        after = packing_utilization(dataset["train"], settings["max_input_length"])
+        print(f"Packed training split: input token utilization {before:.1%} -> {after:.1%}")
+
+    # Write to a temporary folder first so an interrupted run never leaves a half-written cache
+    tmp_path = cache_path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    dataset.save_to_disk(tmp_path, num_proc=num_proc)
+    os.replace(tmp_path, cache_path)
+    print(f"Tokenized dataset cached at {cache_path}")
+
+    # Reload so training reads the memory-mapped shards instead of the in-memory copy
+    return load_from_disk(cache_path)
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+    from load_config import load_config
+
+    config = load_config("../configs/config.json")
+    tokenizer = AutoTokenizer.from_pretrained(config["fine_tune"]["model_name"])
+    build_tokenized_datasets(config, tokenizer)
@@ -11,18 +11,20 @@ from googleapiclient.http import MediaIoBaseDownload
 from google.auth.transport.requests import Request
 import googleapiclient.errors
 from scripts.load_config import load_config
-import logging
+from scripts.logging_utils import setup_logger
+from scripts.content_dedupe import DedupeStats, LocalHashIndex, group_drive_files, link_or_copy, save_dedupe_report
 
-def log_to_file(message, log_file="output_log.txt"):
+def log_to_file(message, log_file="output_log.txt", **fields):
     """
-    Writes a message to the specified log file.
+    Logs a message to the specified log file through the queued logger, so the file is
+    not reopened for every message.
 
     :param message: (str) The message to log.
     :param log_file: (str) The path to the log file.
+    :param fields: Extra fields stored with the JSON log line.
     :return:
     """
-    with open(log_file, "a") as f: # Open in append mode
-        f.write(message + "\n")
+    setup_logger(log_file, name=f"{__name__}.{os.path.basename(log_file)}").info(message, extra=fields)
 
 # Scopes needed to access the files in Google Drive
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
@@ -90,7 +92,10 @@ def list_all_files(service, folder_id, output_file="./listed_files.txt"):
 
             items = results.get('files', [])
             for item in items:
-                log_to_file(f"File: {item['name']}, ID: {item['id']}, MIME Type: {item['mimeType']}")
+                log_to_file(
+                    f"File: {item['name']}, ID: {item['id']}, MIME Type: {item['mimeType']}",
+                    file_name=item['name'], file_id=item['id'], mime_type=item['mimeType'],
+                )
                 # If it's a folder, add it to the search list
                 if item['mimeType'] == 'application/vnd.google-apps.folder':
                     folders_to_search.append(item['id'])
@@ -100,7 +105,45 @@ def list_all_files(service, folder_id, output_file="./listed_files.txt"):
             if not page_token:
                 break
 
-def search_files_recursively(service, folder_id, file_names, exact_match=True):
+def list_drive_files(service, folder_id):
+    """
+    Collect all files (not folders) within the given folder and its subfolders, handling pagination.
+
+    Args:
+        service: Authenticated Google Drive API service instance.
+        folder_id: ID of the Google Drive folder to start listing from.
+
+    Returns:
+        list: Dictionaries with the id, name and mimeType of every file found.
+    """
+    files = []
+    folders_to_search = [folder_id]
+
+    while folders_to_search:
+        current_folder = folders_to_search.pop()
+        query = f"'{current_folder}' in parents and trashed=false"
+
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=query,
+                fields="nextPageToken, files(id, name, mimeType)",
+                pageToken=page_token
+            ).execute()
+
+            for item in results.get('files', []):
+                if item['mimeType'] == 'application/vnd.google-apps.folder':
+                    folders_to_search.append(item['id'])
+                else:
+                    files.append(item)
+
+            page_token = results.get('nextPageToken', None)
+            if not page_token:
+                break
+
+    return files
+
+def search_files_recursively(service, folder_id, file_names, exact_match=True, with_metadata=False):
     """
     Search for specific files by name in a Google Drive folder and its subfolders, handling pagination.
 
@@ -109,9 +152,10 @@ def search_files_recursively(service, folder_id, file_names, exact_match=True):
         folder_id: ID of the Google Drive folder to start searching from.
         file_names: List of file names to search for.
         exact_match: Boolean to specify if the search should be exact (True) or partial (False).
+        with_metadata: Boolean to return the Drive items (id, size, md5Checksum) instead of only their IDs.
 
     Returns:
-        dict: A dictionary with file names as keys and their corresponding file IDs as values.
+        dict: A dictionary with file names as keys and their corresponding file IDs (or items) as values.
     """
     found_files = {}
     folders_to_search = [folder_id]
@@ -129,7 +173,7 @@ def search_files_recursively(service, folder_id, file_names, exact_match=True):
             try:
                 results = service.files().list(
                     q=query,
-                    fields="nextPageToken, files(id, name, mimeType)",
+                    fields="nextPageToken, files(id, name, mimeType, md5Checksum, size)",
                     pageToken=page_token
                 ).execute()
 
@@ -144,10 +188,10 @@ def search_files_recursively(service, folder_id, file_names, exact_match=True):
                     # Check for file match based on the exact_match parameter
                     elif exact_match:
                         if item['name'].strip().lower() in normalized_file_names:
-                            found_files[item['name']] = item['id']
+                            found_files[item['name']] = item if with_metadata else item['id']
                     else:
                         if any(name in item['name'].strip().lower() for name in normalized_file_names):
-                            found_files[item['name']] = item['id']
+                            found_files[item['name']] = item if with_metadata else item['id']
 
                 # Check if there are more pages to fetch
                 page_token = results.get('nextPageToken', None)
@@ -206,16 +250,21 @@ def download_file_from_drive(service, file_id, destination):
         else:
             raise
 
-def download_files_from_list(service, folder_id, file_names, download_folder, exact_match=True, list_findable=False):
+def download_files_from_list(service, folder_id, file_names, download_folder, exact_match=True, list_findable=False, dedupe_report_path=None):
     """
     Search for specific files in Google Drive and download them to a local directory.
 
+    Files with the same md5Checksum are downloaded once and the other names are hard
+    linked (or copied) to it. Files whose content is already in the download folder,
+    under the same or another name, are not downloaded again.
+
     Args:
         service: Authenticated Google Drive API service instance.
         folder_id: ID of the Google Drive folder to start searching from.
         file_names: List of file names to search for.
         download_folder: Local folder to save downloaded files.
         exact_match: Boolean to specify if the search should be exact (True) or partial (False).
+        dedupe_report_path: Optional path of the JSON report of duplicates and saved bytes.
 
     Returns:
         None: Downloads the files and logs missing files.
@@ -229,18 +278,47 @@ def download_files_from_list(service, folder_id, file_names, download_folder, ex
 
     # Search for the files recursively
     print("Searching for files recursively...")
-    found_files = search_files_recursively(service, folder_id, file_names, exact_match=exact_match)
+    found_files = search_files_recursively(service, folder_id, file_names, exact_match=exact_match, with_metadata=True)
 
     # Log found files
     print("Files Found:")
     for name in found_files:
         print(f" - {name}")
 
-    for file_name, file_id in found_files.items():
-        print(f"Downloading {file_name}...")
+    # Content already in the download folder, by MD5 (same hash Drive reports)
+    local_hashes = LocalHashIndex(download_folder)
+    local_files = local_hashes.by_hash()
+    stats = DedupeStats("download")
+
+    for group in group_drive_files(found_files):
+        file_name = group[0]
+        item = found_files[file_name]
+        md5 = item.get('md5Checksum')
+        stats.files += len(group)
+        stats.unique_contents.add(md5 or item['id'])
         destination = os.path.join(download_folder, file_name)
-        download_file_from_drive(service, file_id, destination)
-        print(f"Downloaded {file_name} to {destination}")
+
+        existing = local_files.get(md5, []) if md5 else []
+        if file_name in existing:
+            print(f"{file_name} already downloaded, skipping")
+        elif existing:
+            link_or_copy(os.path.join(download_folder, existing[0]), destination)
+            stats.add_alias(existing[0], file_name, size=item.get('size'))
+            print(f"{file_name} has the same content as {existing[0]}, linked instead of downloaded")
+        else:
+            print(f"Downloading {file_name}...")
+            download_file_from_drive(service, item['id'], destination)
+            print(f"Downloaded {file_name} to {destination}")
+
+        for alias in group[1:]:
+            if alias not in existing:
+                link_or_copy(destination, os.path.join(download_folder, alias))
+                stats.add_alias(file_name, alias, size=item.get('size'))
+                print(f"{alias} is a duplicate of {file_name}, linked instead of downloaded")
+
+    local_hashes.save()
+    if dedupe_report_path:
+        save_dedupe_report(stats, dedupe_report_path)
 
     # Report missing files
     missing_files = set(file_names) - set(found_files.keys())
@@ -0,0 +1,324 @@
+## inference_server.py
+
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import torch
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from constrained_decoding import ConstrainedExtractor
+from inference_utils import load_model, encode_records, generate_batch, parse_prediction, percentile, rank_record_inputs
+from pdf_extraction import get_text_from_pdf
+from excel_extraction import get_text_from_excel
+from load_config import load_config
+
+
+class QueueFullError(Exception):
+    """Raised when a request is shed because the batching queue is too deep."""
+    def __init__(self, retry_after):
+        super().__init__(f"Server overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ServerMetrics:
+    """
+    Thread-safe rolling statistics for the /metrics endpoint.
+    """
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.batch_sizes = deque(maxlen=window)
+        self.queue_times = deque(maxlen=window)
+        self.generation_times = deque(maxlen=window)
+        self.counters = {"requests": 0, "completed": 0, "shed": 0, "errors": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def record_batch(self, batch_size, queue_times, generation_time):
+        with self.lock:
+            self.batch_sizes.append(batch_size)
+            self.queue_times.extend(queue_times)
+            self.generation_times.append(generation_time)
+
+    def mean_generation_time(self):
+        with self.lock:
+            if not self.generation_times:
+                return None
+            return sum(self.generation_times) / len(self.generation_times)
+
+    def snapshot(self, queue_depth):
+        def summary(values):
+            if not values:
+                return {"count": 0}
+            return {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "max": max(values),
+            }
+
+        with self.lock:
+            return {
+                **self.counters,
+                "queue_depth": queue_depth,
+                "batch_size": summary(list(self.batch_sizes)),
+                "queue_time_s": summary(list(self.queue_times)),
+                "generation_time_s": summary(list(self.generation_times)),
+            }
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests into batches for one model worker thread.
+
+    A batch is dispatched as soon as it holds max_batch_size requests or the oldest request
+    in it has waited max_wait_ms, so a lone request is never delayed by more than the wait
+    window. Requests arriving while max_queue_depth are already queued are shed with a
+    retry hint derived from the recent batch generation time.
+
+    Args:
+        process_batch (callable): Takes a list of items and returns a list of results.
+        metrics (ServerMetrics): Where batch statistics are recorded.
+        max_batch_size (int): Largest batch handed to process_batch.
+        max_wait_ms (float): Longest time the first request of a batch waits for company.
+        max_queue_depth (int): Queue depth at which new requests are rejected.
+    """
+
+    def __init__(self, process_batch, metrics, max_batch_size=8, max_wait_ms=50, max_queue_depth=64):
+        self.process_batch = process_batch
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_depth = max_queue_depth
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self.worker.start()
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, item):
+        """
+        Queues an item for the next batch.
+
+        Returns:
+            Future: Resolves to the item's result.
+
+        Raises:
+            QueueFullError: If the queue is at max_queue_depth.
+        """
+        depth = self.depth()
+        if depth >= self.max_queue_depth:
+            generation_time = self.metrics.mean_generation_time() or 1.0
+            batches_ahead = depth / self.max_batch_size
+            raise QueueFullError(retry_after=max(1, round(batches_ahead * generation_time)))
+        future = Future()
+        self.queue.put((time.monotonic(), item, future))
+        return future
+
+    def _collect_batch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0][0] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+            queue_times = [started - enqueued for enqueued, _, _ in batch]
+            try:
+                results = self.process_batch([item for _, item, _ in batch])
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            self.metrics.record_batch(len(batch), queue_times, time.monotonic() - started)
+
+
+def make_batch_processor(model, tokenizer, max_input_length=512, max_new_tokens=512, decoding="free",
+                         input_mode="truncate"):
+    """
+    Builds the process_batch function that runs a list of records through the model.
+    With decoding="constrained" the documents of a batch are decoded one after another;
+    with input_mode="ranked" the reports are cut down to their most relevant sections.
+    """
+    extractor = ConstrainedExtractor(model, tokenizer) if decoding == "constrained" else None
+
+    def process_batch(records):
+        if input_mode == "ranked":
+            records = list(rank_record_inputs(records, tokenizer, max_input_length))
+        input_ids = encode_records(tokenizer, records, max_input_length)
+        if extractor is not None:
+            return [{"prediction": extractor.extract(ids)[0], "parse_error": None} for ids in input_ids]
+
+        results = []
+        for generated_text in generate_batch(model, tokenizer, input_ids, max_new_tokens):
+            prediction, parse_error = parse_prediction(generated_text)
+            results.append({
+                "prediction": prediction if parse_error is None else generated_text,
+                "parse_error": parse_error,
+            })
+        return results
+    return process_batch
+
+
+def extract_text_from_upload(file_name, content):
+    """
+    Runs the pipeline's text extraction on an uploaded PDF or Excel file.
+
+    Args:
+        file_name (str): Original file name; its extension selects the extractor.
+        content (bytes): File content.
+
+    Returns:
+        str: Extracted text.
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in (".pdf", ".xls", ".xlsx"):
+        raise ValueError(f"Unsupported file type: {file_name}")
+
+    # The extractors work on paths, so the upload is written to a temporary file
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, f"upload{extension}")
+        with open(file_path, "wb") as file:
+            file.write(content)
+        if extension == ".pdf":
+            return get_text_from_pdf(file_path)
+        return get_text_from_excel(file_path)
+
+
+class ExtractionRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes:
+        POST /extract                  JSON body {"text": ..., "document": ...}
+        POST /extract/file?filename=x  raw PDF/Excel bytes as the body
+        GET  /metrics                  batching, queue and generation statistics
+        GET  /health
+    """
+    batcher = None
+    metrics = None
+    request_timeout = 300
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.metrics.snapshot(self.batcher.depth()))
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.metrics.count("requests")
+        try:
+            if url.path == "/extract":
+                record = json.loads(self._read_body())
+                if "text" not in record:
+                    raise ValueError("Request body needs a 'text' field")
+            elif url.path == "/extract/file":
+                file_name = parse_qs(url.query).get("filename", [""])[0]
+                record = {"document": file_name, "text": extract_text_from_upload(file_name, self._read_body())}
+            else:
+                self._send_json(404, {"error": f"Unknown path {url.path}"})
+                return
+        except (ValueError, json.JSONDecodeError) as e:
+            self.metrics.count("errors")
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.metrics.count("errors")
+            self._send_json(500, {"error": str(e)})
+            return
+
+        try:
+            result = self.batcher.submit(record).result(timeout=self.request_timeout)
+        except QueueFullError as e:
+            self.metrics.count("shed")
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": str(e.retry_after)})
+            return
+        except Exception as e:
+            self.metrics.count("errors")
+            self._send_json(500, {"error": str(e)})
+            return
+
+        self.metrics.count("completed")
+        self._send_json(200, {"document": record.get("document"), **result})
+
+    def log_message(self, format, *args):
+        # Per-request access logs would dominate the console under load
+        pass
+
+
+def serve(config):
+    """
+    Starts the extraction server with the "server" and "inference" config sections.
+    """
+    server_config = config["server"]
+    inference_config = config["inference"]
+    if inference_config.get("num_threads"):
+        torch.set_num_threads(inference_config["num_threads"])
+
+    model, tokenizer = load_model(inference_config["model_dir"], quantize=server_config.get("quantize"))
+    metrics = ServerMetrics()
+    batcher = MicroBatcher(
+        make_batch_processor(
+            model,
+            tokenizer,
+            max_input_length=inference_config.get("max_input_length", 512),
+            max_new_tokens=inference_config.get("max_new_tokens", 512),
+            decoding=inference_config.get("decoding", "free"),
+            input_mode=inference_config.get("input_mode", "truncate"),
+        ),
+        metrics,
+        max_batch_size=server_config.get("max_batch_size", 8),
+        max_wait_ms=server_config.get("max_wait_ms", 50),
+        max_queue_depth=server_config.get("max_queue_depth", 64),
+    )
+
+    ExtractionRequestHandler.batcher = batcher
+    ExtractionRequestHandler.metrics = metrics
+    host, port = server_config.get("host", "127.0.0.1"), server_config.get("port", 8080)
+    httpd = ThreadingHTTPServer((host, port), ExtractionRequestHandler)
+    print(f"Serving report extraction on http://{host}:{port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    config = load_config("../configs/config.json")
+    serve(config)
@@ -0,0 +1,265 @@
+## inference_utils.py
+
+import json
+import math
+import time
+import torch
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from prompt_templates import resolve_instruction, encode_model_inputs
+from constrained_decoding import ConstrainedExtractor
+from input_builder import build_report_text, field_queries
+
+
+def load_model(model_dir, quantize=None, tokenizer_dir=None):
+    """
+    Loads a fine-tuned seq2seq model for CPU inference.
+
+    Args:
+        model_dir (str): Folder written by fine_tune_model, or a training checkpoint.
+        quantize (str): "int8" applies dynamic int8 quantization to the Linear layers;
+            None keeps fp32 weights.
+        tokenizer_dir (str): Where to load the tokenizer from when model_dir has none
+            (checkpoints written by AsyncCheckpointCallback only hold the weights).
+
+    Returns:
+        tuple: (model, tokenizer)
+    """
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir or model_dir)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_dir)
+    model.eval()
+
+    if quantize == "int8":
+        # Weights are stored as int8 and activations are quantized on the fly per batch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif quantize is not None:
+        raise ValueError(f"Unsupported quantization: {quantize}")
+
+    return model, tokenizer
+
+
+def build_model_input(record):
+    """
+    Builds the model input for a document record the same way the training inputs were
+    built (instruction, newline, report text).
+    """
+    return f"{resolve_instruction(record)}\n{record.get('text', '')}"
+
+
+def encode_records(tokenizer, records, max_input_length=512):
+    """
+    Tokenizes the model inputs of document records, reusing the cached tokenized
+    instruction prefix (see prompt_templates.encode_model_inputs).
+    """
+    return encode_model_inputs(
+        tokenizer,
+        [resolve_instruction(record) for record in records],
+        [record.get("text", "") for record in records],
+        max_input_length,
+    )
+
+
+def parse_prediction(generated_text):
+    """
+    Parses generated text as JSON.
+
+    Returns:
+        tuple: (parsed object or None, error message or None)
+    """
+    try:
+        return json.loads(generated_text), None
+    except json.JSONDecodeError as e:
+        return None, str(e)
+
+
+def generate_batch(model, tokenizer, input_ids, max_new_tokens=512, return_token_counts=False):
+    """
+    Generates outputs for one batch of tokenized inputs.
+
+    Args:
+        model: Seq2seq model.
+        tokenizer: Matching tokenizer.
+        input_ids (list): Token id lists, padded here to the longest in the batch.
+        max_new_tokens (int): Maximum generated tokens per document.
+        return_token_counts (bool): Also return the number of tokens generated per document.
+
+    Returns:
+        list: Decoded output strings, or (strings, token counts) if return_token_counts.
+    """
+    batch = tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+    with torch.inference_mode():
+        output_ids = model.generate(**batch, max_new_tokens=max_new_tokens, num_beams=1, do_sample=False)
+    outputs = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    if return_token_counts:
+        # The first position is the decoder start token; padding follows the end of each output
+        return outputs, (output_ids[:, 1:] != tokenizer.pad_token_id).sum(dim=1).tolist()
+    return outputs
+
+
+def rank_record_inputs(records, tokenizer, max_input_length=512):
+    """
+    Yields copies of the records whose "text" holds only the report sections that fit the
+    input budget (see input_builder.build_report_text).
+    """
+    queries = field_queries()
+    for record in records:
+        yield {**record, "text": build_report_text(
+            resolve_instruction(record), record.get("text", ""), tokenizer, max_input_length, queries
+        )}
+
+
+def run_batch_inference(model, tokenizer, records, batch_size=8, max_input_length=512, max_new_tokens=512,
+                        sort_window=256, decoding="free", input_mode="truncate"):
+    """
+    Runs extraction over an iterable of document records and yields predictions as soon as
+    each batch finishes.
+
+    Records are read sort_window at a time and sorted by token length inside the window,
+    so each batch holds documents of similar length and little compute goes to padding.
+    Predictions are therefore yielded in length order, not input order.
+
+    Args:
+        model: Seq2seq model (see load_model).
+        tokenizer: Matching tokenizer.
+        records (iterable): Dicts with "text" and optionally "document" and "template_id"
+            (or an inline "instruction").
+        batch_size (int): Documents per generate call.
+        max_input_length (int): Input tokens kept per document.
+        max_new_tokens (int): Maximum generated tokens per document.
+        sort_window (int): Number of records sorted together.
+        decoding (str): "free" lets the model generate the whole JSON; "constrained" walks
+            the output schema and generates only the field values, one document at a time
+            (see constrained_decoding.py).
+        input_mode (str): "truncate" cuts each input at max_input_length; "ranked" first
+            packs the report sections most relevant to the output fields into that budget
+            (see input_builder.py). Use the mode the model was fine-tuned with.
+
+    Yields:
+        dict: {"index", "document", "prediction", "parse_error", "latency_s",
+            "generated_tokens"}. "index" is the record's position in records; "prediction"
+            is the parsed JSON, or the raw text when it does not parse.
+    """
+    if decoding == "constrained":
+        extractor = ConstrainedExtractor(model, tokenizer)
+    elif decoding == "free":
+        extractor = None
+    else:
+        raise ValueError(f"Unsupported decoding: {decoding}")
+    if input_mode == "ranked":
+        records = rank_record_inputs(records, tokenizer, max_input_length)
+    elif input_mode != "truncate":
+        raise ValueError(f"Unsupported input_mode: {input_mode}")
+
+    window = []
+    offset = 0
+    for record in records:
+        window.append(record)
+        if len(window) >= sort_window:
+            yield from _run_window(
+                model, tokenizer, window, offset, batch_size, max_input_length, max_new_tokens, extractor
+            )
+            offset += len(window)
+            window = []
+    if window:
+        yield from _run_window(model, tokenizer, window, offset, batch_size, max_input_length, max_new_tokens, extractor)
+
+
+def _run_window(model, tokenizer, records, offset, batch_size, max_input_length, max_new_tokens, extractor=None):
+    encoded = encode_records(tokenizer, records, max_input_length)
+
+    if extractor is not None:
+        for index, (record, input_ids) in enumerate(zip(records, encoded)):
+            start = time.perf_counter()
+            prediction, stats = extractor.extract(input_ids)
+            yield {
+                "index": offset + index,
+                "document": record.get("document"),
+                "prediction": prediction,
+                "parse_error": None,
+                "latency_s": time.perf_counter() - start,
+                "generated_tokens": stats["generated_tokens"],
+            }
+        return
+
+    order = sorted(range(len(records)), key=lambda index: len(encoded[index]))
+    for start in range(0, len(order), batch_size):
+        batch_indices = order[start:start + batch_size]
+        batch_start = time.perf_counter()
+        outputs, token_counts = generate_batch(
+            model, tokenizer, [encoded[index] for index in batch_indices], max_new_tokens, return_token_counts=True
+        )
+        latency = time.perf_counter() - batch_start
+
+        for index, generated_text, token_count in zip(batch_indices, outputs, token_counts):
+            prediction, parse_error = parse_prediction(generated_text)
+            yield {
+                "index": offset + index,
+                "document": records[index].get("document"),
+                "prediction": prediction if parse_error is None else generated_text,
+                "parse_error": parse_error,
+                "latency_s": latency,
+                "generated_tokens": token_count,
+            }
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def benchmark_inference(model_dir, records, batch_size=8, max_input_length=512, max_new_tokens=512,
+                        decoding="free", onnx_dir=None, input_mode="truncate"):
+    """
+    Compares fp32 and dynamic int8 inference over the same documents, and ONNX Runtime
+    when an export is given.
+
+    Latency is the time from the start of a document's batch until its prediction is
+    ready, which is what a caller waiting on that document experiences.
+
+    Args:
+        model_dir (str): Folder written by fine_tune_model.
+        records (list): Document records to run.
+        batch_size (int): Documents per generate call.
+        max_input_length (int): Input tokens kept per document.
+        max_new_tokens (int): Maximum generated tokens per document.
+        decoding (str): "free" or "constrained", see run_batch_inference.
+        onnx_dir (str): Folder written by onnx_backend.export_onnx; also benchmarks it
+            ("free" decoding only).
+        input_mode (str): "truncate" or "ranked", see run_batch_inference.
+
+    Returns:
+        dict: Per variant, documents per second, p50/p95 latency in seconds, mean generated
+            tokens per document and the share of outputs that parse as JSON.
+    """
+    variants = [("fp32", lambda: load_model(model_dir)), ("int8", lambda: load_model(model_dir, quantize="int8"))]
+    if onnx_dir and decoding == "free":
+        # Imported here: onnx_backend imports this module
+        from onnx_backend import load_onnx_model
+
+        variants.append(("onnx", lambda: load_onnx_model(onnx_dir)))
+
+    results = {}
+    for name, load in variants:
+        model, tokenizer = load()
+        start = time.perf_counter()
+        predictions = list(run_batch_inference(
+            model, tokenizer, records, batch_size, max_input_length, max_new_tokens, decoding=decoding,
+            input_mode=input_mode,
+        ))
+        elapsed = time.perf_counter() - start
+        latencies = [prediction["latency_s"] for prediction in predictions]
+
+        results[name] = {
+            "docs_per_s": len(latencies) / elapsed,
+            "p50_latency_s": percentile(latencies, 0.50),
+            "p95_latency_s": percentile(latencies, 0.95),
+            "mean_generated_tokens": sum(p["generated_tokens"] for p in predictions) / len(predictions),
+            "parse_rate": sum(p["parse_error"] is None for p in predictions) / len(predictions),
+        }
+        print(
+            f"{name} ({decoding}): {results[name]['docs_per_s']:.2f} docs/s, "
+            f"p50 {results[name]['p50_latency_s']:.3f}s, p95 {results[name]['p95_latency_s']:.3f}s, "
+            f"{results[name]['mean_generated_tokens']:.1f} generated tokens/doc, "
+            f"{results[name]['parse_rate']:.0%} valid JSON"
+        )
+    return results
@@ -0,0 +1,305 @@
+## input_builder.py
+
+import json
+import math
+import re
+from collections import Counter
+from output_schema import OUTPUT_SCHEMA
+from prompt_templates import batch_instructions, resolve_instruction, template_prefix_ids
+
+# Marker get_text_from_pdf puts between the pdfminer text layer and the OCR text
+OCR_MARKER = "OCR TEXT:"
+
+# Words in report sections that point at a schema field but are not in its key name
+FIELD_SYNONYMS = {
+    "Install Date": ["date", "installed", "install", "run"],
+    "Customer": ["customer", "operator", "company"],
+    "Well Name": ["well", "lease", "name"],
+    "API #": ["api"],
+    "Tubing Size": ["tubing", "size", "od"],
+    "Tubing Weight": ["tubing", "weight", "lb", "ft"],
+    "Manufacturer": ["manufacturer", "mfg", "vendor"],
+    "Pumps": ["pump", "stages", "stg", "series"],
+    "Pump Tapers": ["taper", "stages", "total"],
+    "Intakes/Gas Separators": ["intake", "gas", "separator", "gsep"],
+    "Seals/Protectors": ["seal", "protector", "section"],
+    "Motor Manufacturer": ["motor", "manufacturer"],
+    "Motors": ["motor", "hp", "volts", "amps", "v", "a"],
+    "Calculated": ["total", "hp", "volts", "amps"],
+    "Sensors": ["sensor", "gauge", "depth", "downhole"],
+    "Cable": ["cable", "awg", "kv", "flat", "round", "profile"],
+    "VSD": ["vsd", "drive", "kva", "controller"],
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9#]+")
+SECTION_BREAK = re.compile(r"\f|\n\s*\n")
+
+
+def _terms(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def field_queries(schema=OUTPUT_SCHEMA):
+    """
+    Builds one query term set per top-level schema field from its key, its nested field
+    names and FIELD_SYNONYMS.
+    """
+    queries = {}
+    for entry in schema:
+        words = _terms(entry["key"])
+        words += [word for field in entry.get("fields", []) for word in _terms(field)]
+        words += [word for field in entry.get("columns", {}) for word in _terms(field)]
+        words += FIELD_SYNONYMS.get(entry["key"], [])
+        queries[entry["key"]] = set(words)
+    return queries
+
+
+def _normalize_line(line):
+    return " ".join(_terms(line))
+
+
+def dedupe_text_layers(text):
+    """
+    Removes OCR lines that repeat the PDF text layer.
+
+    get_text_from_pdf returns the text layer followed by an OCR copy of the same pages.
+    OCR lines are kept only when their normalized form (lowercase alphanumerics) is not
+    already in the text layer, so scanned pages and text inside images survive while the
+    duplicated copy of the text layer is dropped.
+
+    Args:
+        text (str): Extracted report text.
+
+    Returns:
+        str: Text layer followed by the OCR lines it did not already contain.
+    """
+    if OCR_MARKER not in text:
+        return text
+    text_layer, ocr_text = text.split(OCR_MARKER, 1)
+
+    seen = {_normalize_line(line) for line in text_layer.splitlines()}
+    normalized_layer = " ".join(_terms(text_layer))
+    kept = []
+    for line in ocr_text.splitlines():
+        normalized = _normalize_line(line)
+        if not normalized:
+            # Blank lines keep the section breaks of the OCR text
+            kept.append("")
+            continue
+        if normalized in seen or (len(normalized) > 10 and normalized in normalized_layer):
+            continue
+        seen.add(normalized)
+        kept.append(line)
+
+    ocr_remainder = "\n".join(kept).strip()
+    if not ocr_remainder:
+        return text_layer.strip()
+    return f"{text_layer.strip()}\n\n{ocr_remainder}"
+
+
+def split_sections(text, max_lines=40):
+    """
+    Splits report text into sections at page breaks and blank lines. Sections longer than
+    max_lines lines are cut into chunks so no single section exhausts the token budget.
+    """
+    sections = []
+    for block in SECTION_BREAK.split(text):
+        lines = [line for line in block.splitlines() if line.strip()]
+        for start in range(0, len(lines), max_lines):
+            sections.append("\n".join(lines[start:start + max_lines]))
+    return sections
+
+
+def rank_sections(sections, queries, k1=1.2, b=0.75):
+    """
+    Scores every section against every field query with BM25, treating the sections of
+    the report as the document collection.
+
+    Returns:
+        list: Per section, a dict of field -> score.
+    """
+    term_counts = [Counter(_terms(section)) for section in sections]
+    lengths = [sum(counts.values()) for counts in term_counts]
+    average_length = sum(lengths) / max(1, len(lengths)) or 1.0
+    document_frequency = Counter(term for counts in term_counts for term in counts)
+    num_sections = len(sections)
+
+    idf = {
+        term: math.log(1 + (num_sections - frequency + 0.5) / (frequency + 0.5))
+        for term, frequency in document_frequency.items()
+    }
+    scores = []
+    for counts, length in zip(term_counts, lengths):
+        norm = k1 * (1 - b + b * length / average_length)
+        section_scores = {}
+        for field, terms in queries.items():
+            score = 0.0
+            for term in terms:
+                frequency = counts.get(term)
+                if frequency:
+                    score += idf[term] * frequency * (k1 + 1) / (frequency + norm)
+            section_scores[field] = score
+        scores.append(section_scores)
+    return scores
+
+
+def select_sections(section_lengths, section_scores, budget):
+    """
+    Picks sections that fit in the token budget, favouring those that add the most field
+    coverage per token.
+
+    A section's gain is how much it raises the best score seen so far for each field, so
+    once a field is covered, sections that only repeat it stop winning. Budget left
+    after no section adds coverage is filled with the remaining sections in report order.
+
+    Args:
+        section_lengths (list): Token count per section.
+        section_scores (list): Per-section field scores from rank_sections.
+        budget (int): Number of tokens available for the report text.
+
+    Returns:
+        list: Indices of the selected sections, in report order.
+    """
+    selected = set()
+    covered = {}
+    remaining = budget
+    while True:
+        best_index, best_value = None, 0.0
+        for index, (length, scores) in enumerate(zip(section_lengths, section_scores)):
+            if index in selected or length > remaining or length == 0:
+                continue
+            gain = sum(max(0.0, score - covered.get(field, 0.0)) for field, score in scores.items())
+            if gain / length > best_value:
+                best_index, best_value = index, gain / length
+        if best_index is None:
+            break
+        selected.add(best_index)
+        remaining -= section_lengths[best_index]
+        for field, score in section_scores[best_index].items():
+            covered[field] = max(covered.get(field, 0.0), score)
+
+    for index, length in enumerate(section_lengths):
+        if index not in selected and 0 < length <= remaining:
+            selected.add(index)
+            remaining -= length
+    return sorted(selected)
+
+
+def build_report_text(instruction, text, tokenizer, max_input_length=512, queries=None):
+    """
+    Builds the report text for one model input so that instruction and report fit in
+    max_input_length tokens with as much field-relevant content as possible.
+
+    The OCR copy is deduplicated against the text layer, the report is split into sections,
+    sections are ranked against the schema fields, and the best ones are packed into the
+    tokens left after the instruction. Selected sections keep their original order.
+
+    Args:
+        instruction (str): Instruction the input starts with.
+        text (str): Extracted report text.
+        tokenizer: Tokenizer of the model.
+        max_input_length (int): Input token budget, special tokens included.
+        queries (dict): Field queries (see field_queries); built from the schema when None.
+
+    Returns:
+        str: Report text to put after the instruction.
+    """
+    sections = split_sections(dedupe_text_layers(text))
+    if not sections:
+        return ""
+    budget = (
+        max_input_length
+        - tokenizer.num_special_tokens_to_add()
+        - len(template_prefix_ids(tokenizer, instruction))
+    )
+    section_lengths = [
+        len(ids) + 1 for ids in tokenizer(sections, add_special_tokens=False)["input_ids"]
+    ]
+    if sum(section_lengths) <= budget:
+        return "\n\n".join(sections)
+
+    section_scores = rank_sections(sections, queries or field_queries())
+    selected = select_sections(section_lengths, section_scores, budget)
+    return "\n\n".join(sections[index] for index in selected)
+
+
+def build_ranked_inputs(examples, tokenizer, max_input_length=512):
+    """
+    Batched datasets.map function that replaces "text" with the ranked report text.
+    """
+    queries = field_queries()
+    return {
+        "text": [
+            build_report_text(instruction, text, tokenizer, max_input_length, queries)
+            for instruction, text in zip(batch_instructions(examples), examples["text"])
+        ]
+    }
+
+
+def _label_values(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _label_values(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _label_values(item)
+    elif isinstance(value, str) and value.strip():
+        yield value
+
+
+def answer_coverage(records, tokenizer, max_input_length=512):
+    """
+    Compares how many label values are still visible to the model with plain truncation
+    and with the ranked input builder.
+
+    Args:
+        records (list): Records with "text", "output" (dict or JSON string) and a
+            "template_id" or inline "instruction".
+        tokenizer: Fast tokenizer of the model (offsets are needed).
+        max_input_length (int): Input token budget.
+
+    Returns:
+        dict: Share of label values found in the truncated and in the ranked model input.
+    """
+    queries = field_queries()
+    found = {"truncate": 0, "ranked": 0}
+    total = 0
+    for record in records:
+        output = record["output"]
+        if isinstance(output, str):
+            output = json.loads(output)
+        values = {_normalize_line(value) for value in _label_values(output)} - {""}
+        if not values:
+            continue
+
+        instruction = resolve_instruction(record)
+        inputs = {
+            "truncate": record.get("text", ""),
+            "ranked": build_report_text(instruction, record.get("text", ""), tokenizer, max_input_length, queries),
+        }
+        for mode, text in inputs.items():
+            # The character offsets of the kept tokens show which part of the input survives truncation
+            model_input = f"{instruction}\n{text}"
+            offsets = tokenizer(
+                model_input, max_length=max_input_length, truncation=True, return_offsets_mapping=True
+            )["offset_mapping"]
+            visible = _normalize_line(model_input[:max((end for _, end in offsets), default=0)])
+            found[mode] += sum(value in visible for value in values)
+        total += len(values)
+
+    return {mode: count / max(1, total) for mode, count in found.items()}
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+    from finetune_preprocess import load_finetune_records
+    from load_config import load_config
+
+    config = load_config("../configs/config.json")
+    tokenizer = AutoTokenizer.from_pretrained(config["fine_tune"]["model_name"])
+    coverage = answer_coverage(
+        load_finetune_records(config["fine_tune"]["dataset_path"]),
+        tokenizer,
+        config["fine_tune"].get("max_input_length", 512),
+    )
+    print(f"Label values visible to the model: truncate {coverage['truncate']:.1%}, ranked {coverage['ranked']:.1%}")
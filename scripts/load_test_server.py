@@ -0,0 +1,83 @@
+## load_test_server.py
+
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from inference_utils import percentile
+from script5_batch_inference import read_jsonl
+
+
+def send_request(url, record, timeout=300):
+    """
+    Posts one document to the /extract endpoint.
+
+    Returns:
+        tuple: (HTTP status, latency in seconds)
+    """
+    body = json.dumps({"document": record.get("document"), "text": record.get("text", "")}).encode("utf-8")
+    request = urllib.request.Request(
+        f"{url}/extract", data=body, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def run_load_test(url, records, num_requests=100, concurrency=16):
+    """
+    Sends num_requests documents from concurrency client threads and reports throughput,
+    latency percentiles, shed requests and the server's own batching metrics.
+
+    Args:
+        url (str): Server base URL, e.g. http://127.0.0.1:8080.
+        records (list): Document records cycled through as request bodies.
+        num_requests (int): Total requests to send.
+        concurrency (int): Number of requests in flight at once.
+
+    Returns:
+        dict: Client-side results and the server's /metrics snapshot.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        responses = list(pool.map(lambda index: send_request(url, records[index % len(records)]), range(num_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for status, latency in responses if status == 200]
+    statuses = {}
+    for status, _ in responses:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    with urllib.request.urlopen(f"{url}/metrics") as response:
+        server_metrics = json.loads(response.read())
+
+    results = {
+        "requests": num_requests,
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "completed_per_s": len(latencies) / elapsed,
+        "p50_latency_s": percentile(latencies, 0.50) if latencies else None,
+        "p95_latency_s": percentile(latencies, 0.95) if latencies else None,
+        "p99_latency_s": percentile(latencies, 0.99) if latencies else None,
+        "server": server_metrics,
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the local extraction server")
+    parser.add_argument("input_jsonl", help="JSONL of documents with a 'text' field")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    run_load_test(args.url, list(read_jsonl(args.input_jsonl)), args.requests, args.concurrency)
@@ -1,35 +1,240 @@
 ## logging_utils.py
 
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import queue
+import threading
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+# Attributes every LogRecord has; anything else on a record came in through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line: time, level, logger, message, and any
+    fields passed with `extra=` (e.g. file name, page number, timings).
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RoutingHandler(logging.Handler):
+    """
+    Writes each record to the file handler registered for its logger name (or the nearest
+    parent name). Used by the background listener, so file writes and rotation happen off
+    the logging thread and records from worker processes land in the right file.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+        self.routes_lock = threading.Lock()
+
+    def add_route(self, logger_name, handler):
+        with self.routes_lock:
+            self.routes[logger_name] = handler
+
+    def handle(self, record):
+        name = record.name
+        handler = self.routes.get(name)
+        while handler is None and "." in name:
+            name = name.rsplit(".", 1)[0]
+            handler = self.routes.get(name)
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+        return True
+
+    def close(self):
+        for handler in set(self.routes.values()):
+            handler.close()
+        super().close()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread. Records only need to be
+    flattened (message rendered, traceback turned into text) when they leave the process.
+    """
+
+    def prepare(self, record):
+        if isinstance(self.queue, queue.SimpleQueue):
+            return record
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _LoggingState:
+    """
+    Per-process logging state: the local queue every logger writes to, the listener
+    thread that drains it, the file handlers by path and the worker queue (if any).
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.router = RoutingHandler()
+        self.file_handlers = {}
+        self.loggers = {}
+        self.listeners = []
+        self.process_queues = {}
+        self.started = False
+        self.is_worker = multiprocessing.parent_process() is not None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Worker processes do not open log files; their records wait in the local queue
+        # until configure_worker_logging forwards them to the parent
+        if self.is_worker or self.started:
+            return
+        listener = logging.handlers.QueueListener(self.queue, self.router, respect_handler_level=False)
+        listener.start()
+        self.listeners.append(listener)
+        self.started = True
+        atexit.register(shutdown_logging)
 
-def setup_logger(log_filename):
-    try:
-        # Configure the logger
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.DEBUG)
 
-        log_dir = os.path.dirname(log_filename)
-        log_base_name = os.path.dirname(log_filename)
+_state = _LoggingState()
 
-        # Create logs directory if it doesn't exist
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
+
+def _file_handler(log_filename, max_bytes, backup_count):
+    path = os.path.abspath(log_filename)
+    if path not in _state.file_handlers:
+        handler = logging.handlers.RotatingFileHandler(
+            log_filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(JsonLinesFormatter())
+        _state.file_handlers[path] = handler
+    return _state.file_handlers[path]
+
+
+def setup_logger(log_filename, name=None, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+    """
+    Returns a logger whose records are written as JSON lines to log_filename by a
+    background thread.
+
+    Logging calls only put the record on an in-memory queue; formatting, writing and
+    size-based rotation happen in the listener thread. Loggers pointing at the same file
+    share one rotating file handler. Calling this again for a configured name returns the
+    existing logger.
+
+    Args:
+        log_filename (str): Path of the log file. Its directory is created if needed.
+        name (str): Logger name; records are routed to the file by this name.
+            Defaults to this module's name, which all loggers used before.
+        max_bytes (int): Size at which the log file is rotated.
+        backup_count (int): Number of rotated files to keep.
+
+    Returns:
+        logging.Logger: The configured logger.
+    """
+    name = name or __name__
+    with _state.lock:
+        if name in _state.loggers:
+            return _state.loggers[name]
+
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+
+        if not _state.is_worker:
+            # Create logs directory if it doesn't exist
+            log_dir = os.path.dirname(log_filename)
+            if log_dir and not os.path.exists(log_dir):
+                os.makedirs(log_dir)
+            _state.router.add_route(name, _file_handler(log_filename, max_bytes, backup_count))
 
         # Check if logger already has handlers to avoid duplicate log entries
-        if not logger.handlers:
-            # Create a file handler for the log file
-            file_handler = logging.FileHandler(log_filename)
-            file_handler.setLevel(logging.DEBUG)
-
-            # Create a logging format
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-            file_handler.setFormatter(formatter)
-
-            # Add the file handler to the logger
-            logger.addHandler(file_handler)
-        # print("Logger successfully setup")
+        if not any(isinstance(handler, _QueueHandler) for handler in logger.handlers):
+            logger.addHandler(_QueueHandler(_state.queue))
+        _state.loggers[name] = logger
+        _state.start()
         return logger
-    except Exception as e:
-        # print("Logger setup is UNsuccessful")
-        raise
+
+
+def get_log_queue(start_method=None):
+    """
+    Returns the multiprocessing queue worker processes log to, starting the parent-side
+    listener that writes their records on first use. Pass it to the pool initializer
+    and call configure_worker_logging(queue) there.
+
+    Args:
+        start_method (str): Start method of the pool ("fork", "spawn", ...); the queue
+            must come from the same multiprocessing context. None uses the default.
+    """
+    context = multiprocessing.get_context(start_method)
+    with _state.lock:
+        key = context.get_start_method()
+        if key not in _state.process_queues:
+            process_queue = context.Queue()
+            listener = logging.handlers.QueueListener(process_queue, _state.router, respect_handler_level=False)
+            listener.start()
+            _state.listeners.append(listener)
+            _state.process_queues[key] = process_queue
+            _state.start()
+        return _state.process_queues[key]
+
+
+def configure_worker_logging(log_queue):
+    """
+    Sends the records of every logger in this worker process to the parent's log queue.
+
+    Loggers set up at import time (before this call) are redirected, and records they
+    logged in the meantime are forwarded. Safe to use as (part of) a pool initializer.
+    Shut such pools down with close() and join(): terminate() can kill a worker while
+    it holds the queue's write lock.
+
+    Args:
+        log_queue: Queue returned by get_log_queue() in the parent process.
+    """
+    with _state.lock:
+        _state.is_worker = True
+        pending = _state.queue
+        _state.queue = log_queue
+        for logger in _state.loggers.values():
+            for handler in logger.handlers:
+                if isinstance(handler, _QueueHandler):
+                    handler.queue = log_queue
+    while True:
+        try:
+            record = pending.get_nowait()
+        except queue.Empty:
+            break
+        log_queue.put_nowait(_QueueHandler(log_queue).prepare(record))
+
+
+def shutdown_logging():
+    """
+    Stops the listener threads after they have written every queued record, then closes
+    the log files. Registered with atexit; call it directly before os._exit or similar.
+    """
+    with _state.lock:
+        listeners, _state.listeners = _state.listeners, []
+    for listener in listeners:
+        listener.stop()
+    _state.router.close()
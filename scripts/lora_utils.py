@@ -0,0 +1,52 @@
+## lora_utils.py
+
+import os
+from peft import LoraConfig, TaskType, get_peft_model
+
+
+def apply_lora(model, lora_config):
+    """
+    Wraps a seq2seq model with LoRA adapters so only the low-rank adapter weights train.
+
+    Args:
+        model: Hugging Face seq2seq model.
+        lora_config (dict): The "lora" section of the fine_tune config. "target_modules"
+            may be left out to use peft's defaults for the model type (q and v for T5).
+
+    Returns:
+        PeftModel: The wrapped model. Its save_pretrained writes only the adapter.
+    """
+    peft_config = LoraConfig(
+        task_type=TaskType.SEQ_2_SEQ_LM,
+        r=lora_config.get("r", 16),
+        lora_alpha=lora_config.get("alpha", 32),
+        lora_dropout=lora_config.get("dropout", 0.05),
+        target_modules=lora_config.get("target_modules"),
+    )
+    model = get_peft_model(model, peft_config)
+    model.print_trainable_parameters()
+    return model
+
+
+def export_lora_model(model, tokenizer, output_dir):
+    """
+    Saves the trained adapter on its own and the adapter merged into the base weights.
+
+    The merged model in output_dir loads like any fully fine-tuned model, while the
+    adapter in output_dir/adapter is the few-MB artifact to keep per run.
+
+    Args:
+        model (PeftModel): Model returned by apply_lora, after training.
+        tokenizer: Tokenizer to save with the merged model.
+        output_dir (str): Folder for the merged model.
+
+    Returns:
+        str: Path of the adapter folder.
+    """
+    adapter_dir = os.path.join(output_dir, "adapter")
+    model.save_pretrained(adapter_dir)
+
+    merged_model = model.merge_and_unload()
+    merged_model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    return adapter_dir
@@ -0,0 +1,252 @@
+## name_reconciliation.py
+
+import json
+import os
+import re
+from collections import defaultdict
+import numpy as np
+
+# Extensions are compared separately so ".pdf" does not dominate the similarity of every name
+EXTENSION_PATTERN = re.compile(r"\.(pdf|xlsx?|xlsm|csv|docx?)$", re.IGNORECASE)
+NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+class NameReconciliationError(Exception):
+    """Raised when a file name mapping cannot be read or is malformed."""
+
+
+def normalize_name(name):
+    """
+    Normalizes a file name for comparison: lowercase, extension removed, and every run of
+    characters other than letters and digits collapsed to one space. "B-18 (2).pdf" and
+    "b_18_2.PDF" both become "b 18 2".
+    """
+    name = EXTENSION_PATTERN.sub("", str(name).strip())
+    return NON_ALNUM.sub(" ", name.lower()).strip()
+
+
+def name_extension(name):
+    match = EXTENSION_PATTERN.search(str(name).strip())
+    return match.group(1).lower() if match else ""
+
+
+def char_ngrams(text, n=3):
+    """
+    Returns the set of character n-grams of a normalized name, padded with spaces so
+    the first and last characters get their own n-grams.
+    """
+    padded = f"{' ' * (n - 1)}{text} "
+    return {padded[index:index + n] for index in range(len(padded) - n + 1)}
+
+
+class NameIndex:
+    """
+    Character n-gram inverted index over candidate file names.
+
+    Every candidate is split into its set of n-grams, and each n-gram keeps a postings
+    array of the candidates that contain it. A query only touches the postings of its own
+    n-grams, so the cost per query grows with how common its n-grams are rather than with
+    the number of candidates. Candidates are scored with the Dice coefficient
+    2 * |shared| / (|query| + |candidate|).
+
+    Args:
+        candidates (list): Candidate dicts with at least a "name" key. Other keys (source,
+            Drive id, ...) are returned unchanged with the matches.
+        n (int): n-gram length.
+        max_df_ratio (float): n-grams found in more than this share of candidates are
+            skipped when counting shared n-grams (unless the query has no others). They
+            carry little signal and would make every query touch most of the index.
+    """
+
+    def __init__(self, candidates, n=3, max_df_ratio=0.1):
+        self.n = n
+        self.candidates = list(candidates)
+        self.normalized = [normalize_name(candidate["name"]) for candidate in self.candidates]
+        self.exact = defaultdict(list)
+        postings = defaultdict(list)
+        self.gram_counts = np.zeros(len(self.candidates), dtype=np.int32)
+
+        for candidate_id, normalized in enumerate(self.normalized):
+            self.exact[normalized].append(candidate_id)
+            grams = char_ngrams(normalized, n)
+            self.gram_counts[candidate_id] = len(grams)
+            for gram in grams:
+                postings[gram].append(candidate_id)
+
+        self.postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.max_df = max(1, int(max_df_ratio * len(self.candidates)))
+
+    def search(self, name, top_k=5):
+        """
+        Ranks the candidates most similar to a file name.
+
+        Args:
+            name (str): File name to resolve.
+            top_k (int): Number of candidates to return.
+
+        Returns:
+            list: Up to top_k (candidate, score) tuples, best first. Names that are equal
+            after normalization score 1.0, with a matching extension ranked first.
+        """
+        normalized = normalize_name(name)
+        extension = name_extension(name)
+        exact_ids = self.exact.get(normalized, [])
+        if exact_ids:
+            ranked = sorted(exact_ids, key=lambda candidate_id: name_extension(self.candidates[candidate_id]["name"]) != extension)
+            return [(self.candidates[candidate_id], 1.0) for candidate_id in ranked[:top_k]]
+
+        grams = char_ngrams(normalized, self.n)
+        gram_postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        selective = [ids for ids in gram_postings if len(ids) <= self.max_df]
+        if not gram_postings:
+            return []
+
+        shared = np.bincount(np.concatenate(selective or gram_postings), minlength=len(self.candidates))
+        matched = np.flatnonzero(shared)
+        # The skipped common n-grams are added back for the matched candidates only
+        if selective and len(selective) < len(gram_postings):
+            for ids in gram_postings:
+                if len(ids) > self.max_df:
+                    shared[matched] += np.isin(matched, ids, assume_unique=True)
+
+        scores = 2.0 * shared[matched] / (len(grams) + self.gram_counts[matched])
+        if len(matched) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            matched, scores = matched[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return [(self.candidates[matched[index]], round(float(scores[index]), 4)) for index in order]
+
+
+def local_candidates(directories):
+    """
+    Lists the files in local directories as index candidates.
+    """
+    candidates = []
+    for directory in directories:
+        if not directory or not os.path.isdir(directory):
+            continue
+        for file_name in os.listdir(directory):
+            candidates.append({"name": file_name, "source": "local", "directory": directory})
+    return candidates
+
+
+def drive_candidates(drive_files):
+    """
+    Turns Google Drive listing items ({"id", "name", ...}) into index candidates.
+    """
+    return [{"name": item["name"], "source": "drive", "id": item["id"]} for item in drive_files]
+
+
+def reconcile_names(names, candidates, top_k=5, min_score=0.75, min_margin=0.05):
+    """
+    Resolves file names against candidate names from local directories and Drive.
+
+    A name is resolved when it exists exactly among the candidates or when its best
+    candidate scores at least min_score and beats the best candidate with a different
+    name by at least min_margin. Names below the threshold, or with two near-identical
+    candidates, are left unresolved with their ranked candidates for manual review.
+
+    Args:
+        names (list): File names to resolve (e.g. Excel "File Name" values).
+        candidates (list): Candidates from local_candidates and drive_candidates.
+        top_k (int): Number of ranked candidates to keep per name.
+        min_score (float): Dice score a match needs to be accepted.
+        min_margin (float): Required lead of the best candidate over the runner-up.
+
+    Returns:
+        dict: {"mapping": {name: resolved name}, "candidates": {name: [...]},
+        "unresolved": [names]}. Names present unchanged are not listed.
+    """
+    candidate_names = {candidate["name"] for candidate in candidates}
+    index = NameIndex(candidates)
+    mapping = {}
+    ranked_candidates = {}
+    unresolved = []
+
+    for name in dict.fromkeys(names):
+        if not isinstance(name, str) or not name.strip() or name in candidate_names:
+            continue
+        matches = index.search(name, top_k=top_k)
+        ranked_candidates[name] = [
+            {**candidate, "score": score} for candidate, score in matches
+        ]
+        other_scores = [score for candidate, score in matches[1:] if candidate["name"] != matches[0][0]["name"]]
+        runner_up = other_scores[0] if other_scores else 0.0
+        if matches and matches[0][1] >= min_score and matches[0][1] - runner_up >= min_margin:
+            mapping[name] = matches[0][0]["name"]
+        else:
+            unresolved.append(name)
+
+    return {"mapping": mapping, "candidates": ranked_candidates, "unresolved": unresolved}
+
+
+def save_mapping(result, mapping_path):
+    """
+    Writes a reconcile_names result as JSON.
+    """
+    mapping_dir = os.path.dirname(mapping_path)
+    if mapping_dir:
+        os.makedirs(mapping_dir, exist_ok=True)
+    with open(mapping_path, "w") as mapping_file:
+        json.dump(result, mapping_file, indent=2)
+    print(f"Resolved {len(result['mapping'])} file names, {len(result['unresolved'])} unresolved. Mapping saved at {mapping_path}")
+
+
+def load_file_name_mapping(config):
+    """
+    Loads the resolved file name mapping configured under
+    config["name_reconciliation"]["mapping_path"].
+
+    Returns:
+        dict: {name in the dataset: resolved file name}; empty when no mapping is
+        configured or the file has not been written yet.
+    """
+    mapping_path = config.get("name_reconciliation", {}).get("mapping_path")
+    if not mapping_path or not os.path.exists(mapping_path):
+        return {}
+    with open(mapping_path, "r") as mapping_file:
+        try:
+            result = json.load(mapping_file)
+        except json.JSONDecodeError as e:
+            raise NameReconciliationError(f"Invalid file name mapping {mapping_path}: {e}")
+    if not isinstance(result.get("mapping"), dict):
+        raise NameReconciliationError(f"File name mapping {mapping_path} has no 'mapping' object")
+    return result["mapping"]
+
+
+def main(config, drive_files=None):
+    """
+    Resolves the document names of the step 1 JSONL against the local download folders
+    and, when given, a Drive listing, and writes the mapping used by steps 2 and 3.
+    """
+    settings = config.get("name_reconciliation", {})
+    with open(config["output_jsonl_path"], "r") as file:
+        names = [json.loads(line).get("document") for line in file]
+
+    candidates = local_candidates(settings.get("local_dirs") or [config["download_folder"]])
+    candidates += drive_candidates(drive_files or [])
+    result = reconcile_names(
+        names,
+        candidates,
+        top_k=settings.get("top_k", 5),
+        min_score=settings.get("min_score", 0.75),
+        min_margin=settings.get("min_margin", 0.05),
+    )
+    save_mapping(result, settings.get("mapping_path", "../datasets/file_name_mapping.json"))
+    for name in result["unresolved"]:
+        best = result["candidates"].get(name, [])
+        print(f"Unresolved: {name} -> best candidate {best[0]['name']!r} ({best[0]['score']})" if best else f"Unresolved: {name} (no candidates)")
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    from load_config import load_config
+
+    config = load_config("../configs/config.json")
+    drive_files = None
+    if "--drive" in sys.argv:
+        from google_drive_file_finder import authenticate_google_drive, list_drive_files
+
+        drive_files = list_drive_files(authenticate_google_drive(config), config["google_drive_folder_id"])
+    main(config, drive_files)
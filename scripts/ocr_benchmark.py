@@ -0,0 +1,81 @@
+## ocr_benchmark.py
+
+import os
+import re
+import sys
+import time
+from collections import Counter
+from pdf_extraction import extract_text_from_pdf_with_ocr, extract_text_from_pdf_with_roi_ocr
+
+WORD_PATTERN = re.compile(r"[a-z0-9]{2,}")
+
+
+def word_recall(reference_text, text):
+    """
+    Share of the reference words (lowercase alphanumerics, counted with multiplicity)
+    that also appear in text.
+    """
+    reference = Counter(WORD_PATTERN.findall(reference_text.lower()))
+    found = Counter(WORD_PATTERN.findall(text.lower()))
+    total = sum(reference.values())
+    return sum((reference & found).values()) / total if total else 1.0
+
+
+def compare_ocr_modes(file_paths, triage_dpi=50, ocr_dpi=200):
+    """
+    OCRs each PDF with full-page OCR and with two-pass region OCR and compares time,
+    pixels sent to Tesseract, and how many full-page OCR words the region OCR recovers.
+
+    Args:
+        file_paths (list): PDFs to compare.
+        triage_dpi (int): Layout pass resolution of the region OCR.
+        ocr_dpi (int): Region resolution of the region OCR.
+
+    Returns:
+        dict: Totals for both modes plus the pixel ratio, speedup and mean word recall.
+    """
+    totals = {"full": {"seconds": 0.0, "ocr_pixels": 0}, "roi": {"seconds": 0.0, "ocr_pixels": 0}}
+    recalls = []
+    print(f"{'file':40s} {'full s':>8s} {'roi s':>8s} {'full Mpx':>9s} {'roi Mpx':>8s} {'recall':>7s}")
+    for file_path in file_paths:
+        full_stats, roi_stats = {}, {}
+        start = time.perf_counter()
+        full_text = extract_text_from_pdf_with_ocr(file_path, stats=full_stats)
+        full_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        roi_text = extract_text_from_pdf_with_roi_ocr(file_path, triage_dpi, ocr_dpi, stats=roi_stats)
+        roi_seconds = time.perf_counter() - start
+
+        recall = word_recall(full_text, roi_text)
+        recalls.append(recall)
+        for mode, seconds, stats in (("full", full_seconds, full_stats), ("roi", roi_seconds, roi_stats)):
+            totals[mode]["seconds"] += seconds
+            totals[mode]["ocr_pixels"] += stats.get("ocr_pixels", 0)
+        print(
+            f"{os.path.basename(file_path)[:40]:40s} {full_seconds:8.2f} {roi_seconds:8.2f} "
+            f"{full_stats.get('ocr_pixels', 0) / 1e6:9.2f} {roi_stats.get('ocr_pixels', 0) / 1e6:8.2f} {recall:7.1%}"
+        )
+
+    summary = {
+        **totals,
+        "pixel_ratio": totals["full"]["ocr_pixels"] / max(1, totals["roi"]["ocr_pixels"]),
+        "speedup": totals["full"]["seconds"] / max(1e-9, totals["roi"]["seconds"]),
+        "mean_word_recall": sum(recalls) / max(1, len(recalls)),
+    }
+    print(
+        f"{len(file_paths)} PDFs: full {totals['full']['seconds']:.1f} s, roi {totals['roi']['seconds']:.1f} s "
+        f"({summary['speedup']:.2f}x); {summary['pixel_ratio']:.1f}x fewer OCR pixels; "
+        f"word recall {summary['mean_word_recall']:.1%}"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    from load_config import load_config
+
+    config = load_config("../configs/config.json")
+    ocr_settings = config.get("ocr", {})
+    folder = sys.argv[1] if len(sys.argv) > 1 else config["download_folder"]
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    pdfs = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(".pdf"))[:limit]
+    compare_ocr_modes(pdfs, ocr_settings.get("triage_dpi", 50), ocr_settings.get("ocr_dpi", 200))
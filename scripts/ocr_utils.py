@@ -1,5 +1,144 @@
 ## ocr_utils.py
 
+from collections import deque
+import numpy as np
 import pytesseract
+
 def perform_ocr_on_image(image):
     return pytesseract.image_to_string(image)
+
+def _dilate_horizontally(mask, steps):
+    for _ in range(steps):
+        grown = mask.copy()
+        grown[:, 1:] |= mask[:, :-1]
+        grown[:, :-1] |= mask[:, 1:]
+        mask = grown
+    return mask
+
+def _long_runs(mask, length, axis):
+    """
+    Marks the pixels of mask that lie in a run of at least `length` set pixels along axis.
+    """
+    mask = np.moveaxis(mask, axis, -1)
+    if mask.shape[-1] < length:
+        return np.zeros_like(np.moveaxis(mask, -1, axis))
+    padded = np.concatenate([np.zeros(mask.shape[:-1] + (1,), dtype=np.int32), np.cumsum(mask, axis=-1, dtype=np.int32)], axis=-1)
+    # A full window starts at i when the ink count over [i, i + length) equals length
+    starts = (padded[..., length:] - padded[..., :-length]) == length
+    covered = np.cumsum(np.concatenate([starts, np.zeros(mask.shape[:-1] + (length - 1,), dtype=bool)], axis=-1), axis=-1, dtype=np.int32)
+    covered[..., length:] -= np.cumsum(starts, axis=-1, dtype=np.int32)[..., :covered.shape[-1] - length]
+    return np.moveaxis(covered > 0, -1, axis)
+
+def _remove_rules(ink):
+    """
+    Removes ruling lines (page frames, boxes, table grid lines) from an ink mask: runs
+    much longer than a character in one direction but only a few pixels thick in the
+    other. Solid areas such as photos and logos are kept.
+    """
+    height, width = ink.shape
+    horizontal = _long_runs(ink, max(20, width // 15), axis=1) & ~_long_runs(ink, 5, axis=0)
+    vertical = _long_runs(ink, max(20, height // 15), axis=0) & ~_long_runs(ink, 5, axis=1)
+    return ink & ~(horizontal | vertical)
+
+def _components(mask):
+    """
+    Bounding boxes (top, left, bottom, right in grid cells, exclusive end) of the
+    4-connected components of a small boolean grid.
+    """
+    seen = np.zeros_like(mask)
+    boxes = []
+    rows, cols = mask.shape
+    for row, col in zip(*np.nonzero(mask)):
+        if seen[row, col]:
+            continue
+        seen[row, col] = True
+        queue = deque([(row, col)])
+        top, left, bottom, right = row, col, row, col
+        while queue:
+            r, c = queue.popleft()
+            top, left, bottom, right = min(top, r), min(left, c), max(bottom, r), max(right, c)
+            for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= nr < rows and 0 <= nc < cols and mask[nr, nc] and not seen[nr, nc]:
+                    seen[nr, nc] = True
+                    queue.append((nr, nc))
+        boxes.append((top, left, bottom + 1, right + 1))
+    return boxes
+
+def _merge_overlapping(boxes):
+    # Bounding boxes of non-touching components can still overlap; OCR'ing both would
+    # read the shared part twice
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+def find_text_regions(image, block_size=6, ink_threshold=170, density_threshold=0.03,
+                      min_blocks=3, join_blocks=2, margin_blocks=1, merge_coverage=0.7):
+    """
+    Finds the parts of a low-resolution page image that hold text, tables or pictures.
+
+    Ruling lines are removed first so page frames and table grids do not join everything
+    into one region. The page is then cut into block_size x block_size pixel blocks; blocks
+    whose share of dark pixels is above density_threshold are marked, grown sideways by
+    join_blocks so the words and cells of a line join, and grouped into connected regions;
+    lines that touch vertically form one region, blank space between sections splits them.
+    Regions smaller than min_blocks blocks (specks, scan noise) are dropped and the rest
+    get margin_blocks of margin so edge strokes are not cut off.
+
+    Args:
+        image (PIL.Image): Page rendered at a low DPI.
+        block_size (int): Block edge in pixels of the low-resolution image.
+        ink_threshold (int): Grey level below which a pixel counts as ink.
+        density_threshold (float): Share of ink pixels that marks a block.
+        min_blocks (int): Smallest region, in blocks, that is kept.
+        join_blocks (int): Blocks added left and right of marked blocks before grouping.
+        margin_blocks (int): Margin, in blocks, added around every region.
+        merge_coverage (float): If the regions cover more than this share of the page,
+            the whole page is returned as one region.
+
+    Returns:
+        list: Regions as (left, top, right, bottom) fractions of the page width and
+        height, in reading order (top to bottom, then left to right).
+    """
+    gray = np.asarray(image.convert("L"))
+    height, width = gray.shape
+    rows, cols = -(-height // block_size), -(-width // block_size)
+    ink = np.zeros((rows * block_size, cols * block_size), dtype=np.float32)
+    ink[:height, :width] = _remove_rules(gray < ink_threshold)
+    density = ink.reshape(rows, block_size, cols, block_size).mean(axis=(1, 3))
+
+    marked = density > density_threshold
+    if not marked.any():
+        return []
+    grown = _dilate_horizontally(marked, join_blocks)
+
+    regions = []
+    covered = 0
+    boxes = [
+        (max(0, top - margin_blocks), max(0, left - margin_blocks), min(rows, bottom + margin_blocks), min(cols, right + margin_blocks))
+        for top, left, bottom, right in _components(grown)
+        if marked[top:bottom, left:right].sum() >= min_blocks
+    ]
+    for top, left, bottom, right in _merge_overlapping(boxes):
+        covered += (bottom - top) * (right - left)
+        regions.append((
+            left * block_size / width,
+            top * block_size / height,
+            min(1.0, right * block_size / width),
+            min(1.0, bottom * block_size / height),
+        ))
+
+    if covered > merge_coverage * rows * cols:
+        return [(0.0, 0.0, 1.0, 1.0)]
+    return sorted(regions, key=lambda region: (round(region[1], 2), region[0]))
@@ -0,0 +1,152 @@
+## onnx_backend.py
+
+import os
+import torch
+from transformers import AutoTokenizer
+from inference_utils import load_model, encode_records, generate_batch
+
+# Written by export_onnx next to the decoder files (decoder_model.onnx and
+# decoder_with_past_model.onnx, or one decoder_model_merged.onnx)
+ENCODER_FILE = "encoder_model.onnx"
+
+
+class OnnxBackendError(Exception):
+    """Raised when an ONNX export is missing or does not match the PyTorch model."""
+
+
+def export_onnx(model_dir, onnx_dir, tokenizer_dir=None):
+    """
+    Exports a fine-tuned seq2seq model to ONNX: the encoder, the decoder for the first
+    step and the decoder that takes the past keys and values, so generation does not
+    recompute earlier positions. The tokenizer is saved alongside.
+
+    Args:
+        model_dir (str): Folder written by fine_tune_model, or a training checkpoint.
+        onnx_dir (str): Folder to write the ONNX files to.
+        tokenizer_dir (str): Where to load the tokenizer from when model_dir has none.
+
+    Returns:
+        str: onnx_dir
+    """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_dir, export=True, use_cache=True)
+    model.save_pretrained(onnx_dir)
+    AutoTokenizer.from_pretrained(tokenizer_dir or model_dir).save_pretrained(onnx_dir)
+    print(f"Exported {model_dir} to ONNX at {onnx_dir}")
+    return onnx_dir
+
+
+def load_onnx_model(onnx_dir, num_threads=None):
+    """
+    Loads an export_onnx folder into ONNX Runtime on CPU.
+
+    The model has the same generate() as the PyTorch one, so generate_batch and
+    run_batch_inference work with it unchanged. optimum only uses IO binding on CUDA,
+    so on CPU the inputs and past keys and values are still copied in and out of the
+    sessions at every decoder step.
+
+    Args:
+        onnx_dir (str): Folder written by export_onnx.
+        num_threads (int): ONNX Runtime intra-op threads; None lets it use all cores.
+
+    Returns:
+        tuple: (model, tokenizer)
+    """
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    if not os.path.exists(os.path.join(onnx_dir, ENCODER_FILE)):
+        raise OnnxBackendError(f"No ONNX export in {onnx_dir}; run `python onnx_backend.py export` first")
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    model = ORTModelForSeq2SeqLM.from_pretrained(
+        onnx_dir,
+        provider="CPUExecutionProvider",
+        session_options=options,
+        use_cache=True,
+    )
+    tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+    return model, tokenizer
+
+
+def check_parity(model_dir, onnx_dir, records, max_input_length=512, max_new_tokens=64, atol=1e-3, tokenizer_dir=None):
+    """
+    Checks the ONNX export against the PyTorch model on the same documents: the logits
+    of the first decoder step must agree within atol, and greedy generation (which runs
+    the decoder with past keys and values) must produce the same text.
+
+    Args:
+        model_dir (str): Folder written by fine_tune_model.
+        onnx_dir (str): Its export_onnx folder.
+        records (list): Document records, see inference_utils.encode_records.
+        max_input_length (int): Input tokens kept per document.
+        max_new_tokens (int): Generated tokens compared per document.
+        atol (float): Largest allowed absolute logit difference.
+        tokenizer_dir (str): Where to load the tokenizer from when model_dir has none.
+
+    Returns:
+        dict: documents, max_logit_diff, same_output_rate, mismatched documents and passed.
+    """
+    torch_model, tokenizer = load_model(model_dir, tokenizer_dir=tokenizer_dir)
+    onnx_model, _ = load_onnx_model(onnx_dir)
+    encoded = encode_records(tokenizer, records, max_input_length)
+
+    max_logit_diff = 0.0
+    mismatched = []
+    for record, input_ids in zip(records, encoded):
+        batch = tokenizer.pad({"input_ids": [input_ids]}, return_tensors="pt")
+        decoder_input_ids = torch.tensor([[torch_model.config.decoder_start_token_id]])
+        with torch.inference_mode():
+            expected = torch_model(**batch, decoder_input_ids=decoder_input_ids).logits
+            actual = onnx_model(**batch, decoder_input_ids=decoder_input_ids).logits
+        max_logit_diff = max(max_logit_diff, float((expected - actual).abs().max()))
+
+        if generate_batch(torch_model, tokenizer, [input_ids], max_new_tokens) != generate_batch(
+            onnx_model, tokenizer, [input_ids], max_new_tokens
+        ):
+            mismatched.append(record.get("document"))
+
+    result = {
+        "documents": len(encoded),
+        "max_logit_diff": max_logit_diff,
+        "same_output_rate": 1 - len(mismatched) / max(1, len(encoded)),
+        "mismatched": mismatched,
+        "passed": max_logit_diff <= atol and not mismatched,
+    }
+    print(
+        f"ONNX parity on {result['documents']} documents: max logit difference {max_logit_diff:.2e} "
+        f"(tolerance {atol:.0e}), {result['same_output_rate']:.0%} identical outputs"
+    )
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from load_config import load_config
+
+    config = load_config("../configs/config.json")
+    inference_config = config["inference"]
+    parser = argparse.ArgumentParser(description="Export the fine-tuned model to ONNX and check it against PyTorch")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--records", default=config["enriched_jsonl_path"], help="JSONL of documents for the parity check")
+    parser.add_argument("--limit", type=int, default=20, help="Documents used for the parity check")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(inference_config["model_dir"], inference_config["onnx_dir"])
+    else:
+        with open(args.records, "r") as records_file:
+            parity_records = [json.loads(line) for line, _ in zip(records_file, range(args.limit))]
+        parity = check_parity(
+            inference_config["model_dir"],
+            inference_config["onnx_dir"],
+            parity_records,
+            max_input_length=inference_config.get("max_input_length", 512),
+        )
+        if not parity["passed"]:
+            raise OnnxBackendError(f"ONNX export differs from the PyTorch model: {parity}")
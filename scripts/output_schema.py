@@ -0,0 +1,76 @@
+## output_schema.py
+
+# Layout of the "output" dict that excel_to_jsonl builds for every report, in key order.
+#
+# kind "value":     a single field read from "column"; "dtype": "date" columns are written as
+#                   YYYY-MM-DD.
+# kind "instances": a list with one dict per numbered column group "<prefix> <n> <field>";
+#                   the field "" is the bare "<prefix> <n>" column, stored as "type".
+# kind "group":     a dict of fields, each read from its own column.
+# kind "record":    a list holding exactly one dict of fields, each read from its own column.
+#
+# "max_tokens" limits the tokens generated per value in constrained decoding and
+# "max_instances" the number of list entries; see constrained_decoding.py.
+OUTPUT_SCHEMA = [
+    {"key": "Install Date", "kind": "value", "column": "Install Date", "dtype": "date", "max_tokens": 12},
+    {"key": "Customer", "kind": "value", "column": "Customer"},
+    {"key": "Well Name", "kind": "value", "column": "Well Name"},
+    {"key": "API #", "kind": "value", "column": "API #"},
+    {"key": "Tubing Size", "kind": "value", "column": "Tubing Size", "max_tokens": 8},
+    {"key": "Tubing Weight", "kind": "value", "column": "Tubing Weight", "max_tokens": 8},
+    {"key": "Manufacturer", "kind": "value", "column": "Manufacturer"},
+    {"key": "Pumps", "kind": "instances", "prefix": "Pump", "fields": ["", "Series", "# Stages"], "max_instances": 4},
+    {"key": "Pump Tapers", "kind": "instances", "prefix": "Calculated Pump Taper", "fields": ["", "Total # Stages"],
+     "max_instances": 4},
+    {"key": "Intakes/Gas Separators", "kind": "instances", "prefix": "Intake/ Gas Sep", "fields": ["Series", "Model"],
+     "max_instances": 2},
+    {"key": "Seals/Protectors", "kind": "instances", "prefix": "Seal/Protector", "fields": ["Series", "Model"],
+     "max_instances": 3},
+    {"key": "Motor Manufacturer", "kind": "value", "column": "Motor Manufacturer"},
+    {"key": "Motors", "kind": "instances", "prefix": "Motor", "fields": ["Series", "Model", "HP", "V", "A"],
+     "max_instances": 3},
+    {"key": "Calculated", "kind": "group", "columns": {
+        "Total Horsepower": "Calculated Total Motor HP",
+        "Total Voltage": "Calculated Total Motor V",
+        "Total Amperage": "Calculated Total Motor A",
+    }, "max_tokens": 8},
+    {"key": "Sensors", "kind": "record", "columns": {
+        "Series": "Sensor Series",
+        "Manufacturer": "Sensor Manufacturer",
+        "Model": "Sensor Model",
+        "Depth": "Sensor Depth",
+    }},
+    {"key": "Cable", "kind": "record", "columns": {
+        "AWG": "Main Cable AWG",
+        "KV": "Cable KV",
+        "Profile": "Cable Profile",
+    }},
+    {"key": "VSD", "kind": "record", "columns": {
+        "Manufacturer": "VSD Manufacturer",
+        "Type": "VSD Type",
+        "KVA": "VSD KVA",
+        "A": "VSD A",
+    }},
+]
+
+# Token limit for values whose schema entry has no "max_tokens"
+DEFAULT_MAX_VALUE_TOKENS = 16
+
+# List length limit for instance lists whose schema entry has no "max_instances"
+DEFAULT_MAX_INSTANCES = 4
+
+
+def instance_keys(entry):
+    """
+    Returns the keys of one instance dict of an "instances" schema entry, in order.
+    """
+    return ["type" if field == "" else field for field in entry["fields"]]
+
+
+def entry_keys(entry):
+    """
+    Returns the keys of the dict(s) nested under a "group", "record" or "instances" entry.
+    """
+    if entry["kind"] == "instances":
+        return instance_keys(entry)
+    return list(entry["columns"])
@@ -0,0 +1,351 @@
+## page_transport.py
+
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context, shared_memory
+import numpy as np
+from PIL import Image
+
+TRANSPORTS = ("mmap", "shm")
+PPM_MAGIC = {b"P5": 1, b"P6": 3}
+
+
+class PageTransportError(Exception):
+    """Raised when a page buffer cannot be written or read."""
+
+
+class PageRef:
+    """
+    Where a rendered page's pixels are: a few hundred bytes to pickle to a worker
+    instead of the page itself.
+
+    Args:
+        kind (str): "mmap" (raw PPM/PGM file) or "shm" (shared memory block).
+        name (str): File path or shared memory block name.
+        offset (int): Byte offset of the first pixel.
+        width (int): Page width in pixels.
+        height (int): Page height in pixels.
+        channels (int): 1 for grayscale, 3 for RGB.
+    """
+
+    __slots__ = ("kind", "name", "offset", "width", "height", "channels")
+
+    def __init__(self, kind, name, offset, width, height, channels):
+        self.kind = kind
+        self.name = name
+        self.offset = offset
+        self.width = width
+        self.height = height
+        self.channels = channels
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    @property
+    def nbytes(self):
+        return self.width * self.height * self.channels
+
+
+def _read_ppm_header(file_path):
+    """
+    Returns (width, height, channels, data offset) of a binary PPM (P6) or PGM (P5) with
+    8-bit samples, as pdftoppm writes them.
+    """
+    with open(file_path, "rb") as file:
+        head = file.read(512)
+    fields = []
+    position = 0
+    while len(fields) < 4:
+        while position < len(head) and head[position:position + 1].isspace():
+            position += 1
+        if head[position:position + 1] == b"#":
+            position = head.index(b"\n", position) + 1
+            continue
+        end = position
+        while end < len(head) and not head[end:end + 1].isspace():
+            end += 1
+        if end == position:
+            raise PageTransportError(f"Truncated PPM header in {file_path}")
+        fields.append(head[position:end])
+        position = end
+    magic, width, height, maxval = fields
+    if magic not in PPM_MAGIC or int(maxval) != 255:
+        raise PageTransportError(f"{file_path} is not an 8-bit binary PPM/PGM")
+    # A single whitespace byte separates the header from the pixels
+    return int(width), int(height), PPM_MAGIC[magic], position + 1
+
+
+def render_pages_to_files(file_path, spool_dir, dpi=200, grayscale=False, poppler_path=None,
+                          first_page=None, last_page=None):
+    """
+    Renders every page of a PDF straight to raw PPM (or PGM) files with pdftoppm. The
+    pixels never pass through this process: workers map the files (see open_page) and
+    Tesseract can read them by path.
+
+    Args:
+        file_path (str): Path of the PDF.
+        spool_dir (str): Directory for the page files, ideally on a RAM disk.
+        dpi (int): Render resolution.
+        grayscale (bool): Render 1-channel pages, a third of the bytes of RGB.
+        poppler_path (str): Directory of the Poppler binaries, if not on PATH.
+        first_page (int): First page to render (1-based); None starts at the first.
+        last_page (int): Last page to render; None renders to the end.
+
+    Returns:
+        list: A PageRef per page, in page order.
+    """
+    from pdf2image import convert_from_path
+
+    paths = convert_from_path(
+        file_path, dpi=dpi, output_folder=spool_dir, fmt="ppm", paths_only=True,
+        grayscale=grayscale, poppler_path=poppler_path, first_page=first_page, last_page=last_page,
+    )
+    return [page_file_ref(path) for path in sorted(paths)]
+
+
+def page_file_ref(file_path):
+    """
+    PageRef of an existing PPM/PGM page file.
+    """
+    width, height, channels, offset = _read_ppm_header(file_path)
+    return PageRef("mmap", file_path, offset, width, height, channels)
+
+
+def write_page_file(image, file_path):
+    """
+    Writes a PIL image as a raw PPM/PGM page file and returns its PageRef.
+    """
+    image = image if image.mode in ("L", "RGB") else image.convert("RGB")
+    image.save(file_path, format="PPM")
+    return page_file_ref(file_path)
+
+
+class SharedPageBuffer:
+    """
+    One shared memory block holding the pixels of a batch of pages. The renderer writes
+    each page into it once; workers attach by name and read the pixels in place.
+
+    Use as a context manager in the process that owns the pages; the block is freed on
+    exit, so all workers must be done with it by then.
+
+    Args:
+        capacity_bytes (int): Size of the block; enough for all pages to be written.
+    """
+
+    def __init__(self, capacity_bytes):
+        self.block = shared_memory.SharedMemory(create=True, size=max(1, capacity_bytes))
+        self.used = 0
+
+    @classmethod
+    def for_pages(cls, images):
+        return cls(sum(image.width * image.height * (1 if image.mode == "L" else 3) for image in images))
+
+    def write(self, image):
+        """
+        Copies a PIL page into the block (the only copy of its pixels) and returns its PageRef.
+        """
+        image = image if image.mode in ("L", "RGB") else image.convert("RGB")
+        pixels = np.asarray(image)
+        if self.used + pixels.nbytes > self.block.size:
+            raise PageTransportError(f"Shared page buffer full ({self.block.size} bytes)")
+        view = np.ndarray(pixels.shape, dtype=np.uint8, buffer=self.block.buf, offset=self.used)
+        view[...] = pixels
+        del view
+        channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+        ref = PageRef("shm", self.block.name, self.used, image.width, image.height, channels)
+        self.used += pixels.nbytes
+        return ref
+
+    def close(self):
+        self.block.close()
+        self.block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach_shared_memory(name):
+    # Pool workers share the owner's resource tracker, so attaching there needs no
+    # unregistering; 3.13 can skip tracking altogether
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+@contextmanager
+def open_page(ref):
+    """
+    Gives a read-only numpy view (height x width, or height x width x 3) of a page's
+    pixels without copying them. The view is only valid inside the with block.
+    """
+    shape = (ref.height, ref.width) if ref.channels == 1 else (ref.height, ref.width, ref.channels)
+    if ref.kind == "shm":
+        block = _attach_shared_memory(ref.name)
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=block.buf, offset=ref.offset)
+        pixels.flags.writeable = False
+        try:
+            yield pixels
+        finally:
+            # The block cannot be closed while an array still points into it
+            del pixels
+            block.close()
+    elif ref.kind == "mmap":
+        with open(ref.name, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            pixels = np.ndarray(shape, dtype=np.uint8, buffer=mapped, offset=ref.offset)
+            try:
+                yield pixels
+            finally:
+                del pixels
+    else:
+        raise PageTransportError(f"Unknown page transport {ref.kind!r}; expected one of {TRANSPORTS}")
+
+
+def crop_image(ref, box=None):
+    """
+    PIL image of a page, or of a (left, top, right, bottom) pixel box of it. Only the
+    box's pixels are copied out of the shared buffer.
+    """
+    with open_page(ref) as pixels:
+        if box is not None:
+            left, top, right, bottom = box
+            pixels = pixels[top:bottom, left:right]
+        # Copied: PIL would otherwise keep pointing into the buffer after it is closed
+        return Image.fromarray(np.array(pixels))
+
+
+def ocr_page(ref, regions=None):
+    """
+    OCRs one page buffer in a worker. A whole page stored as a file goes to Tesseract
+    by path, without being decoded or re-encoded here; otherwise each region, given as
+    (left, top, right, bottom) page fractions, is cropped from the buffer and OCR'd.
+
+    Returns:
+        str: The OCR text of the page or its regions, in the given order, as one page
+            (see text_normalizer.join_region_texts).
+    """
+    from ocr_utils import perform_ocr_on_image
+    from text_normalizer import join_region_texts
+
+    if regions is None:
+        if ref.kind == "mmap":
+            return perform_ocr_on_image(ref.name)
+        return perform_ocr_on_image(crop_image(ref, (0, 0, ref.width, ref.height)))
+    texts = []
+    for left, top, right, bottom in regions:
+        box = (int(left * ref.width), int(top * ref.height), int(round(right * ref.width)), int(round(bottom * ref.height)))
+        texts.append(perform_ocr_on_image(crop_image(ref, box)))
+    return join_region_texts(texts)
+
+
+@contextmanager
+def page_spool(spool_dir=None):
+    """
+    Temporary directory for page files, on /dev/shm when it exists so the page files
+    are in memory; removed with its pages on exit.
+    """
+    if spool_dir is None and os.path.isdir("/dev/shm"):
+        spool_dir = "/dev/shm"
+    with tempfile.TemporaryDirectory(prefix="pages_", dir=spool_dir) as directory:
+        yield directory
+
+
+def _page_checksum(page):
+    # Benchmark stand-in for OCR: reads every pixel once so the transport cost is what is measured
+    if isinstance(page, PageRef):
+        with open_page(page) as pixels:
+            return int(pixels.sum(dtype=np.uint64))
+    return int(np.asarray(page).sum(dtype=np.uint64))
+
+
+def benchmark_transports(images, num_workers=2, spool_dir=None):
+    """
+    Hands the same pages to a process pool three ways (pickled PIL images, shared memory
+    refs and mapped page files) and compares the bytes copied and the pages per second.
+
+    "Sent" is what goes through the pool's pipe, where every byte is copied into the
+    pickle, through the pipe and out again in the worker; "staged" is the one write of
+    each page into its shared buffer. The worker reads of the pixels are the same for all.
+
+    Args:
+        images (list): PIL page images.
+        num_workers (int): Pool size.
+        spool_dir (str): Parent directory of the page files; None uses /dev/shm if present.
+
+    Returns:
+        dict: Per transport the seconds, pages per second, bytes sent and bytes staged.
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=get_context("spawn")) as executor:
+        # Start the workers before timing
+        list(executor.map(abs, range(num_workers)))
+
+        start = time.perf_counter()
+        expected = list(executor.map(_page_checksum, images))
+        results["pickle"] = {
+            "seconds": time.perf_counter() - start,
+            "bytes_sent": sum(len(pickle.dumps(image, protocol=pickle.HIGHEST_PROTOCOL)) for image in images),
+            "bytes_staged": 0,
+        }
+
+        start = time.perf_counter()
+        with SharedPageBuffer.for_pages(images) as buffer:
+            refs = [buffer.write(image) for image in images]
+            checksums = list(executor.map(_page_checksum, refs))
+        results["shm"] = {
+            "seconds": time.perf_counter() - start,
+            "bytes_sent": sum(len(pickle.dumps(ref)) for ref in refs),
+            "bytes_staged": sum(ref.nbytes for ref in refs),
+        }
+        if checksums != expected:
+            raise PageTransportError("Shared memory pages differ from the pickled pages")
+
+        with page_spool(spool_dir) as directory:
+            start = time.perf_counter()
+            refs = [write_page_file(image, os.path.join(directory, f"page-{number}.ppm")) for number, image in enumerate(images)]
+            checksums = list(executor.map(_page_checksum, refs))
+            results["mmap"] = {
+                "seconds": time.perf_counter() - start,
+                "bytes_sent": sum(len(pickle.dumps(ref)) for ref in refs),
+                "bytes_staged": sum(ref.nbytes for ref in refs),
+            }
+        if checksums != expected:
+            raise PageTransportError("Mapped page files differ from the pickled pages")
+
+    megapixels = sum(image.width * image.height for image in images) / 1e6
+    print(f"{len(images)} pages, {megapixels:.0f} Mpx, {num_workers} workers")
+    print(f"{'transport':10s} {'seconds':>8s} {'pages/s':>8s} {'MB sent':>9s} {'MB staged':>10s}")
+    for transport, result in results.items():
+        result["pages_per_second"] = len(images) / max(1e-9, result["seconds"])
+        print(
+            f"{transport:10s} {result['seconds']:8.2f} {result['pages_per_second']:8.1f} "
+            f"{result['bytes_sent'] / 1e6:9.3f} {result['bytes_staged'] / 1e6:10.1f}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    # python page_transport.py [report.pdf] [dpi] [workers]; without a PDF, blank A4 pages are used
+    dpi = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    if len(sys.argv) > 1:
+        from pdf2image import convert_from_path
+        from pdf_extraction import POPPLER_PATH
+
+        pages = convert_from_path(sys.argv[1], dpi=dpi, poppler_path=POPPLER_PATH)
+    else:
+        size = (int(8.27 * dpi), int(11.69 * dpi))
+        pages = [Image.new("RGB", size, (255, 255, 255)) for _ in range(8)]
+    benchmark_transports(pages, num_workers=workers)
@@ -1,11 +1,17 @@
 ##File name: pdf_extraction.py
 
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pdfminer.high_level import extract_text
 from pdf2image import convert_from_path
 import pytesseract
 
 import logging_utils
-from ocr_utils import perform_ocr_on_image
+from ocr_utils import find_text_regions, perform_ocr_on_image
+from page_transport import ocr_page, page_spool, render_pages_to_files
+from text_normalizer import join_region_texts, normalize_report_text
 import logging
 
 # Suppress lower-level logging messages from pytesseract
@@ -15,7 +21,12 @@ logging.getLogger('pytesseract').setLevel(logging.ERROR)
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
 # logger = logging_utils.setup_logger(f'logs/{__name__}.log')
-logger = logging_utils.setup_logger(f'logs/main_log.log')
+logger = logging_utils.setup_logger(f'logs/main_log.log', name=__name__)
+
+# Explicitly provide the path to the Poppler binaries
+POPPLER_PATH = r"C:/Program Files/poppler-24.07.0/Library/bin"  # Update to your actual Poppler path
+
+OCR_MODES = ("full", "roi")
 
 class PDFExtractionError(Exception):
     """Custom exception for handling PDF extraction errors."""
@@ -29,29 +40,196 @@ def extract_text_from_pdf(file_path):
         logger.error(f"Error extracting text from PDF {file_path}")
         raise PDFExtractionError(f"Error extracting text from PDF {file_path}")
 
-def extract_text_from_pdf_with_ocr(file_path):
+@contextmanager
+def open_page_pool(page_workers):
+    """
+    Process pool that OCRs rendered pages, meant to be opened once per extraction run
+    and passed to every PDF, so the workers import Tesseract, numpy and PIL once.
+
+    Yields:
+        ProcessPoolExecutor: The pool, or None when page_workers is 1 or less (pages
+            are then OCR'd in this process).
+    """
+    if page_workers <= 1:
+        yield None
+        return
+    executor = ProcessPoolExecutor(
+        max_workers=page_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=logging_utils.configure_worker_logging,
+        initargs=(logging_utils.get_log_queue("spawn"),),
+    )
+    with executor:
+        yield executor
+
+def _ocr_pages_in_pool(jobs, page_pool):
+    """
+    OCRs (PageRef, regions) jobs in the page pool. Workers get the page refs, not the
+    pixels, and read the rendered pages in place (see page_transport.py).
+
+    Returns:
+        list: The text of each job, in job order.
+    """
+    return list(page_pool.map(ocr_page, *zip(*jobs))) if jobs else []
+
+def extract_text_from_pdf_with_ocr(file_path, stats=None, page_pool=None):
+    """
+    OCRs every page of a PDF at poppler's default DPI.
+
+    With a page pool (see open_page_pool) the pages are rendered to raw page files and
+    OCR'd by its processes, which read the files in place instead of receiving pickled
+    images.
+    """
     try:
-        # Explicitly provide the path to the Poppler binaries
-        poppler_path = r"C:/Program Files/poppler-24.07.0/Library/bin"  # Update to your actual Poppler path
+        poppler_path = POPPLER_PATH
         #print(poppler_path) # debugging
+        if page_pool is not None:
+            with page_spool() as spool_dir:
+                refs = render_pages_to_files(file_path, spool_dir, dpi=200, poppler_path=poppler_path)
+                start = time.perf_counter()
+                page_texts = _ocr_pages_in_pool([(ref, None) for ref in refs], page_pool)
+            if stats is not None:
+                stats["pages"] = stats.get("pages", 0) + len(refs)
+                stats["ocr_pixels"] = stats.get("ocr_pixels", 0) + sum(ref.width * ref.height for ref in refs)
+            logger.debug(
+                "OCR pages done",
+                extra={"file": file_path, "pages": len(refs), "seconds": round(time.perf_counter() - start, 3)},
+            )
+            return "".join(page_texts)
+
         pages = convert_from_path(file_path, poppler_path=poppler_path)
         text = ""
-        for page in pages:
-            text += perform_ocr_on_image(page)  # Assuming perform_ocr_on_image uses Tesseract
+        for page_number, page in enumerate(pages, start=1):
+            start = time.perf_counter()
+            page_text = perform_ocr_on_image(page)  # Assuming perform_ocr_on_image uses Tesseract
+            text += page_text
+            if stats is not None:
+                stats["pages"] = stats.get("pages", 0) + 1
+                stats["ocr_pixels"] = stats.get("ocr_pixels", 0) + page.width * page.height
+            logger.debug(
+                "OCR page done",
+                extra={"file": file_path, "page": page_number, "chars": len(page_text), "seconds": round(time.perf_counter() - start, 3)},
+            )
         return text
     except Exception as e:
         logger.error(f"Error performing OCR on PDF {file_path}: {e}")
         raise PDFExtractionError(f"Error performing OCR on PDF {file_path}")
 
-def get_text_from_pdf(file_path):
+def _region_box(region, width, height):
+    left, top, right, bottom = region
+    return int(left * width), int(top * height), int(round(right * width)), int(round(bottom * height))
+
+def extract_text_from_pdf_with_roi_ocr(file_path, triage_dpi=50, ocr_dpi=200, stats=None, page_pool=None):
+    """
+    Two-pass OCR: a low-DPI render of every page finds the regions that hold text,
+    tables or pictures (see ocr_utils.find_text_regions), then only the pages with
+    regions are rendered at ocr_dpi and only the regions are sent to Tesseract.
+
+    Args:
+        file_path (str): Path of the PDF.
+        triage_dpi (int): Resolution of the layout pass.
+        ocr_dpi (int): Resolution of the regions that are OCR'd.
+        stats (dict): Optional dict that receives page, region and pixel counts.
+        page_pool (ProcessPoolExecutor): Optional pool from open_page_pool that OCRs
+            the regions; the pages are then rendered to raw page files the workers crop
+            in place.
+
+    Returns:
+        str: OCR text of the regions, page by page in reading order.
+    """
+    try:
+        triage_pages = convert_from_path(file_path, dpi=triage_dpi, poppler_path=POPPLER_PATH, grayscale=True)
+        if page_pool is not None:
+            return _roi_ocr_in_pool(file_path, triage_pages, ocr_dpi, stats, page_pool)
+        text = ""
+        for page_number, triage_page in enumerate(triage_pages, start=1):
+            start = time.perf_counter()
+            regions = find_text_regions(triage_page)
+            page_text = ""
+            pixels = 0
+            if regions:
+                page = convert_from_path(
+                    file_path, dpi=ocr_dpi, first_page=page_number, last_page=page_number, poppler_path=POPPLER_PATH
+                )[0]
+                region_texts = []
+                for region in regions:
+                    crop = page.crop(_region_box(region, page.width, page.height))
+                    pixels += crop.width * crop.height
+                    region_texts.append(perform_ocr_on_image(crop))
+                page_text = join_region_texts(region_texts)
+            text += page_text
+            if stats is not None:
+                stats["pages"] = stats.get("pages", 0) + 1
+                stats["regions"] = stats.get("regions", 0) + len(regions)
+                stats["ocr_pixels"] = stats.get("ocr_pixels", 0) + pixels
+            logger.debug(
+                "ROI OCR page done",
+                extra={"file": file_path, "page": page_number, "regions": len(regions), "pixels": pixels,
+                       "chars": len(page_text), "seconds": round(time.perf_counter() - start, 3)},
+            )
+        return text
+    except Exception as e:
+        logger.error(f"Error performing ROI OCR on PDF {file_path}: {e}")
+        raise PDFExtractionError(f"Error performing ROI OCR on PDF {file_path}")
+
+def _roi_ocr_in_pool(file_path, triage_pages, ocr_dpi, stats, page_pool):
+    start = time.perf_counter()
+    with page_spool() as spool_dir:
+        jobs = []
+        for page_number, triage_page in enumerate(triage_pages, start=1):
+            regions = find_text_regions(triage_page)
+            if stats is not None:
+                stats["pages"] = stats.get("pages", 0) + 1
+                stats["regions"] = stats.get("regions", 0) + len(regions)
+            if not regions:
+                continue
+            ref = render_pages_to_files(
+                file_path, spool_dir, dpi=ocr_dpi, poppler_path=POPPLER_PATH, first_page=page_number, last_page=page_number
+            )[0]
+            if stats is not None:
+                for region in regions:
+                    left, top, right, bottom = _region_box(region, ref.width, ref.height)
+                    stats["ocr_pixels"] = stats.get("ocr_pixels", 0) + (right - left) * (bottom - top)
+            jobs.append((ref, regions))
+        text = "".join(_ocr_pages_in_pool(jobs, page_pool))
+    logger.debug(
+        "ROI OCR pages done",
+        extra={"file": file_path, "pages": len(triage_pages), "ocr_pages": len(jobs),
+               "seconds": round(time.perf_counter() - start, 3)},
+    )
+    return text
+
+def get_text_from_pdf(file_path, ocr_mode="full", triage_dpi=50, ocr_dpi=200, page_workers=1, page_pool=None):
+    """
+    Returns the PDF text layer followed by the OCR text of its pages, each normalized
+    by text_normalizer.normalize_text.
+
+    Args:
+        file_path (str): Path of the PDF.
+        ocr_mode (str): "full" OCRs whole pages at poppler's default DPI; "roi" uses
+            the two-pass region OCR of extract_text_from_pdf_with_roi_ocr.
+        triage_dpi (int): Layout pass resolution for "roi".
+        ocr_dpi (int): Region resolution for "roi".
+        page_workers (int): Processes OCR'ing the pages of this PDF when no page_pool
+            is given; the pool then only lives for this PDF.
+        page_pool (ProcessPoolExecutor): Pool from open_page_pool shared by the PDFs of
+            an extraction run (see extraction_scheduler.run_extraction_tasks).
+    """
+    if ocr_mode not in OCR_MODES:
+        raise PDFExtractionError(f"Unknown OCR mode {ocr_mode!r}; expected one of {OCR_MODES}")
     try:
         text = extract_text_from_pdf(file_path)
         if not text.strip():
             # raise PDFExtractionError(f"No text found in PDF {file_path}, attempting Pure OCR...")
             logger.info(f"No text found in PDF {file_path}, attempting OCR...")
-        ocr_text = extract_text_from_pdf_with_ocr(file_path)
+        with nullcontext(page_pool) if page_pool is not None else open_page_pool(page_workers) as pool:
+            if ocr_mode == "roi":
+                ocr_text = extract_text_from_pdf_with_roi_ocr(file_path, triage_dpi=triage_dpi, ocr_dpi=ocr_dpi, page_pool=pool)
+            else:
+                ocr_text = extract_text_from_pdf_with_ocr(file_path, page_pool=pool)
         combined_text = text + "\n" + "OCR TEXT:" + "\n" + ocr_text
-        return combined_text
+        # Layout whitespace, OCR specks, hyphenation and running headers cost tokens
+        return normalize_report_text(combined_text)
     except Exception as e:
         logger.error(f"Error getting text from PDF {file_path}: {e}")
         raise PDFExtractionError(f"Error getting text from PDF {file_path}")
\ No newline at end of file
@@ -6,6 +6,7 @@ from script1_generate_jsonl import main as run_script1
 from script2_download_files import main as run_script2
 from script3_extract_text import main as run_script3
 from script4_finetune_model import main as run_script4
+from distillation import main as run_distillation
 
 def check_flag(flag_path):
     """Checks if a flag file exists."""
@@ -56,6 +57,11 @@ def main(config_path):
         print("Step 4: Fine-tuning the model...")
         run_script4(config)
 
+        # Step 5: Distilling the fine-tuned model into a smaller student
+        if config.get("distill", {}).get("enabled", False):
+            print("Step 5: Distilling the fine-tuned model...")
+            run_distillation(config)
+
         print("Pipeline completed successfully!")
     except Exception as e:
         print("Pipeline failed!")
@@ -0,0 +1,180 @@
+## prompt_templates.py
+
+import functools
+import hashlib
+import json
+
+# The task instruction of the ESP install report extraction. The indentation is part of
+# the prompt the model was trained on, so keep it as is.
+EXTRACTION_INSTRUCTION = """
+    Extract the following information from the report if available:
+
+    Install Date
+    Customer
+    Well Name
+    API #
+    Tubing Size
+    Tubing Weight
+    Manufacturer
+
+    for each pump in the report:
+    - Pump type
+    - Pump Series
+    - Pump number of Stages
+
+    for each pump taper in the report:
+    - taper type
+    - total number of Stages
+
+    for each intake/gas separator
+    - model
+    - series
+
+    for each Seal/Protector
+    - series
+    - model
+
+    for each motor
+    - manufacturer
+    - series
+    - model
+    - horsepower
+    - voltage
+    - amperage
+
+    calculated total horsepower
+    calculated total voltage
+    calculated total amperage
+
+    sensor series
+    sensor manufacturer
+    sensor model
+    sensor depth
+
+    main cable AWG
+    Cable KV
+    Cable Profile
+
+    VSD Manufacturer
+    VSD Type
+    VSD KVA
+    VSD A
+    """
+
+# Registered prompt templates. Records refer to a template by id instead of carrying its
+# text. Never edit a registered template; add a new version so that existing datasets
+# and trained models keep the prompt they were built with.
+PROMPT_TEMPLATES = {
+    "esp_extraction_v1": EXTRACTION_INSTRUCTION,
+}
+
+DEFAULT_TEMPLATE_ID = "esp_extraction_v1"
+
+
+class PromptTemplateError(Exception):
+    """Raised when a record refers to a template that is not registered."""
+    pass
+
+
+def get_template(template_id):
+    """
+    Returns the text of a registered prompt template.
+    """
+    if template_id not in PROMPT_TEMPLATES:
+        raise PromptTemplateError(f"Unknown prompt template: {template_id}")
+    return PROMPT_TEMPLATES[template_id]
+
+
+def resolve_instruction(record):
+    """
+    Returns the instruction of a record. Older records carry the text inline as
+    "instruction"; newer ones only a "template_id". Records with neither use the default
+    template.
+    """
+    return record.get("instruction") or get_template(record.get("template_id") or DEFAULT_TEMPLATE_ID)
+
+
+def batch_instructions(examples):
+    """
+    Resolves the instruction of every row of a batched datasets.map input.
+    """
+    num_rows = len(examples["text"])
+    inline = examples.get("instruction") or [None] * num_rows
+    template_ids = examples.get("template_id") or [None] * num_rows
+    return [
+        resolve_instruction({"instruction": instruction, "template_id": template_id})
+        for instruction, template_id in zip(inline, template_ids)
+    ]
+
+
+def compact_record(record):
+    """
+    Replaces an inline instruction that matches a registered template with its id.
+
+    Returns:
+        dict: The record, without "instruction" when a template matched.
+    """
+    instruction = record.get("instruction")
+    for template_id, template in PROMPT_TEMPLATES.items():
+        if instruction == template:
+            compacted = {key: value for key, value in record.items() if key != "instruction"}
+            return {"template_id": template_id, **compacted}
+    return record
+
+
+def templates_fingerprint():
+    """Hash of the template registry, for caches of data built from expanded templates."""
+    return hashlib.sha256(json.dumps(PROMPT_TEMPLATES, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=32)
+def template_prefix_ids(tokenizer, instruction):
+    """
+    Token ids of the input prefix (instruction and newline), tokenized once per tokenizer
+    and instruction and reused for every record.
+    """
+    return tuple(tokenizer(f"{instruction}\n", add_special_tokens=False)["input_ids"])
+
+
+def encode_model_inputs(tokenizer, instructions, texts, max_input_length=512):
+    """
+    Tokenizes model inputs (instruction, newline, report text) from the cached template
+    prefix and the report text, truncated to max_input_length tokens.
+
+    Args:
+        tokenizer: Hugging Face tokenizer.
+        instructions (list): Instruction per input.
+        texts (list): Report text per input.
+        max_input_length (int): Token limit per input, special tokens included.
+
+    Returns:
+        list: Token id lists.
+    """
+    num_special = tokenizer.num_special_tokens_to_add()
+    text_ids = tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+    encoded = []
+    for instruction, ids in zip(instructions, text_ids):
+        prefix_ids = template_prefix_ids(tokenizer, instruction)
+        encoded.append(tokenizer.build_inputs_with_special_tokens(
+            (list(prefix_ids) + ids)[:max_input_length - num_special]
+        ))
+    return encoded
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Replace inline instructions in a JSONL dataset with template ids")
+    parser.add_argument("jsonl_paths", nargs="+")
+    args = parser.parse_args()
+
+    for jsonl_path in args.jsonl_paths:
+        size_before = os.path.getsize(jsonl_path)
+        with open(jsonl_path, "r") as file:
+            records = [compact_record(json.loads(line)) for line in file if line.strip()]
+        with open(jsonl_path + ".tmp", "w") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+        os.replace(jsonl_path + ".tmp", jsonl_path)
+        print(f"{jsonl_path}: {size_before} -> {os.path.getsize(jsonl_path)} bytes")
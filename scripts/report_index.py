@@ -0,0 +1,529 @@
+## report_index.py
+
+import argparse
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import time
+from collections import Counter
+import numpy as np
+from load_config import load_config
+
+INDEX_VERSION = 1
+TOKEN_PATTERN = re.compile(r"[a-z0-9#]+")
+
+# Filterable fields: filter name -> key in the record's "output"
+FILTER_FIELDS = {
+    "customer": "Customer",
+    "well_name": "Well Name",
+    "api": "API #",
+}
+
+
+class ReportIndexError(Exception):
+    """Custom exception for report index errors."""
+    pass
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def normalize_filter_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    value = " ".join(str(value).lower().split())
+    return value or None
+
+
+def _record_filters(record):
+    output = record.get("output") or {}
+    if isinstance(output, str):
+        output = json.loads(output)
+    return {name: normalize_filter_value(output.get(key)) for name, key in FILTER_FIELDS.items()}
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file)
+    os.replace(path + ".tmp", path)
+
+
+class DenseEncoder:
+    """
+    Mean-pooled sentence embeddings from a small Hugging Face encoder on CPU, e.g.
+    "sentence-transformers/all-MiniLM-L6-v2". Embeddings are L2-normalized so a dot
+    product is the cosine similarity.
+    """
+
+    def __init__(self, model_name, max_length=256, batch_size=32):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.max_length = max_length
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(
+                texts[start:start + self.batch_size], max_length=self.max_length, truncation=True,
+                padding=True, return_tensors="pt",
+            )
+            with self.torch.inference_mode():
+                hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            embeddings.append(self.torch.nn.functional.normalize(pooled, dim=-1).numpy())
+        return np.concatenate(embeddings).astype(np.float32)
+
+
+def write_segment(segment_dir, records, encoder=None):
+    """
+    Writes one immutable index segment for a list of enriched records.
+
+    Files (all arrays are .npy, opened memory-mapped when searching):
+        terms.json           term -> [postings offset, document frequency]
+        postings_docs.npy    local document ids, grouped by term
+        postings_tf.npy      term frequencies, aligned with postings_docs
+        doc_lengths.npy      number of terms per document
+        docs.json            per document: name and filter values
+        filters.json         filter -> value -> [offset, count] into filter_docs.npy
+        filter_docs.npy      sorted local document ids per filter value
+        texts.bin            UTF-8 report texts, sliced with text_offsets.npy
+        embeddings.npy       float16 dense embeddings (only with an encoder)
+
+    Args:
+        segment_dir (str): Folder to create.
+        records (list): Enriched records with "document", "text" and "output".
+        encoder (DenseEncoder): Optional encoder for dense embeddings.
+    """
+    tmp_dir = segment_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    vocabulary = {}
+    term_chunks, doc_chunks, tf_chunks = [], [], []
+    doc_lengths = np.zeros(len(records), dtype=np.int32)
+    docs = []
+    filter_docs = {name: {} for name in FILTER_FIELDS}
+    text_offsets = np.zeros(len(records) + 1, dtype=np.int64)
+
+    with open(os.path.join(tmp_dir, "texts.bin"), "wb") as texts_file:
+        for doc_id, record in enumerate(records):
+            text = record.get("text", "")
+            counts = Counter(tokenize(text))
+            term_chunks.append(np.fromiter(
+                (vocabulary.setdefault(term, len(vocabulary)) for term in counts), dtype=np.int32, count=len(counts)
+            ))
+            doc_chunks.append(np.full(len(counts), doc_id, dtype=np.int32))
+            tf_chunks.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            doc_lengths[doc_id] = sum(counts.values())
+
+            filters = _record_filters(record)
+            docs.append({"document": record.get("document"), **filters})
+            for name, value in filters.items():
+                if value is not None:
+                    filter_docs[name].setdefault(value, []).append(doc_id)
+
+            encoded = text.encode("utf-8")
+            texts_file.write(encoded)
+            text_offsets[doc_id + 1] = text_offsets[doc_id] + len(encoded)
+
+    # Group the postings by term; the stable sort keeps each term's documents in id order
+    term_ids = np.concatenate(term_chunks) if term_chunks else np.zeros(0, dtype=np.int32)
+    order = np.argsort(term_ids, kind="stable")
+    np.save(os.path.join(tmp_dir, "postings_docs.npy"), (np.concatenate(doc_chunks) if doc_chunks else term_ids)[order])
+    np.save(os.path.join(tmp_dir, "postings_tf.npy"),
+            (np.concatenate(tf_chunks) if tf_chunks else term_ids.astype(np.float32))[order])
+    frequencies = np.bincount(term_ids, minlength=len(vocabulary))
+    offsets = np.concatenate([[0], np.cumsum(frequencies)[:-1]]) if len(vocabulary) else []
+    _write_json(os.path.join(tmp_dir, "terms.json"), {
+        term: [int(offsets[term_id]), int(frequencies[term_id])] for term, term_id in vocabulary.items()
+    })
+
+    np.save(os.path.join(tmp_dir, "doc_lengths.npy"), doc_lengths)
+    np.save(os.path.join(tmp_dir, "text_offsets.npy"), text_offsets)
+    _write_json(os.path.join(tmp_dir, "docs.json"), docs)
+
+    filter_index, filter_arrays, position = {}, [], 0
+    for name, values in filter_docs.items():
+        filter_index[name] = {}
+        for value, doc_ids in values.items():
+            filter_index[name][value] = [position, len(doc_ids)]
+            filter_arrays.append(np.array(doc_ids, dtype=np.int32))
+            position += len(doc_ids)
+    np.save(os.path.join(tmp_dir, "filter_docs.npy"),
+            np.concatenate(filter_arrays) if filter_arrays else np.zeros(0, dtype=np.int32))
+    _write_json(os.path.join(tmp_dir, "filters.json"), filter_index)
+
+    if encoder is not None:
+        embeddings = encoder.encode([record.get("text", "") for record in records])
+        np.save(os.path.join(tmp_dir, "embeddings.npy"), embeddings.astype(np.float16))
+
+    os.replace(tmp_dir, segment_dir)
+
+
+class IndexSegment:
+    """
+    Read-only view of one segment; arrays are memory-mapped, the term dictionary and the
+    document list are loaded into memory.
+    """
+
+    def __init__(self, segment_dir):
+        def load(name):
+            return np.load(os.path.join(segment_dir, name), mmap_mode="r")
+
+        with open(os.path.join(segment_dir, "terms.json"), "r") as file:
+            self.terms = json.load(file)
+        with open(os.path.join(segment_dir, "docs.json"), "r") as file:
+            self.docs = json.load(file)
+        with open(os.path.join(segment_dir, "filters.json"), "r") as file:
+            self.filters = json.load(file)
+        self.postings_docs = load("postings_docs.npy")
+        self.postings_tf = load("postings_tf.npy")
+        self.doc_lengths = np.asarray(load("doc_lengths.npy"), dtype=np.float32)
+        self.filter_docs = load("filter_docs.npy")
+        self.text_offsets = load("text_offsets.npy")
+        self.texts = np.memmap(os.path.join(segment_dir, "texts.bin"), dtype=np.uint8, mode="r") \
+            if self.text_offsets[-1] > 0 else None
+        embeddings_path = os.path.join(segment_dir, "embeddings.npy")
+        self.embeddings = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+        self.alive = np.ones(len(self.docs), dtype=bool)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def text(self, doc_id):
+        if self.texts is None:
+            return ""
+        start, end = self.text_offsets[doc_id], self.text_offsets[doc_id + 1]
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def candidate_mask(self, filters):
+        """
+        Boolean mask of the live documents that match every filter. A filter value may be
+        a single value or a list of accepted values.
+        """
+        mask = self.alive.copy()
+        for name, accepted in (filters or {}).items():
+            if name not in FILTER_FIELDS:
+                raise ReportIndexError(f"Unknown filter: {name}")
+            if not isinstance(accepted, (list, tuple, set)):
+                accepted = [accepted]
+            matching = np.zeros(len(self.docs), dtype=bool)
+            for value in accepted:
+                entry = self.filters[name].get(normalize_filter_value(value))
+                if entry:
+                    matching[self.filter_docs[entry[0]:entry[0] + entry[1]]] = True
+            mask &= matching
+        return mask
+
+
+class ReportIndex:
+    """
+    Segmented on-disk search index over enriched report text.
+
+    Each add_documents call writes a new immutable segment, so newly enriched reports are
+    indexed without rewriting the existing ones. A document added again replaces its older
+    version, which is only marked deleted until compact() rewrites the index into a single
+    segment. BM25 statistics (document frequencies, average length) are combined across
+    segments at query time, so scores do not depend on how the index is segmented; replaced
+    documents still count toward them until the next compact().
+
+    Filters on customer, well name and API # are resolved to document id lists inside
+    each segment and applied to the postings before scoring, so a filtered query only
+    scores the matching reports.
+
+    Args:
+        index_dir (str): Index folder; created on the first add.
+        embedding_model (str): Optional encoder for dense embeddings (see DenseEncoder);
+            must stay the same for the lifetime of the index.
+    """
+
+    def __init__(self, index_dir, embedding_model=None):
+        self.index_dir = index_dir
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as file:
+                self.manifest = json.load(file)
+            if self.manifest.get("version") != INDEX_VERSION:
+                raise ReportIndexError(f"Index at {index_dir} has version {self.manifest.get('version')}")
+            if embedding_model and self.manifest.get("embedding_model") not in (None, embedding_model):
+                raise ReportIndexError(
+                    f"Index at {index_dir} uses embeddings from {self.manifest['embedding_model']}"
+                )
+        else:
+            self.manifest = {"version": INDEX_VERSION, "segments": [], "deleted": {},
+                             "embedding_model": embedding_model, "next_segment": 1}
+        if embedding_model and self.manifest["embedding_model"] is None and not self.manifest["segments"]:
+            self.manifest["embedding_model"] = embedding_model
+        self._encoder = None
+        self._load_segments()
+
+    def _load_segments(self):
+        self.segments = []
+        self.locations = {}
+        for name in self.manifest["segments"]:
+            segment = IndexSegment(os.path.join(self.index_dir, name))
+            deleted = self.manifest["deleted"].get(name, [])
+            if deleted:
+                segment.alive[deleted] = False
+            for doc_id, doc in enumerate(segment.docs):
+                if segment.alive[doc_id]:
+                    self.locations[doc["document"]] = (name, doc_id)
+            self.segments.append((name, segment))
+        self.num_docs = sum(int(segment.alive.sum()) for _, segment in self.segments)
+        # Term statistics include replaced documents until compact(), like document frequencies do
+        self.statistics_docs = sum(len(segment) for _, segment in self.segments)
+        total_length = sum(float(segment.doc_lengths.sum()) for _, segment in self.segments)
+        self.average_length = total_length / self.statistics_docs if self.statistics_docs else 1.0
+
+    @property
+    def encoder(self):
+        if self._encoder is None and self.manifest.get("embedding_model"):
+            self._encoder = DenseEncoder(self.manifest["embedding_model"])
+        return self._encoder
+
+    def _save_manifest(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        _write_json(self.manifest_path, self.manifest)
+
+    def add_documents(self, records):
+        """
+        Indexes a batch of enriched records as a new segment.
+
+        Args:
+            records (list): Records with "document", "text" and "output".
+
+        Returns:
+            int: Number of documents added.
+        """
+        records = [record for record in records if record.get("document")]
+        if not records:
+            return 0
+        # Within one batch the last record for a document wins
+        records = list({record["document"]: record for record in records}.values())
+
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        os.makedirs(self.index_dir, exist_ok=True)
+        write_segment(os.path.join(self.index_dir, name), records, self.encoder)
+
+        for record in records:
+            if record["document"] in self.locations:
+                old_segment, old_id = self.locations[record["document"]]
+                self.manifest["deleted"].setdefault(old_segment, []).append(old_id)
+        self.manifest["segments"].append(name)
+        self.manifest["next_segment"] += 1
+        self._save_manifest()
+        self._load_segments()
+        return len(records)
+
+    def add_jsonl(self, jsonl_path, only_new=True, batch_size=10000):
+        """
+        Indexes an enriched JSONL file (the output of step 3) in segments of batch_size
+        records. With only_new, documents already in the index with the same text are
+        skipped, so re-running after new reports were enriched only indexes those.
+        """
+        added = 0
+        batch = []
+        with open(jsonl_path, "r") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if only_new and record.get("document") in self.locations:
+                    segment_name, doc_id = self.locations[record["document"]]
+                    if self._segment(segment_name).text(doc_id) == record.get("text", ""):
+                        continue
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    added += self.add_documents(batch)
+                    batch = []
+        added += self.add_documents(batch)
+        print(f"Indexed {added} documents from {jsonl_path}; index holds {self.num_docs} documents")
+        return added
+
+    def _segment(self, name):
+        return next(segment for segment_name, segment in self.segments if segment_name == name)
+
+    def compact(self):
+        """
+        Rewrites all live documents into a single segment and drops the deleted ones.
+        """
+        records = []
+        for _, segment in self.segments:
+            for doc_id, doc in enumerate(segment.docs):
+                if not segment.alive[doc_id]:
+                    continue
+                output = {key: doc[name] for name, key in FILTER_FIELDS.items()}
+                records.append({"document": doc["document"], "text": segment.text(doc_id), "output": output})
+
+        old_segments = list(self.manifest["segments"])
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        write_segment(os.path.join(self.index_dir, name), records, self.encoder)
+        self.manifest.update({"segments": [name], "deleted": {}, "next_segment": self.manifest["next_segment"] + 1})
+        self._save_manifest()
+        self._load_segments()
+        for old_name in old_segments:
+            shutil.rmtree(os.path.join(self.index_dir, old_name))
+
+    def _bm25(self, query_terms, masks, k1=1.2, b=0.75):
+        # Document frequencies over all live segments give every segment the same idf
+        document_frequency = Counter()
+        for _, segment in self.segments:
+            for term in query_terms:
+                if term in segment.terms:
+                    document_frequency[term] += segment.terms[term][1]
+
+        results = []
+        for (_, segment), mask in zip(self.segments, masks):
+            scores = np.zeros(len(segment), dtype=np.float32)
+            for term in query_terms:
+                entry = segment.terms.get(term)
+                if entry is None:
+                    continue
+                frequency = document_frequency[term]
+                idf = math.log(1 + (self.statistics_docs - frequency + 0.5) / (frequency + 0.5))
+                doc_ids = segment.postings_docs[entry[0]:entry[0] + entry[1]]
+                tf = segment.postings_tf[entry[0]:entry[0] + entry[1]]
+                keep = mask[doc_ids]
+                doc_ids, tf = doc_ids[keep], tf[keep]
+                norm = k1 * (1 - b + b * segment.doc_lengths[doc_ids] / self.average_length)
+                scores[doc_ids] += idf * tf * (k1 + 1) / (tf + norm)
+            results.append(scores)
+        return results
+
+    def _dense(self, query, masks):
+        query_embedding = self.encoder.encode([query])[0]
+        results = []
+        for (_, segment), mask in zip(self.segments, masks):
+            scores = np.full(len(segment), -np.inf, dtype=np.float32)
+            candidates = np.flatnonzero(mask)
+            if segment.embeddings is not None and len(candidates):
+                scores[candidates] = np.asarray(segment.embeddings[candidates], dtype=np.float32) @ query_embedding
+            results.append(scores)
+        return results
+
+    @staticmethod
+    def _top(per_segment_scores, masks, k, positive_only):
+        candidates = []
+        for segment_index, (scores, mask) in enumerate(zip(per_segment_scores, masks)):
+            valid = mask & (scores > 0) if positive_only else mask & np.isfinite(scores)
+            doc_ids = np.flatnonzero(valid)
+            if len(doc_ids) > k:
+                doc_ids = doc_ids[np.argpartition(-scores[doc_ids], k - 1)[:k]]
+            candidates.extend((float(scores[doc_id]), segment_index, int(doc_id)) for doc_id in doc_ids)
+        return heapq.nlargest(k, candidates)
+
+    def search(self, query, k=10, filters=None, mode="bm25", snippet_chars=300):
+        """
+        Searches the index.
+
+        Args:
+            query (str): Free-text query.
+            k (int): Number of results.
+            filters (dict): e.g. {"customer": "Chord", "api": ["42-001", "42-002"]}; see
+                FILTER_FIELDS for the names.
+            mode (str): "bm25", "dense" (requires embeddings) or "hybrid" (reciprocal rank
+                fusion of both).
+            snippet_chars (int): Length of the text snippet returned per result.
+
+        Returns:
+            list: Dicts with "document", "score", the filter values and "snippet".
+        """
+        masks = [segment.candidate_mask(filters) for _, segment in self.segments]
+        query_terms = set(tokenize(query))
+
+        if mode == "bm25":
+            top = self._top(self._bm25(query_terms, masks), masks, k, positive_only=True)
+        elif mode in ("dense", "hybrid"):
+            if self.encoder is None:
+                raise ReportIndexError("The index has no dense embeddings")
+            dense_top = self._top(self._dense(query, masks), masks, k * 4 if mode == "hybrid" else k, False)
+            if mode == "dense":
+                top = dense_top
+            else:
+                bm25_top = self._top(self._bm25(query_terms, masks), masks, k * 4, positive_only=True)
+                fused = Counter()
+                for ranking in (bm25_top, dense_top):
+                    for rank, (_, segment_index, doc_id) in enumerate(ranking):
+                        fused[(segment_index, doc_id)] += 1 / (60 + rank)
+                top = [(score, segment_index, doc_id) for (segment_index, doc_id), score in fused.most_common(k)]
+        else:
+            raise ReportIndexError(f"Unknown search mode: {mode}")
+
+        results = []
+        for score, segment_index, doc_id in top:
+            segment = self.segments[segment_index][1]
+            doc = segment.docs[doc_id]
+            results.append({**doc, "score": score, "snippet": self._snippet(segment.text(doc_id), query_terms, snippet_chars)})
+        return results
+
+    @staticmethod
+    def _snippet(text, query_terms, snippet_chars):
+        lowered = text.lower()
+        positions = [lowered.find(term) for term in query_terms]
+        positions = [position for position in positions if position >= 0]
+        start = max(0, min(positions) - snippet_chars // 4) if positions else 0
+        return " ".join(text[start:start + snippet_chars].split())
+
+
+def benchmark_queries(index, queries, filters=None, k=10, mode="bm25"):
+    """
+    Times queries against an index.
+
+    Returns:
+        dict: p50/p95/max query latency in milliseconds.
+    """
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, k=k, filters=filters, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    result = {
+        "queries": len(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max_ms": latencies[-1],
+    }
+    print(f"{index.num_docs} documents, {mode}, filters={filters}: "
+          f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, max {result['max_ms']:.1f} ms")
+    return result
+
+
+if __name__ == "__main__":
+    config = load_config("../configs/config.json")
+    index_config = config.get("report_index", {})
+
+    parser = argparse.ArgumentParser(description="Search index over the enriched report text")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Index new or changed documents from an enriched JSONL")
+    add_parser.add_argument("jsonl_path", nargs="?", default=config["enriched_jsonl_path"])
+    subparsers.add_parser("compact", help="Merge all segments and drop replaced documents")
+    search_parser = subparsers.add_parser("search", help="Search the index")
+    search_parser.add_argument("query")
+    search_parser.add_argument("-k", type=int, default=10)
+    search_parser.add_argument("--mode", choices=["bm25", "dense", "hybrid"], default="bm25")
+    for name in FILTER_FIELDS:
+        search_parser.add_argument(f"--{name.replace('_', '-')}", dest=name)
+    args = parser.parse_args()
+
+    index = ReportIndex(index_config.get("index_dir", "../datasets/report_index"), index_config.get("embedding_model"))
+    if args.command == "add":
+        index.add_jsonl(args.jsonl_path, batch_size=index_config.get("segment_size", 10000))
+    elif args.command == "compact":
+        index.compact()
+    else:
+        filters = {name: getattr(args, name) for name in FILTER_FIELDS if getattr(args, name)}
+        for result in index.search(args.query, k=args.k, filters=filters, mode=args.mode):
+            print(f"{result['score']:.3f}  {result['document']}  [{result['customer']} | {result['well_name']} | "
+                  f"{result['api']}]\n    {result['snippet']}")
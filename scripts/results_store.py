@@ -0,0 +1,413 @@
+## results_store.py
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import time
+import pandas as pd
+from output_schema import OUTPUT_SCHEMA
+from load_config import load_config
+
+# Bump this whenever the table layout changes; an older store has to be rebuilt
+STORE_VERSION = 1
+LEADING_NUMBER = re.compile(r"^[-+]?(\d[\d,]*\.?\d*|\.\d+)")
+
+# Columns of the reports table: (output key, nested key or None) -> (column, SQLite type).
+# Customer, well name and API # compare case-insensitively.
+REPORT_COLUMNS = {
+    ("Install Date", None): ("install_date", "TEXT"),
+    ("Customer", None): ("customer", "TEXT COLLATE NOCASE"),
+    ("Well Name", None): ("well_name", "TEXT COLLATE NOCASE"),
+    ("API #", None): ("api", "TEXT COLLATE NOCASE"),
+    ("Tubing Size", None): ("tubing_size", "TEXT"),
+    ("Tubing Weight", None): ("tubing_weight", "REAL"),
+    ("Manufacturer", None): ("manufacturer", "TEXT"),
+    ("Motor Manufacturer", None): ("motor_manufacturer", "TEXT"),
+    ("Calculated", "Total Horsepower"): ("total_hp", "REAL"),
+    ("Calculated", "Total Voltage"): ("total_volts", "REAL"),
+    ("Calculated", "Total Amperage"): ("total_amps", "REAL"),
+}
+REPORT_INDEXES = ["customer", "well_name", "api", "install_date"]
+
+# One table per list in the output: output key -> (table, {instance key: (column, SQLite type)})
+EQUIPMENT_TABLES = {
+    "Pumps": ("pumps", {"type": ("type", "TEXT"), "Series": ("series", "TEXT"), "# Stages": ("stages", "REAL")}),
+    "Pump Tapers": ("pump_tapers", {"type": ("type", "TEXT"), "Total # Stages": ("total_stages", "REAL")}),
+    "Intakes/Gas Separators": ("intakes", {"Series": ("series", "TEXT"), "Model": ("model", "TEXT")}),
+    "Seals/Protectors": ("seals", {"Series": ("series", "TEXT"), "Model": ("model", "TEXT")}),
+    "Motors": ("motors", {
+        "Series": ("series", "TEXT"), "Model": ("model", "TEXT"),
+        "HP": ("hp", "REAL"), "V": ("volts", "REAL"), "A": ("amps", "REAL"),
+    }),
+    "Sensors": ("sensors", {
+        "Series": ("series", "TEXT"), "Manufacturer": ("manufacturer", "TEXT"),
+        "Model": ("model", "TEXT"), "Depth": ("depth", "REAL"),
+    }),
+    "Cable": ("cables", {"AWG": ("awg", "TEXT"), "KV": ("kv", "REAL"), "Profile": ("profile", "TEXT")}),
+    "VSD": ("vsds", {
+        "Manufacturer": ("manufacturer", "TEXT"), "Type": ("type", "TEXT"),
+        "KVA": ("kva", "REAL"), "A": ("amps", "REAL"),
+    }),
+}
+
+
+class ResultsStoreError(Exception):
+    """Custom exception for results store errors."""
+    pass
+
+
+def _check_schema_coverage():
+    # Every output field needs a column, or it would be silently dropped from the store
+    for entry in OUTPUT_SCHEMA:
+        key = entry["key"]
+        if entry["kind"] == "value":
+            covered = (key, None) in REPORT_COLUMNS
+        elif entry["kind"] == "group":
+            covered = all((key, field) in REPORT_COLUMNS for field in entry["columns"])
+        else:
+            covered = key in EQUIPMENT_TABLES
+        if not covered:
+            raise ResultsStoreError(f"Output field {key!r} has no column in the results store")
+
+
+def _as_text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    text = " ".join(str(value).split())
+    return text if text and text.lower() not in ("nan", "null", "none") else None
+
+
+def _as_number(value):
+    # Leading number of the value, so "1,200" and "520 KVA" are stored as 1200 and 520
+    text = _as_text(value)
+    if text is None:
+        return None
+    match = LEADING_NUMBER.match(text)
+    return float(match.group(0).replace(",", "")) if match else None
+
+
+def _convert(value, sql_type):
+    return _as_number(value) if sql_type == "REAL" else _as_text(value)
+
+
+def _equipment_items(value):
+    if isinstance(value, dict):
+        return [value]
+    return [item for item in value if isinstance(item, dict)] if isinstance(value, list) else []
+
+
+class ResultsStore:
+    """
+    SQLite store of extracted report fields in typed, indexed tables, so fleet questions
+    ("wells of customer X with a motor above 200 HP") are answered by index lookups
+    instead of parsing every JSONL record.
+
+    Every report is one row of the reports table per source, keyed by document and
+    source ("label" for excel_to_jsonl outputs, or the name of a model whose predictions
+    were ingested), with the single-valued fields and the whole output as JSON. The
+    equipment lists (pumps, motors, seals, cables, VSDs, ...) go to one table each, one
+    row per instance in output order. Numeric fields are stored as REAL, so range
+    conditions compare numbers; the raw text stays in the reports row.
+
+    Args:
+        db_path (str): SQLite file; created with its tables on first use.
+    """
+
+    def __init__(self, db_path):
+        _check_schema_coverage()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, STORE_VERSION):
+            raise ResultsStoreError(f"Results store at {db_path} has version {version}; rebuild it")
+        self._create_tables()
+
+    def _create_tables(self):
+        report_columns = ", ".join(f'"{column}" {sql_type}' for column, sql_type in REPORT_COLUMNS.values())
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS reports (document TEXT, source TEXT, {report_columns}, "
+            f"output TEXT, output_hash TEXT, updated REAL, PRIMARY KEY (document, source))",
+            *(f"CREATE INDEX IF NOT EXISTS reports_{column} ON reports ({column})" for column in REPORT_INDEXES),
+        ]
+        for table, columns in EQUIPMENT_TABLES.values():
+            table_columns = ", ".join(f'"{column}" {sql_type}' for column, sql_type in columns.values())
+            statements.append(
+                f"CREATE TABLE IF NOT EXISTS {table} (document TEXT, source TEXT, position INTEGER, "
+                f"{table_columns}, PRIMARY KEY (document, source, position))"
+            )
+            # Range conditions are on the numeric fields
+            statements.extend(
+                f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})"
+                for column, sql_type in columns.values() if sql_type == "REAL"
+            )
+        for statement in statements:
+            self.connection.execute(statement)
+        self.connection.execute(f"PRAGMA user_version = {STORE_VERSION}")
+        self.connection.commit()
+
+    def upsert_document(self, document, output, source="label"):
+        """
+        Inserts or replaces the fields of one report. A report whose output did not change
+        since it was stored is left untouched.
+
+        Args:
+            document (str): Report file name, as in the JSONL "document" field.
+            output (dict): The report's "output" dict (see output_schema.py).
+            source (str): "label", or the name of the model that predicted the output.
+
+        Returns:
+            bool: Whether the store changed. Call commit() to persist the changes.
+        """
+        serialized = json.dumps(output, sort_keys=True)
+        output_hash = hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+        stored = self.connection.execute(
+            "SELECT output_hash FROM reports WHERE document = ? AND source = ?", (document, source)
+        ).fetchone()
+        if stored is not None and stored[0] == output_hash:
+            return False
+
+        values = []
+        for (key, field), (_, sql_type) in REPORT_COLUMNS.items():
+            value = output.get(key)
+            if field is not None:
+                value = value.get(field) if isinstance(value, dict) else None
+            values.append(_convert(value, sql_type))
+        columns = ", ".join(f'"{column}"' for column, _ in REPORT_COLUMNS.values())
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO reports (document, source, {columns}, output, output_hash, updated) "
+            f"VALUES ({', '.join('?' * (len(values) + 5))})",
+            (document, source, *values, serialized, output_hash, time.time()),
+        )
+
+        for key, (table, table_columns) in EQUIPMENT_TABLES.items():
+            self.connection.execute(f"DELETE FROM {table} WHERE document = ? AND source = ?", (document, source))
+            rows = [
+                (document, source, position,
+                 *(_convert(item.get(field), sql_type) for field, (_, sql_type) in table_columns.items()))
+                for position, item in enumerate(_equipment_items(output.get(key)))
+            ]
+            if rows:
+                self.connection.executemany(
+                    f"INSERT INTO {table} VALUES ({', '.join('?' * (len(table_columns) + 3))})", rows
+                )
+        return True
+
+    def ingest_jsonl(self, jsonl_path, source="label", commit_every=500):
+        """
+        Upserts every report of a JSONL file: excel_to_jsonl or enriched dataset records
+        (with "output") or script5 predictions (with "prediction"; those that did not
+        parse as JSON are skipped).
+
+        Args:
+            jsonl_path (str): JSONL file to ingest.
+            source (str): "label" for labels, or the name of the predicting model.
+            commit_every (int): Reports upserted per transaction.
+
+        Returns:
+            dict: Number of reports read, updated, unchanged and skipped.
+        """
+        counts = {"documents": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+        start = time.perf_counter()
+        with open(jsonl_path, "r") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                counts["documents"] += 1
+                output = record["output"] if "output" in record else record.get("prediction")
+                if isinstance(output, str) and "output" in record:
+                    # load_finetune_records style records serialize the output
+                    output = json.loads(output)
+                if not isinstance(output, dict) or not record.get("document"):
+                    counts["skipped"] += 1
+                    continue
+                if self.upsert_document(record["document"], output, source):
+                    counts["updated"] += 1
+                else:
+                    counts["unchanged"] += 1
+                if counts["documents"] % commit_every == 0:
+                    self.commit()
+        self.commit()
+        print(
+            f"Ingested {jsonl_path} as {source!r} in {time.perf_counter() - start:.1f}s: "
+            f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['skipped']} skipped"
+        )
+        return counts
+
+    def query(self, sql, params=()):
+        """
+        Runs a read query against the store.
+
+        Returns:
+            pd.DataFrame: The result rows.
+        """
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def find_equipment(self, table, source="label", customer=None, well_name=None, api=None,
+                       min_values=None, max_values=None):
+        """
+        Equipment rows with the identifying fields of their report, filtered by report and
+        by numeric ranges, e.g. find_equipment("motors", customer="Chord", min_values={"hp": 200}).
+
+        Args:
+            table (str): Equipment table, e.g. "motors" or "pumps".
+            source (str): "label" or the name of a predicting model.
+            customer (str): Only reports of this customer (case-insensitive).
+            well_name (str): Only reports of this well (case-insensitive).
+            api (str): Only reports with this API # (case-insensitive).
+            min_values (dict): Column -> inclusive lower bound.
+            max_values (dict): Column -> inclusive upper bound.
+
+        Returns:
+            pd.DataFrame: Matching rows with document, install_date, customer, well_name and
+                api first.
+        """
+        columns = [column for table_name, table_columns in EQUIPMENT_TABLES.values() if table_name == table
+                   for column, _ in table_columns.values()]
+        if not columns:
+            raise ResultsStoreError(f"Unknown equipment table: {table}")
+
+        conditions, params = ["r.source = ?"], [source]
+        for column, value in (("customer", customer), ("well_name", well_name), ("api", api)):
+            if value is not None:
+                conditions.append(f"r.{column} = ?")
+                params.append(value)
+        for bounds, operator in ((min_values or {}, ">="), (max_values or {}, "<=")):
+            for column, value in bounds.items():
+                if column not in columns:
+                    raise ResultsStoreError(f"{table} has no column {column!r}")
+                conditions.append(f'e."{column}" {operator} ?')
+                params.append(value)
+
+        equipment_columns = ", ".join(f'e."{column}"' for column in columns)
+        return self.query(
+            f"SELECT r.document, r.install_date, r.customer, r.well_name, r.api, e.position, {equipment_columns} "
+            f"FROM reports r JOIN {table} e ON e.document = r.document AND e.source = r.source "
+            f"WHERE {' AND '.join(conditions)} ORDER BY r.document, e.position",
+            params,
+        )
+
+    def export_parquet(self, parquet_dir):
+        """
+        Writes every table to <parquet_dir>/<table>.parquet with the store's column types,
+        for columnar analysis in pandas, pyarrow or DuckDB.
+
+        Returns:
+            dict: Table name -> number of rows written.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(parquet_dir, exist_ok=True)
+        tables = {"reports": {
+            "document": "TEXT", "source": "TEXT", **dict(REPORT_COLUMNS.values()),
+            "output": "TEXT", "output_hash": "TEXT", "updated": "REAL",
+        }}
+        for table, columns in EQUIPMENT_TABLES.values():
+            tables[table] = {"document": "TEXT", "source": "TEXT", "position": "INTEGER", **dict(columns.values())}
+
+        arrow_types = {"REAL": pa.float64(), "INTEGER": pa.int64()}
+        written = {}
+        for table, columns in tables.items():
+            schema = pa.schema([(column, arrow_types.get(sql_type, pa.string())) for column, sql_type in columns.items()])
+            selected = ", ".join(f'"{column}"' for column in columns)
+            frame = self.query(f"SELECT {selected} FROM {table}")
+            path = os.path.join(parquet_dir, f"{table}.parquet")
+            # Write to a temporary file first so readers never see a half-written table
+            pq.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False), path + ".tmp")
+            os.replace(path + ".tmp", path)
+            written[table] = len(frame)
+        print(f"Exported {written['reports']} reports in {len(written)} tables to {parquet_dir}")
+        return written
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def _scan_motors(jsonl_path, customer, min_hp):
+    # What answering the question took before the store: parse every record
+    matches = []
+    with open(jsonl_path, "r") as file:
+        for line in file:
+            record = json.loads(line)
+            output = record.get("output") or {}
+            if isinstance(output, str):
+                output = json.loads(output)
+            if (_as_text(output.get("Customer")) or "").lower() != customer.lower():
+                continue
+            for motor in _equipment_items(output.get("Motors")):
+                hp = _as_number(motor.get("HP"))
+                if hp is not None and hp >= min_hp:
+                    matches.append(record.get("document"))
+    return matches
+
+
+def benchmark_fleet_query(store, jsonl_path, customer, min_hp, repeats=5):
+    """
+    Times "motors of at least min_hp for a customer" on the store against parsing the
+    labels JSONL it was ingested from, and checks both give the same motors.
+
+    Returns:
+        dict: Best-of-repeats milliseconds of both and the number of matching motors.
+    """
+    def best_ms(function):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = function()
+            times.append((time.perf_counter() - start) * 1000)
+        return min(times), result
+
+    scan_ms, scanned = best_ms(lambda: _scan_motors(jsonl_path, customer, min_hp))
+    store_ms, found = best_ms(lambda: store.find_equipment("motors", customer=customer, min_values={"hp": min_hp}))
+    if sorted(scanned) != sorted(found["document"]):
+        raise ResultsStoreError(f"Store and JSONL scan disagree: {len(found)} vs {len(scanned)} motors")
+    result = {"motors": len(scanned), "jsonl_scan_ms": scan_ms, "store_ms": store_ms}
+    print(
+        f"Motors >= {min_hp} HP for {customer}: {len(scanned)} found; "
+        f"JSONL scan {scan_ms:.1f} ms, store {store_ms:.1f} ms"
+    )
+    return result
+
+
+if __name__ == "__main__":
+    config = load_config("../configs/config.json")
+    store_config = config.get("results_store", {})
+
+    parser = argparse.ArgumentParser(description="Indexed store of extracted ESP equipment fields")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="Upsert the reports of a labels or predictions JSONL")
+    ingest_parser.add_argument("jsonl_path", nargs="?", default=config["output_jsonl_path"])
+    ingest_parser.add_argument("--source", default="label", help="'label', or the name of the predicting model")
+    subparsers.add_parser("export", help="Write every table to Parquet")
+    query_parser = subparsers.add_parser("query", help="Run a SQL query and print the result")
+    query_parser.add_argument("sql")
+    benchmark_parser = subparsers.add_parser("benchmark", help="Time a fleet query against a JSONL scan")
+    benchmark_parser.add_argument("customer")
+    benchmark_parser.add_argument("--min-hp", type=float, default=200)
+    benchmark_parser.add_argument("--jsonl-path", default=config["output_jsonl_path"])
+    args = parser.parse_args()
+
+    store = ResultsStore(store_config.get("db_path", "../datasets/results_store.sqlite"))
+    try:
+        if args.command == "ingest":
+            store.ingest_jsonl(args.jsonl_path, source=args.source)
+        elif args.command == "export":
+            store.export_parquet(store_config.get("parquet_dir", "../datasets/results_parquet"))
+        elif args.command == "query":
+            print(store.query(args.sql).to_string(index=False))
+        else:
+            benchmark_fleet_query(store, args.jsonl_path, args.customer, args.min_hp)
+    finally:
+        store.close()
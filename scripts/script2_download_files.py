@@ -2,6 +2,7 @@
 
 import json
 from google_drive_file_finder import authenticate_google_drive, download_files_from_list
+from name_reconciliation import load_file_name_mapping
 
 def main(config):
     # Extract configuration parameters
@@ -14,6 +15,10 @@ def main(config):
 
     # Extract file names from the JSONL dataset
     file_names = get_file_names_from_jsonl(jsonl_path)
+
+    # Names resolved by name_reconciliation.py are searched under their Drive name
+    file_name_mapping = load_file_name_mapping(config)
+    file_names = [file_name_mapping.get(name, name) for name in file_names]
     print(f"Extracted file names: {file_names}")
 
     # Download the files from Google Drive
@@ -23,7 +28,8 @@ def main(config):
         file_names=file_names,
         download_folder=download_folder,
         exact_match=True,
-        list_findable=True
+        list_findable=True,
+        dedupe_report_path=config.get("dedupe", {}).get("report_path"),
     )
 
 def get_file_names_from_jsonl(jsonl_path):
@@ -2,11 +2,34 @@
 
 import os
 import json
+import time
 from pdf_extraction import get_text_from_pdf
 from excel_extraction import get_text_from_excel
 from load_config import load_config
+from prompt_templates import compact_record
+from name_reconciliation import load_file_name_mapping
+from content_dedupe import DedupeStats, ExtractionCache, LocalHashIndex, save_dedupe_report
+from extraction_scheduler import ExtractionTask, run_extraction_tasks
+from extraction_cost import ExtractionCostModel, append_timings, write_run_report
 
-def extract_text_and_enrich(jsonl_path, download_folder, output_jsonl, log_missing_files):
+# Part of the extraction cache key: bump it whenever the extractors or text_normalizer change
+# the text they produce, so cached text from older versions is re-extracted instead of reused
+EXTRACTION_VERSION = 3
+
+def extract_file_text(file_name, file_path, ocr_settings=None, page_pool=None):
+    """
+    Extracts the text of one PDF or Excel file; raises ValueError for other file types.
+    ocr_settings (the "ocr" config section) and page_pool are passed on to get_text_from_pdf.
+    """
+    if file_name.lower().endswith(".pdf"):
+        return get_text_from_pdf(file_path, page_pool=page_pool, **(ocr_settings or {}))
+    elif file_name.lower().endswith(".xls") or file_name.lower().endswith(".xlsx"):
+        return get_text_from_excel(file_path)
+    raise ValueError(f"Unsupported file type: {file_name}")
+
+def extract_text_and_enrich(jsonl_path, download_folder, output_jsonl, log_missing_files, file_name_mapping=None,
+                            extraction_cache_dir=None, dedupe_report_path=None, ocr_settings=None,
+                            scheduler_settings=None):
     """
     Extracts text from files listed in the JSONL dataset and enriches the dataset with the extracted text.
 
@@ -15,6 +38,17 @@ def extract_text_and_enrich(jsonl_path, download_folder, output_jsonl, log_missi
         download_folder (str): Directory containing the downloaded files.
         output_jsonl (str): Path to save the enriched JSONL file.
         log_missing_files (str): Path to save the list of missing files.
+        file_name_mapping (dict): Optional document name -> downloaded file name, from
+            name_reconciliation.py. Records keep their original document name.
+        extraction_cache_dir (str): Optional directory of extracted text by content hash.
+            Files with identical content are extracted once, also across runs.
+        dedupe_report_path (str): Optional path of the JSON report of reused extractions.
+        ocr_settings (dict): OCR mode and resolutions for PDFs, see get_text_from_pdf.
+        scheduler_settings (dict): Worker count and memory budget for extraction
+            ("extraction" config section), see run_extraction_tasks. With timings_path
+            set, the largest documents are extracted first, ordered by a cost model
+            fitted on earlier runs, and this run's timings are added to it; with
+            run_report_path set, predicted and actual costs are written there.
 
     Returns:
         None: Saves the enriched dataset to a JSONL file and logs missing files.
@@ -24,14 +58,25 @@ def extract_text_and_enrich(jsonl_path, download_folder, output_jsonl, log_missi
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
         
+    # Records carry a prompt template id; older inline instructions are swapped for theirs
     with open(jsonl_path, "r") as file:
-        dataset = [json.loads(line) for line in file]
+        dataset = [compact_record(json.loads(line)) for line in file]
 
     enriched_data = []
     missing_files = []
+    file_name_mapping = file_name_mapping or {}
+
+    # Text is shared between files with the same content (MD5), within this run and through the cache
+    local_hashes = LocalHashIndex(download_folder)
+    cache = ExtractionCache(extraction_cache_dir) if extraction_cache_dir else None
+    extracted = {}
+    stats = DedupeStats("extraction")
 
+    # First pass: reuse cached text and collect each distinct content that still needs extracting
+    tasks = {}
+    waiting = []
     for record in dataset:
-        file_name = record["document"]
+        file_name = file_name_mapping.get(record["document"], record["document"])
         file_path = os.path.join(download_folder, file_name)
 
         # Check if the file exists
@@ -43,23 +88,69 @@ def extract_text_and_enrich(jsonl_path, download_folder, output_jsonl, log_missi
             enriched_data.append(record)
             continue
 
-        # Extract text based on file type
-        text = ""
-        try:
-            if file_name.endswith(".pdf"):
-                text = get_text_from_pdf(file_path)
-            elif file_name.endswith(".xls") or file_name.endswith(".xlsx"):
-                text = get_text_from_excel(file_path)
+        content_hash = local_hashes.hash(file_name)
+        # Text from the ROI OCR mode differs from full-page OCR, and text from older extractor
+        # versions from the current one, so each is cached separately
+        ocr_mode = (ocr_settings or {}).get("ocr_mode", "full")
+        content_hash = f"{content_hash}-{ocr_mode}-v{EXTRACTION_VERSION}"
+        stats.files += 1
+        stats.unique_contents.add(content_hash)
+        entry = cache.get(content_hash) if cache else None
+        if entry is not None:
+            if entry["file_name"] == file_name:
+                stats.add_cache_hit(entry["seconds"])
             else:
-                raise ValueError(f"Unsupported file type: {file_name}")
-        except Exception as e:
-            print(f"Error extracting text from {file_name}: {e}")
-            text = f"Error extracting text: {e}"
+                print(f"{file_name} has the same content as {entry['file_name']}, reusing its text")
+                stats.add_alias(entry["file_name"], file_name, size=os.path.getsize(file_path), seconds=entry["seconds"])
+            record["text"] = entry["text"]
+            enriched_data.append(record)
+            continue
 
-        # Add extracted text to record
-        record["text"] = text
+        if content_hash not in tasks:
+            tasks[content_hash] = ExtractionTask(content_hash, file_name, file_path)
+        waiting.append((record, content_hash, file_name, file_path))
         enriched_data.append(record)
 
+    # Second pass: extract every distinct content once, in parallel when configured
+    scheduler_settings = scheduler_settings or {}
+    ocr_mode = (ocr_settings or {}).get("ocr_mode", "full")
+    timings_path = scheduler_settings.get("timings_path")
+    cost_model = ExtractionCostModel.from_timings_file(timings_path, ocr_mode) if timings_path else None
+    results = []
+    start = time.perf_counter()
+    for result in run_extraction_tasks(
+        list(tasks.values()),
+        ocr_settings=ocr_settings,
+        num_workers=scheduler_settings.get("num_workers", 1),
+        memory_budget_mb=scheduler_settings.get("memory_budget_mb"),
+        max_tasks_per_child=scheduler_settings.get("max_tasks_per_child"),
+        cost_model=cost_model,
+    ):
+        results.append(result)
+        task = tasks[result["key"]]
+        if result["error"] is not None:
+            print(f"Error extracting text from {task.file_name}: {result['error']}")
+            extracted[result["key"]] = {"text": f"Error extracting text: {result['error']}", "seconds": 0, "file_name": task.file_name}
+            continue
+        entry = {"text": result["text"], "seconds": result["seconds"], "file_name": task.file_name}
+        extracted[result["key"]] = entry
+        if cache:
+            cache.put(result["key"], **entry)
+
+    if results and timings_path:
+        append_timings(timings_path, tasks, results, ocr_mode)
+    if results and scheduler_settings.get("run_report_path"):
+        write_run_report(scheduler_settings["run_report_path"], tasks, results, time.perf_counter() - start,
+                         scheduler_settings.get("num_workers", 1))
+
+    # Add extracted text to records; aliases of the same content share it
+    for record, content_hash, file_name, file_path in waiting:
+        entry = extracted[content_hash]
+        if entry["file_name"] != file_name:
+            print(f"{file_name} has the same content as {entry['file_name']}, reusing its text")
+            stats.add_alias(entry["file_name"], file_name, size=os.path.getsize(file_path), seconds=entry["seconds"])
+        record["text"] = entry["text"]
+
     # Save enriched dataset
     with open(output_jsonl, "w") as output_file:
         for entry in enriched_data:
@@ -67,6 +158,10 @@ def extract_text_and_enrich(jsonl_path, download_folder, output_jsonl, log_missi
 
     print(f"Enriched JSONL saved at {output_jsonl}")
 
+    local_hashes.save()
+    if dedupe_report_path:
+        save_dedupe_report(stats, dedupe_report_path)
+
     # Save missing files log
     if missing_files:
         with open(log_missing_files, "w") as log_file:
@@ -88,6 +183,11 @@ def main(config):
         download_folder=DOWNLOAD_FOLDER,
         output_jsonl=OUTPUT_JSONL_PATH,
         log_missing_files=LOG_MISSING_FILES,
+        file_name_mapping=load_file_name_mapping(config),
+        extraction_cache_dir=config.get("dedupe", {}).get("extraction_cache_dir"),
+        dedupe_report_path=config.get("dedupe", {}).get("report_path"),
+        ocr_settings=config.get("ocr"),
+        scheduler_settings=config.get("extraction"),
     )
 
 if __name__ == "__main__":
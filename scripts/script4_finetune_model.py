@@ -1,25 +1,20 @@
 ## script4_finetune_model.py
 
 import os
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, Seq2SeqTrainer, Seq2SeqTrainingArguments
-from datasets import Dataset
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, Seq2SeqTrainer, Seq2SeqTrainingArguments, DataCollatorForSeq2Seq
+from finetune_preprocess import build_tokenized_datasets
+from sequence_packing import PackedSeq2SeqCollator, enable_packed_attention
+from cpu_training import configure_cpu_threads, cpu_training_arguments
+from lora_utils import apply_lora, export_lora_model
+from checkpointing import AsyncCheckpointCallback, resolve_resume_checkpoint
 import torch
 
-def preprocess_data(examples, tokenizer, max_input_length=512, max_output_length=512):
-    inputs = tokenizer(
-        examples["input"], max_length=max_input_length, truncation=True, padding="max_length"
-    )
-    labels = tokenizer(
-        examples["output"], max_length = max_output_length, truncation=True, padding="max_length"
-    )
-    input["labels"] = labels["input_ids"]
-    return inputs
-
-def fine_tune_model(config):
+def build_trainer(config, **training_overrides):
     """
-    Fine-tunes a pre-trained Hugging Face model using the dataset in JSONL format
-    :param config:
-    :return:
+    Loads the model, tokenizer and tokenized dataset and builds the Seq2SeqTrainer
+    :param config: pipeline configuration
+    :param training_overrides: extra Seq2SeqTrainingArguments that replace the configured ones
+    :return: the trainer
     """
     # Load configuration
     dataset_path = config["fine_tune"]["dataset_path"]
@@ -34,27 +29,47 @@ def fine_tune_model(config):
     num_epochs = config["fine_tune"].get("num_epochs", 3)
     batch_size = config["fine_tune"].get("batch_size", 8)
     learning_rate = config["fine_tune"].get("learning_rate", 5e-5)
+    dataset_mode = config["fine_tune"].get("dataset_mode", "truncate")
+    profile = config["fine_tune"].get("profile", "default")
+    lora_config = config["fine_tune"].get("lora", {})
+    checkpoint_config = config["fine_tune"].get("checkpointing", {})
+    async_checkpoints = checkpoint_config.get("async", False)
 
     # Check available hardware
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if profile == "cpu":
+        cpu_profile = config["fine_tune"].get("cpu_profile", {})
+        intra_op_threads, inter_op_threads = configure_cpu_threads(
+            cpu_profile.get("intra_op_threads"), cpu_profile.get("inter_op_threads")
+        )
+        print(f"Using {intra_op_threads} intra-op and {inter_op_threads} inter-op CPU threads")
+        device = torch.device("cpu")
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
 
-    # Load dataset
-    dataset = Dataset.from_json(dataset_path)
-    dataset = dataset.train_test_split(test_size=0.1)
-    train_dataset = dataset["train"]
-    val_dataset = dataset["test"]
-
     # Load tokenizer and model
     tokenizer = AutoTokenizer.from_pretrained(model_name)
     model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(device)
 
-    # Preprocess datasets
-    train_dataset = train_dataset.map(lambda x: preprocess_data(x, tokenizer), batched=True)
-    val_dataset = val_dataset.map(lambda x: preprocess_data(x, tokenizer), batched=True)
+    # Load the tokenized splits (cached on disk, keyed by dataset, tokenizer and max lengths)
+    dataset = build_tokenized_datasets(config, tokenizer, decoder_start_token_id=model.config.decoder_start_token_id)
+    train_dataset = dataset["train"]
+    val_dataset = dataset["test"]
+
+    # Train low-rank adapters instead of every weight; checkpoints then only hold the adapter
+    if lora_config.get("enabled", False):
+        model = apply_lora(model, lora_config)
+
+    # Pad each batch dynamically; padded label positions are ignored by the loss
+    if dataset_mode == "pack":
+        # Packed rows carry segment ids that keep the packed examples from attending to each other
+        enable_packed_attention(model)
+        data_collator = PackedSeq2SeqCollator(tokenizer, model=model)
+    else:
+        data_collator = DataCollatorForSeq2Seq(tokenizer, model=model)
 
     # Define training arguments
-    training_args = Seq2SeqTrainingArguments(
+    training_kwargs = dict(
         output_dir=output_dir,
         evaluation_strategy="steps",
         save_strategy="steps",
@@ -66,7 +81,22 @@ def fine_tune_model(config):
         predict_with_generate=True,
         fp16=torch.cuda.is_available(),
         save_total_limit=3,
+        # The segment id columns of packed rows are not model arguments and must reach the collator
+        remove_unused_columns=dataset_mode != "pack",
     )
+    if async_checkpoints:
+        # Checkpoints are written by AsyncCheckpointCallback instead of the Trainer
+        training_kwargs["save_strategy"] = "no"
+    if profile == "cpu":
+        training_kwargs.update(cpu_training_arguments(
+            cpu_profile,
+            model,
+            batch_size,
+            config["fine_tune"].get("max_input_length", 512),
+            config["fine_tune"].get("max_output_length", 512),
+        ))
+    training_kwargs.update(training_overrides)
+    training_args = Seq2SeqTrainingArguments(**training_kwargs)
 
     # Initialize the trainer
     trainer = Seq2SeqTrainer(
@@ -75,17 +105,46 @@ def fine_tune_model(config):
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
         tokenizer=tokenizer,
+        data_collator=data_collator,
+    )
+    if async_checkpoints:
+        trainer.add_callback(AsyncCheckpointCallback(
+            output_dir,
+            save_steps=checkpoint_config.get("save_steps", 500),
+            save_every_minutes=checkpoint_config.get("save_every_minutes"),
+            optimizer_state=checkpoint_config.get("optimizer_state", "full"),
+            optimizer_shards=checkpoint_config.get("optimizer_shards", 4),
+            save_total_limit=checkpoint_config.get("save_total_limit", 3),
+        ))
+    return trainer
+
+def fine_tune_model(config):
+    """
+    Fine-tunes a pre-trained Hugging Face model using the dataset in JSONL format
+    :param config:
+    :return:
+    """
+    output_dir = config["fine_tune"]["output_dir"]
+    trainer = build_trainer(config)
+    model = trainer.model
+    tokenizer = trainer.processing_class
+
+    resume_from_checkpoint = resolve_resume_checkpoint(
+        config["fine_tune"].get("checkpointing", {}).get("resume_from_checkpoint"), output_dir
     )
 
     # Fine-tune the model
     print("Starting fine-tuning...")
-    trainer.train()
+    trainer.train(resume_from_checkpoint=resume_from_checkpoint)
 
     # Save the fine-tuned model
     print("Saving fine-tuned model...")
-    model.save_pretrained(output_dir)
-    tokenizer.save_pretrained(output_dir)
-    tokenizer.save_pretrained(output_dir)
+    if config["fine_tune"].get("lora", {}).get("enabled", False):
+        adapter_dir = export_lora_model(model, tokenizer, output_dir)
+        print(f"LoRA adapter saved to {adapter_dir}")
+    else:
+        model.save_pretrained(output_dir)
+        tokenizer.save_pretrained(output_dir)
 
     print(f"Model saved to {output_dir}")
 
@@ -97,4 +156,3 @@ def main(config):
     """
 
     fine_tune_model(config)
-
@@ -0,0 +1,107 @@
+## script5_batch_inference.py
+
+import argparse
+import json
+import os
+import torch
+from inference_utils import load_model, run_batch_inference, benchmark_inference
+from onnx_backend import load_onnx_model
+from load_config import load_config
+
+def read_jsonl(jsonl_path):
+    """
+    Lazily reads records from a JSONL file.
+
+    Args:
+        jsonl_path (str): Path to the JSONL file.
+
+    Yields:
+        dict: One record per line.
+    """
+    with open(jsonl_path, "r") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def batch_inference(config, input_jsonl, output_jsonl, quantize=None, decoding="free", backend="torch"):
+    """
+    Runs the fine-tuned model over a JSONL of documents and streams the predictions to a
+    JSONL file, one line per document as soon as its batch is done.
+
+    Args:
+        config (dict): Pipeline configuration. Uses the "inference" section.
+        input_jsonl (str): JSONL with a "text" (and optionally "document") per record,
+            such as the enriched dataset.
+        output_jsonl (str): Path to write the predictions to.
+        quantize (str): "int8" for dynamic int8 quantization, None for fp32.
+        decoding (str): "free" or "constrained" (schema-constrained, values only).
+        backend (str): "torch" runs the model with PyTorch; "onnx" runs the export in
+            inference.onnx_dir with ONNX Runtime (see onnx_backend.py; "free" decoding only).
+
+    Returns:
+        None: Writes the predictions to output_jsonl.
+    """
+    inference_config = config["inference"]
+    if inference_config.get("num_threads"):
+        torch.set_num_threads(inference_config["num_threads"])
+
+    if backend == "onnx":
+        if decoding != "free":
+            raise ValueError("Constrained decoding drives the PyTorch decoder cache; use the torch backend")
+        model, tokenizer = load_onnx_model(inference_config["onnx_dir"], num_threads=inference_config.get("num_threads"))
+    else:
+        model, tokenizer = load_model(inference_config["model_dir"], quantize=quantize)
+
+    count = 0
+    with open(output_jsonl, "w") as output_file:
+        for prediction in run_batch_inference(
+            model,
+            tokenizer,
+            read_jsonl(input_jsonl),
+            batch_size=inference_config.get("batch_size", 8),
+            max_input_length=inference_config.get("max_input_length", 512),
+            max_new_tokens=inference_config.get("max_new_tokens", 512),
+            decoding=decoding,
+            input_mode=inference_config.get("input_mode", "truncate"),
+        ):
+            output_file.write(json.dumps(prediction) + "\n")
+            output_file.flush()
+            count += 1
+
+    print(f"Predictions for {count} documents saved at {output_jsonl}")
+
+def main(config):
+    parser = argparse.ArgumentParser(description="Batch extraction of ESP install report fields")
+    parser.add_argument("input_jsonl", help="JSONL of documents with a 'text' field")
+    parser.add_argument("output_jsonl", nargs="?", default="predictions.jsonl", help="Where to write predictions")
+    parser.add_argument("--quantize", choices=["int8", "none"], default=config["inference"].get("quantize") or "none",
+                        help="Dynamic int8 quantization for CPU, or none to run the fp32 weights")
+    parser.add_argument("--decoding", choices=["free", "constrained"],
+                        default=config["inference"].get("decoding", "free"),
+                        help="Generate the whole JSON, or only the field values of the output schema")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=config["inference"].get("backend", "torch"),
+                        help="Run with PyTorch, or the ONNX Runtime export in inference.onnx_dir")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare fp32, int8 and ONNX throughput and latency instead of writing predictions")
+    args = parser.parse_args()
+    quantize = None if args.quantize == "none" else args.quantize
+
+    if args.benchmark:
+        inference_config = config["inference"]
+        benchmark_inference(
+            inference_config["model_dir"],
+            list(read_jsonl(args.input_jsonl)),
+            batch_size=inference_config.get("batch_size", 8),
+            max_input_length=inference_config.get("max_input_length", 512),
+            max_new_tokens=inference_config.get("max_new_tokens", 512),
+            decoding=args.decoding,
+            input_mode=inference_config.get("input_mode", "truncate"),
+            onnx_dir=inference_config.get("onnx_dir") if os.path.isdir(inference_config.get("onnx_dir") or "") else None,
+        )
+    else:
+        batch_inference(config, args.input_jsonl, args.output_jsonl, quantize=quantize, decoding=args.decoding,
+                        backend=args.backend)
+
+if __name__ == "__main__":
+    config = load_config("../configs/config.json")
+    main(config)
@@ -0,0 +1,215 @@
+## sequence_packing.py
+
+import torch
+from datasets import Dataset
+from transformers import DataCollatorForSeq2Seq
+
+# Columns added to packed rows; segment 0 marks padding
+SEGMENT_COLUMNS = ("input_segment_ids", "label_segment_ids")
+
+
+def packing_utilization(dataset, max_input_length):
+    """
+    Fraction of the input token budget that holds real tokens, assuming one row per window.
+    """
+    if len(dataset) == 0:
+        return 0.0
+    total_tokens = sum(len(input_ids) for input_ids in dataset["input_ids"])
+    return total_tokens / (len(dataset) * max_input_length)
+
+
+def pack_examples(input_lengths, label_lengths, max_input_length, max_output_length):
+    """
+    Groups examples into bins whose inputs and labels both fit in one window (first-fit
+    decreasing on the input length).
+
+    Args:
+        input_lengths (list): Number of input tokens of each example.
+        label_lengths (list): Number of label tokens of each example.
+        max_input_length (int): Input token budget of a packed row.
+        max_output_length (int): Label token budget of a packed row.
+
+    Returns:
+        list: One list of example indices per packed row.
+    """
+    bins = []
+    bin_space = []
+    order = sorted(range(len(input_lengths)), key=lambda index: input_lengths[index], reverse=True)
+    for index in order:
+        input_length = min(input_lengths[index], max_input_length)
+        label_length = min(label_lengths[index], max_output_length)
+        for bin_index, (input_space, label_space) in enumerate(bin_space):
+            if input_length <= input_space and label_length <= label_space:
+                bins[bin_index].append(index)
+                bin_space[bin_index] = (input_space - input_length, label_space - label_length)
+                break
+        else:
+            bins.append([index])
+            bin_space.append((max_input_length - input_length, max_output_length - label_length))
+    return bins
+
+
+def pack_dataset(dataset, max_input_length, max_output_length, decoder_start_token_id):
+    """
+    Packs a tokenized seq2seq dataset so several short examples share one row.
+
+    Each packed row concatenates the inputs and labels of its examples and records which
+    example every token belongs to in "input_segment_ids"/"label_segment_ids". The decoder
+    inputs are shifted per example so every target starts from the decoder start token.
+    Use PackedSeq2SeqCollator and enable_packed_attention so examples cannot attend to
+    each other during training.
+
+    Args:
+        dataset (Dataset): Tokenized dataset with "input_ids" and "labels".
+        max_input_length (int): Input token budget of a packed row.
+        max_output_length (int): Label token budget of a packed row.
+        decoder_start_token_id (int): Token the decoder starts every target with.
+
+    Returns:
+        Dataset: Packed dataset.
+    """
+    all_input_ids = dataset["input_ids"]
+    all_labels = dataset["labels"]
+    bins = pack_examples(
+        [len(input_ids) for input_ids in all_input_ids],
+        [len(labels) for labels in all_labels],
+        max_input_length,
+        max_output_length,
+    )
+
+    packed = {
+        "input_ids": [], "attention_mask": [], "labels": [], "decoder_input_ids": [],
+        "input_segment_ids": [], "label_segment_ids": [],
+    }
+    for example_indices in bins:
+        row = {key: [] for key in packed}
+        for segment, index in enumerate(example_indices, start=1):
+            input_ids = all_input_ids[index][:max_input_length]
+            labels = all_labels[index][:max_output_length]
+            row["input_ids"].extend(input_ids)
+            row["input_segment_ids"].extend([segment] * len(input_ids))
+            row["labels"].extend(labels)
+            row["decoder_input_ids"].extend([decoder_start_token_id] + labels[:-1])
+            row["label_segment_ids"].extend([segment] * len(labels))
+        row["attention_mask"] = [1] * len(row["input_ids"])
+        for key, values in row.items():
+            packed[key].append(values)
+
+    return Dataset.from_dict(packed)
+
+
+class PackedSeq2SeqCollator:
+    """
+    Pads packed rows (and their segment ids) into a batch. Batches of unpacked examples,
+    such as the evaluation split, are passed to DataCollatorForSeq2Seq unchanged.
+    """
+
+    def __init__(self, tokenizer, model=None, label_pad_token_id=-100):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.label_pad_token_id = label_pad_token_id
+        self.default_collator = DataCollatorForSeq2Seq(tokenizer, model=model, label_pad_token_id=label_pad_token_id)
+
+    def __call__(self, features):
+        if "input_segment_ids" not in features[0]:
+            return self.default_collator(features)
+
+        pad_values = {
+            "input_ids": self.pad_token_id,
+            "attention_mask": 0,
+            "labels": self.label_pad_token_id,
+            "decoder_input_ids": self.pad_token_id,
+            "input_segment_ids": 0,
+            "label_segment_ids": 0,
+        }
+        batch = {}
+        for key, pad_value in pad_values.items():
+            length = max(len(feature[key]) for feature in features)
+            batch[key] = torch.tensor(
+                [list(feature[key]) + [pad_value] * (length - len(feature[key])) for feature in features],
+                dtype=torch.long,
+            )
+        return batch
+
+
+def _segment_mask(query_segments, key_segments, dtype, causal=False):
+    """
+    Additive attention mask that only lets tokens attend within their own segment.
+
+    Returns:
+        torch.Tensor: Mask of shape (batch, 1, query_length, key_length).
+    """
+    allowed = query_segments[:, :, None] == key_segments[:, None, :]
+    if causal:
+        length = query_segments.shape[1]
+        allowed = allowed & torch.ones(length, length, dtype=torch.bool, device=allowed.device).tril()
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=allowed.device)
+    mask = mask.masked_fill(~allowed, torch.finfo(dtype).min)
+    return mask[:, None, :, :]
+
+
+def enable_packed_attention(model):
+    """
+    Makes a T5-style model respect segment ids so packed examples attend only to
+    themselves.
+
+    The model's forward accepts "input_segment_ids" and "label_segment_ids" from the
+    PackedSeq2SeqCollator. Block-diagonal masks built from them replace the masks of the
+    first encoder self-attention, decoder self-attention and cross-attention layers; T5
+    carries those masks to every later layer through the shared position bias. Because T5
+    only uses relative positions, each packed example sees exactly the same attention
+    pattern as it would on its own. Calls without segment ids are left unchanged.
+
+    The masks only live for the duration of one forward pass, so this cannot be combined
+    with gradient checkpointing (which re-runs the layers during the backward pass).
+
+    Args:
+        model: T5ForConditionalGeneration (or a compatible model such as mT5), optionally
+            wrapped in a peft model.
+
+    Returns:
+        list: Hook handles, which can be removed to restore the original behaviour.
+    """
+    # peft wrappers call the wrapped model's forward directly, so the segment ids are taken
+    # from the outer model while the masks are applied inside the wrapped one
+    base_model = model.get_base_model() if hasattr(model, "get_base_model") else model
+    if base_model.config.model_type not in ("t5", "mt5"):
+        raise ValueError(f"Packed attention is not supported for model type {base_model.config.model_type}")
+
+    segments = {}
+
+    def capture_segments(module, args, kwargs):
+        segments.clear()
+        for column in SEGMENT_COLUMNS:
+            if column in kwargs:
+                segments[column] = kwargs.pop(column)
+        return args, kwargs
+
+    def release_segments(module, args, kwargs, output):
+        segments.clear()
+
+    def mask_hook(query_column, key_column, causal):
+        def hook(module, args, kwargs):
+            if not segments:
+                return None
+            hidden_states = args[0] if args else kwargs["hidden_states"]
+            kwargs["mask"] = _segment_mask(
+                segments[query_column], segments[key_column], hidden_states.dtype, causal=causal
+            )
+            return args, kwargs
+        return hook
+
+    first_encoder_layer = base_model.encoder.block[0].layer
+    first_decoder_layer = base_model.decoder.block[0].layer
+    return [
+        model.register_forward_pre_hook(capture_segments, with_kwargs=True),
+        model.register_forward_hook(release_segments, with_kwargs=True),
+        first_encoder_layer[0].SelfAttention.register_forward_pre_hook(
+            mask_hook("input_segment_ids", "input_segment_ids", causal=False), with_kwargs=True
+        ),
+        first_decoder_layer[0].SelfAttention.register_forward_pre_hook(
+            mask_hook("label_segment_ids", "label_segment_ids", causal=True), with_kwargs=True
+        ),
+        first_decoder_layer[1].EncDecAttention.register_forward_pre_hook(
+            mask_hook("label_segment_ids", "input_segment_ids", causal=False), with_kwargs=True
+        ),
+    ]
@@ -0,0 +1,244 @@
+## text_normalizer.py
+
+import re
+import time
+from collections import Counter
+
+# Marker get_text_from_pdf puts between the pdfminer text layer and the OCR text
+OCR_MARKER = "OCR TEXT:"
+PAGE_BREAK = "\f"
+
+# Placeholders pandas writes for empty header and data cells
+PLACEHOLDER_PATTERN = re.compile(r"\bUnnamed: ?\d+\b|\bNaN\b")
+WORD_CHAR = re.compile(r"\w")
+# Page numbers are the only part of a running header or footer that changes per page
+PAGE_NUMBER = re.compile(r"\bpage\s*\d+(\s*(of|/)\s*\d+)?\b")
+BARE_NUMBER = re.compile(r"^[\s\-\u2013|]*\d+[\s\-\u2013|]*$")
+
+# A line is a running header or footer when it is among the first or last
+# HEADER_FOOTER_LINES lines of at least HEADER_FOOTER_SHARE of the pages (page numbers
+# masked, everything else compared exactly), in a document of at least
+# MIN_PAGES_FOR_HEADERS pages
+HEADER_FOOTER_LINES = 2
+HEADER_FOOTER_SHARE = 0.5
+MIN_PAGES_FOR_HEADERS = 3
+
+
+def _normalize_page(page, placeholders, dehyphenate):
+    """
+    Cleans the lines of one page: whitespace runs become one space, placeholders and
+    lines without any letter or digit (OCR specks, rules) are dropped, consecutive
+    blank lines become one, and a word hyphenated at a line end is joined.
+
+    Returns:
+        list: The lines of the page, without leading or trailing blank lines.
+    """
+    lines = []
+    for line in page.splitlines():
+        if placeholders and ("NaN" in line or "Unnamed" in line):
+            line = PLACEHOLDER_PATTERN.sub(" ", line)
+        line = " ".join(line.split())
+        if not line or not WORD_CHAR.search(line):
+            if lines and lines[-1]:
+                lines.append("")
+            continue
+        if dehyphenate and lines and line[0].islower():
+            previous = lines[-1]
+            if len(previous) > 1 and previous[-1] == "-" and previous[-2].isalpha():
+                lines[-1] = previous[:-1] + line
+                continue
+        lines.append(line)
+    if lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _line_key(line):
+    """
+    Key under which repeats of a line are counted: the lowercase line with "Page 3 of
+    12" style page numbers masked, or "#" for a line that is only a page number. Other
+    digits are kept, so "Motor HP 225" and "Motor HP 250" are different lines.
+    """
+    if BARE_NUMBER.match(line):
+        return "#"
+    return PAGE_NUMBER.sub("page #", line.lower())
+
+
+def _edge_lines(lines):
+    return lines[:HEADER_FOOTER_LINES] + lines[-HEADER_FOOTER_LINES:]
+
+
+def _repeated_edge_lines(pages):
+    """
+    Keys (see _line_key) of the lines that repeat at the top or bottom of most pages.
+    """
+    if len(pages) < MIN_PAGES_FOR_HEADERS:
+        return set()
+    counts = Counter()
+    for lines in pages:
+        counts.update({_line_key(line) for line in _edge_lines([line for line in lines if line])})
+    threshold = max(2, HEADER_FOOTER_SHARE * len(pages))
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def normalize_text(text, placeholders=True, dehyphenate=True, strip_headers=True):
+    """
+    Normalizes extracted text in one pass over its lines, keeping its structure: one
+    line per text line or table row, blank lines between blocks and form feeds between
+    pages, which input_builder uses to split sections.
+
+    Args:
+        text (str): Extracted text; pages separated by form feeds as pdfminer and
+            Tesseract write them.
+        placeholders (bool): Drop pandas' "Unnamed: N" and "NaN" cells.
+        dehyphenate (bool): Join words hyphenated at a line end ("pro-" + "duction").
+        strip_headers (bool): Drop running headers and footers, e.g. report titles and
+            "Page 3 of 12" lines repeated on most pages.
+
+    Returns:
+        str: The normalized text.
+
+    Only the page number may differ between repeats of a header, so values that sit at
+    the edge of every page are kept:
+
+    >>> pages = [f"ACME Install Report\\nRun notes for day {day}\\nMotor HP {hp}\\nPage {day} of 4"
+    ...          for day, hp in zip(range(1, 5), (225, 250, 275, 300))]
+    >>> normalize_text("\\f".join(pages)).split("\\f")[1]
+    'Run notes for day 2\\nMotor HP 250'
+
+    Repeats are only stripped after the page they first appear on, and never when they
+    are all a page holds, so repeated forms and repeated values are kept:
+
+    >>> form = "WELL TEST FORM\\nPump: 120 stages\\nMotor: 200 HP"
+    >>> normalize_text("\\f".join([form] * 3)) == "\\f".join([form] * 3)
+    True
+    >>> pages = ["Customer Chord\\nWell A 1\\nHP 200", "Daily notes\\nPump started", "Customer Chord\\nWell A 1\\nHP 200"]
+    >>> normalize_text("\\f".join(pages)).split("\\f")[0]
+    'Customer Chord\\nWell A 1\\nHP 200'
+    """
+    pages = [_normalize_page(page, placeholders, dehyphenate) for page in text.split(PAGE_BREAK)]
+    repeated = _repeated_edge_lines(pages) if strip_headers else set()
+
+    kept_pages = []
+    seen = set()
+    for lines in pages:
+        if repeated:
+            edges = set(_edge_lines([number for number, line in enumerate(lines) if line]))
+            edge_keys = {number: _line_key(lines[number]) for number in edges}
+            # The first page a header or footer appears on keeps it
+            stripped = [
+                line for number, line in enumerate(lines)
+                if number not in edges or edge_keys[number] not in repeated or edge_keys[number] not in seen
+            ]
+            seen.update(key for key in edge_keys.values() if key in repeated)
+            # A page made only of repeated lines is a repeated form, not headers: keep it whole
+            if any(stripped):
+                lines = stripped
+            while lines and not lines[0]:
+                lines.pop(0)
+            while lines and not lines[-1]:
+                lines.pop()
+        if lines:
+            kept_pages.append("\n".join(lines))
+    return PAGE_BREAK.join(kept_pages)
+
+
+def normalize_report_text(text, **options):
+    """
+    Normalizes the text layer and the OCR part of get_text_from_pdf output separately,
+    so each part's page headers are counted against its own pages; other text goes
+    through normalize_text as a whole.
+    """
+    marker = f"\n{OCR_MARKER}\n"
+    if marker not in text:
+        return normalize_text(text, **options)
+    text_layer, ocr_text = text.split(marker, 1)
+    return normalize_text(text_layer, **options) + marker + normalize_text(ocr_text, **options)
+
+
+def join_region_texts(region_texts):
+    """
+    Joins the OCR text of the regions of one page into the text of that page.
+
+    Tesseract ends the text of every image with a form feed; kept, each region of a
+    page would count as a page of its own and repeated labels ("Serial No:") as running
+    headers.
+    """
+    return "\n".join(text.rstrip(PAGE_BREAK) for text in region_texts) + PAGE_BREAK
+
+
+def _five_pass_preprocess(text):
+    # The regex passes preprocess_text made before this module, kept as the benchmark baseline
+    text = re.sub(r'\bUnnamed\b.*?:?', '', text)
+    text = re.sub(r'\bNaN\b', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'^\s+|\s+$', '', text, flags=re.MULTILINE)
+    return "\n".join(line for line in text.splitlines() if line.strip())
+
+
+def benchmark_normalizer(texts, tokenizer=None, repeats=3):
+    """
+    Times normalize_report_text against the old five-pass preprocess_text on the same
+    texts and counts tokens per document before and after normalizing.
+
+    Args:
+        texts (list): Extracted document texts.
+        tokenizer: Optional Hugging Face tokenizer; without it words and punctuation
+            marks are counted.
+        repeats (int): Timing repetitions; the fastest is kept.
+
+    Returns:
+        dict: MB/s of both, and mean tokens per document raw and normalized.
+    """
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+
+    def best_seconds(function):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for text in texts:
+                function(text)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def tokens(text):
+        if tokenizer is not None:
+            return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+        return len(re.findall(r"\w+|[^\w\s]", text))
+
+    five_pass_seconds = best_seconds(_five_pass_preprocess)
+    normalizer_seconds = best_seconds(normalize_report_text)
+    raw_tokens = sum(tokens(text) for text in texts) / max(1, len(texts))
+    normalized_tokens = sum(tokens(normalize_report_text(text)) for text in texts) / max(1, len(texts))
+    summary = {
+        "megabytes": round(megabytes, 2),
+        "five_pass_mb_per_second": round(megabytes / max(1e-9, five_pass_seconds), 1),
+        "normalizer_mb_per_second": round(megabytes / max(1e-9, normalizer_seconds), 1),
+        "raw_tokens_per_document": round(raw_tokens, 1),
+        "normalized_tokens_per_document": round(normalized_tokens, 1),
+    }
+    print(
+        f"{len(texts)} documents, {megabytes:.1f} MB: five-pass preprocess {summary['five_pass_mb_per_second']} MB/s, "
+        f"normalizer {summary['normalizer_mb_per_second']} MB/s; tokens per document "
+        f"{raw_tokens:.0f} -> {normalized_tokens:.0f} ({1 - normalized_tokens / max(1, raw_tokens):.1%} fewer)"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    from load_config import load_config
+
+    config = load_config("../configs/config.json")
+    dataset_path = sys.argv[1] if len(sys.argv) > 1 else config["enriched_jsonl_path"]
+    with open(dataset_path, "r") as dataset_file:
+        documents = [json.loads(line).get("text", "") for line in dataset_file]
+    try:
+        from transformers import AutoTokenizer
+
+        report_tokenizer = AutoTokenizer.from_pretrained(config["fine_tune"]["model_name"])
+    except Exception as e:
+        print(f"Counting words instead of model tokens ({e})")
+        report_tokenizer = None
+    benchmark_normalizer([document for document in documents if document], report_tokenizer)